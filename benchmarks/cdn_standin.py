@@ -0,0 +1,410 @@
+"""
+本地 CDN 替身
+提供合成的加密 MP4（用 crypto/decryptor 的密钥流加密开头 ENCRYPTED_LENGTH 字节，与视频号相同）和 HLS 播放列表，
+可以设置每个请求的延迟（模拟 RTT）、每个连接的带宽、是否支持 Range、随机错误 / 断连和 token 过期，
+供端到端回放（benchmarks.e2e_replay）和下载器测试复用
+
+地址格式:
+    /stodownload?encfilekey=<名称>&token=<签发时间戳毫秒>   MP4，token 超过有效期返回 403
+    /hls/<名称>/index.m3u8?token=<签发时间戳毫秒>           HLS 播放列表，片段为 /hls/<名称>/seg_000.ts
+
+用法: python -m benchmarks.cdn_standin [--port 18081] [--count 4] [--size 4] [--latency 20] [--bandwidth 2048]
+"""
+import argparse
+import hashlib
+import random
+import socket
+import ssl
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from crypto.decryptor import ENCRYPTED_LENGTH, decrypt
+
+MB = 1024 * 1024
+TS_PACKET = 188
+WRITE_BLOCK = 64 * 1024
+
+
+@dataclass
+class Media:
+    """一个合成媒体：body 为 CDN 返回的内容（可能已加密），sha256 为解密后应得到的内容"""
+    name: str
+    body: bytes
+    sha256: str
+    decode_key: str = ""
+    segments: int = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+
+def make_mp4(size: int, seed: int) -> bytearray:
+    """ftyp + moov + mdat 铺满 size 字节，能通过 utils.mp4.verify_mp4 的结构校验"""
+    ftyp = struct.pack('>I4s', 24, b'ftyp') + b'isom' + b'\0\0\2\0' + b'isomiso2'
+    moov = struct.pack('>I4s', 1024, b'moov') + bytes(1016)
+    mdat_size = max(size - len(ftyp) - len(moov), 8)
+    payload = random.Random(seed).randbytes(mdat_size - 8)
+    return bytearray(ftyp + moov + struct.pack('>I4s', mdat_size, b'mdat') + payload)
+
+
+def make_ts(size: int, seed: int) -> bytes:
+    """按 188 字节 TS 包（0x47 同步字节）拼出的片段"""
+    rng = random.Random(seed)
+    packets = max(1, size // TS_PACKET)
+    return b''.join(b'\x47' + rng.randbytes(TS_PACKET - 1) for _ in range(packets))
+
+
+def sha256_file(path: str, block: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class Catalog:
+    """CDN 上的全部媒体"""
+
+    def __init__(self, seed: int = 1):
+        self.seed = seed
+        self.media: Dict[str, Media] = {}
+        self.lock = threading.Lock()
+
+    def add_mp4(self, name: str, size: int, encrypted: bool = True) -> Media:
+        """
+        Args:
+            encrypted: 加密开头 ENCRYPTED_LENGTH 字节；文件比这还小时不加密（与解密模块的要求一致）
+        """
+        seed = int(hashlib.md5(f"{self.seed}:{name}".encode()).hexdigest()[:8], 16)
+        data = make_mp4(size, seed)
+        digest = hashlib.sha256(data).hexdigest()
+        decode_key = ""
+        if encrypted and len(data) >= ENCRYPTED_LENGTH:
+            # 密钥流是异或，加密和解密是同一个操作
+            decode_key = str(seed)
+            decrypt(data, ENCRYPTED_LENGTH, seed)
+        media = Media(name=name, body=bytes(data), sha256=digest, decode_key=decode_key)
+        with self.lock:
+            self.media[name] = media
+        return media
+
+    def add_hls(self, name: str, size: int, segments: int = 8) -> Media:
+        """HLS 不加密，合并后的内容为各片段依次拼接"""
+        seed = int(hashlib.md5(f"{self.seed}:{name}".encode()).hexdigest()[:8], 16)
+        segments = max(1, segments)
+        data = make_ts(size, seed)
+        media = Media(name=name, body=data, sha256=hashlib.sha256(data).hexdigest(), segments=segments)
+        with self.lock:
+            self.media[name] = media
+        return media
+
+    def get(self, name: str) -> Optional[Media]:
+        with self.lock:
+            return self.media.get(name)
+
+    @staticmethod
+    def segment_bounds(media: Media, index: int) -> Tuple[int, int]:
+        """第 index 个片段在 body 中的区间，按 TS 包对齐切分"""
+        packets = media.size // TS_PACKET
+        per_segment = -(-packets // media.segments)
+        start = min(index * per_segment, packets) * TS_PACKET
+        end = min((index + 1) * per_segment, packets) * TS_PACKET
+        return start, end
+
+
+@dataclass
+class Behavior:
+    """CDN 行为，运行中可以修改"""
+    latency: float = 0.0          # 每个请求返回响应头之前的延迟（秒）
+    bandwidth: int = 0            # 每个连接每秒字节数，0 为不限速
+    range_support: bool = True
+    error_rate: float = 0.0       # 返回 503 的请求比例
+    reset_rate: float = 0.0       # 响应体发送一半时断开连接的比例
+    token_ttl: float = 0.0        # token 有效期（秒），0 为不过期
+
+
+class _Server(ThreadingHTTPServer):
+    """TLS 握手在各连接自己的线程里进行，慢的握手不会阻塞 accept"""
+    daemon_threads = True
+    context: Optional[ssl.SSLContext] = None
+
+    def finish_request(self, request, client_address):
+        if self.context:
+            request = self.context.wrap_socket(request, server_side=True)
+        super().finish_request(request, client_address)
+
+    def handle_error(self, request, client_address):
+        # 下载端取消、超时断开和握手失败都是正常情况
+        pass
+
+
+class StandinCDN:
+    """在后台线程运行的 CDN 替身，stats 记录请求数、发送字节数和注入的错误"""
+
+    def __init__(self, catalog: Catalog, behavior: Optional[Behavior] = None,
+                 host: str = '127.0.0.1', port: int = 0, certfile: Optional[str] = None, seed: int = 1):
+        """
+        Args:
+            certfile: 证书和私钥（PEM，例如 ~/.mitmproxy/mitmproxy-ca.pem），给出时提供 HTTPS
+        """
+        self.catalog = catalog
+        self.behavior = behavior or Behavior()
+        self.random = random.Random(seed)
+        self.stats = dict.fromkeys(('requests', 'bytes', 'errors', 'resets', 'expired', 'not_found'), 0)
+        self.stats_lock = threading.Lock()
+        # 媒体名称 -> 最近一次请求的时间（time.monotonic），回放脚本据此判断任务是否已开始下载
+        self.last_request: Dict[str, float] = {}
+        self.server = _Server((host, port), self._handler_class())
+        self.scheme = 'http'
+        if certfile:
+            self.server.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.server.context.load_cert_chain(certfile)
+            self.scheme = 'https'
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"{self.scheme}://{host}:{port}"
+
+    def start(self) -> 'StandinCDN':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def token() -> str:
+        """新签发的 token（签发时间）"""
+        return str(int(time.time() * 1000))
+
+    def mp4_url(self, name: str) -> Tuple[str, str]:
+        """返回 (地址, urlToken)，与页面上报的 url / urlToken 字段对应"""
+        return f"{self.base_url}/stodownload?encfilekey={name}", f"&token={self.token()}"
+
+    def hls_url(self, name: str) -> Tuple[str, str]:
+        return f"{self.base_url}/hls/{name}/index.m3u8", f"?token={self.token()}"
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def _roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self.stats_lock:
+            return self.random.random() < rate
+
+    def _handler_class(self):
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self._serve(head=True)
+
+            def do_GET(self):
+                self._serve(head=False)
+
+            def _reply(self, status: int, body: bytes = b'') -> None:
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if body and self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _serve(self, head: bool) -> None:
+                behavior = cdn.behavior
+                cdn._count('requests')
+                if behavior.latency > 0:
+                    time.sleep(behavior.latency)
+
+                parsed = urlsplit(self.path)
+                params = parse_qs(parsed.query)
+                with cdn.stats_lock:
+                    cdn.last_request[self._media_name(parsed.path, params)] = time.monotonic()
+                located = self._locate(parsed.path, params)
+                if located is None:
+                    cdn._count('not_found')
+                    self._reply(404)
+                    return
+                body, content_type, tokened = located
+
+                if tokened and behavior.token_ttl > 0:
+                    issued = params.get('token', ['0'])[0]
+                    if not issued.isdigit() or time.time() - int(issued) / 1000 > behavior.token_ttl:
+                        cdn._count('expired')
+                        self._reply(403)
+                        return
+
+                if cdn._roll(behavior.error_rate):
+                    cdn._count('errors')
+                    self._reply(503)
+                    return
+
+                start, end = 0, len(body) - 1
+                status = 200
+                range_header = self.headers.get('Range')
+                if range_header and behavior.range_support and range_header.startswith('bytes='):
+                    first, _, last = range_header[6:].partition('-')
+                    start = int(first) if first else 0
+                    end = min(int(last), len(body) - 1) if last else len(body) - 1
+                    if start >= len(body) or start > end:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{len(body)}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    status = 206
+
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(end - start + 1))
+                if behavior.range_support:
+                    self.send_header('Accept-Ranges', 'bytes')
+                if status == 206:
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+                self.end_headers()
+                if not head:
+                    self._send_body(memoryview(body)[start:end + 1], behavior)
+
+            @staticmethod
+            def _media_name(path: str, params: dict) -> str:
+                if path == '/stodownload':
+                    return params.get('encfilekey', [''])[0]
+                parts = path.strip('/').split('/')
+                return parts[1] if len(parts) > 1 and parts[0] == 'hls' else ''
+
+            def _locate(self, path: str, params: dict):
+                """返回 (内容, Content-Type, 是否校验 token)"""
+                if path == '/stodownload':
+                    media = cdn.catalog.get(params.get('encfilekey', [''])[0])
+                    return (media.body, 'video/mp4', True) if media and not media.segments else None
+
+                parts = path.strip('/').split('/')
+                if len(parts) != 3 or parts[0] != 'hls':
+                    return None
+                media = cdn.catalog.get(parts[1])
+                if not media or not media.segments:
+                    return None
+                if parts[2] == 'index.m3u8':
+                    return self._playlist(media).encode(), 'application/vnd.apple.mpegurl', True
+                if parts[2].startswith('seg_') and parts[2].endswith('.ts') and parts[2][4:-3].isdigit():
+                    index = int(parts[2][4:-3])
+                    if index < media.segments:
+                        start, end = Catalog.segment_bounds(media, index)
+                        return media.body[start:end], 'video/mp2t', False
+                return None
+
+            @staticmethod
+            def _playlist(media: Media) -> str:
+                lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+                for index in range(media.segments):
+                    lines += ['#EXTINF:4.0,', f'seg_{index:03d}.ts']
+                lines.append('#EXT-X-ENDLIST')
+                return '\n'.join(lines) + '\n'
+
+            def _send_body(self, body: memoryview, behavior: Behavior) -> None:
+                """分块发送，按连接限速；注入断连时只发送一半"""
+                limit = len(body)
+                if cdn._roll(behavior.reset_rate):
+                    cdn._count('resets')
+                    limit = len(body) // 2
+                    self.close_connection = True
+                started = time.monotonic()
+                sent = 0
+                try:
+                    while sent < limit:
+                        block = body[sent:min(sent + WRITE_BLOCK, limit)]
+                        self.wfile.write(block)
+                        sent += len(block)
+                        cdn._count('bytes', len(block))
+                        if behavior.bandwidth > 0:
+                            ahead = sent / behavior.bandwidth - (time.monotonic() - started)
+                            if ahead > 0:
+                                time.sleep(ahead)
+                    if limit < len(body):
+                        self.wfile.flush()
+                        self.connection.shutdown(socket.SHUT_RDWR)
+                except (ConnectionError, OSError):
+                    # 下载端取消或超时断开
+                    self.close_connection = True
+
+        return Handler
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """CDN 行为参数，回放脚本共用"""
+    parser.add_argument('--latency', type=float, default=0.0, metavar='MS',
+                        help='每个请求的延迟（毫秒），模拟 RTT (默认: %(default)s)')
+    parser.add_argument('--bandwidth', type=int, default=0, metavar='KB',
+                        help='每个连接的带宽（KB/s），0 为不限 (默认: %(default)s)')
+    parser.add_argument('--no-range', action='store_true', help='不支持 Range，总是返回完整内容')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 503 的请求比例 (默认: %(default)s)')
+    parser.add_argument('--reset-rate', type=float, default=0.0,
+                        help='响应体发送一半时断开连接的比例 (默认: %(default)s)')
+    parser.add_argument('--token-ttl', type=float, default=0.0, metavar='S',
+                        help='token 有效期（秒），过期返回 403，0 为不过期 (默认: %(default)s)')
+    parser.add_argument('--certfile',
+                        help='证书和私钥 PEM 文件，给出时使用 HTTPS（例如 ~/.mitmproxy/mitmproxy-ca.pem）；'
+                             '小文件下载会校验证书，媒体需大于 SMALL_OBJECT_THRESHOLD')
+    parser.add_argument('--seed', type=int, default=1, help='内容和错误注入的随机种子 (默认: %(default)s)')
+
+
+def behavior_from_args(args) -> Behavior:
+    return Behavior(
+        latency=args.latency / 1000,
+        bandwidth=args.bandwidth * 1024,
+        range_support=not args.no_range,
+        error_rate=args.error_rate,
+        reset_rate=args.reset_rate,
+        token_ttl=args.token_ttl,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 CDN 替身：合成的加密 MP4 和 HLS')
+    parser.add_argument('-p', '--port', type=int, default=18081, help='监听端口 (默认: %(default)s)')
+    parser.add_argument('--count', type=int, default=4, help='MP4 个数 (默认: %(default)s)')
+    parser.add_argument('--hls', type=int, default=1, help='HLS 个数 (默认: %(default)s)')
+    parser.add_argument('--size', type=float, default=4, help='每个媒体的大小（MB） (默认: %(default)s)')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    catalog = Catalog(seed=args.seed)
+    cdn = StandinCDN(catalog, behavior_from_args(args), port=args.port, certfile=args.certfile, seed=args.seed)
+    for index in range(args.count):
+        media = catalog.add_mp4(f"mp4{index:04d}", int(args.size * MB))
+        url, token = cdn.mp4_url(media.name)
+        print(f"{url}{token} decodeKey={media.decode_key} sha256={media.sha256}")
+    for index in range(args.hls):
+        media = catalog.add_hls(f"hls{index:04d}", int(args.size * MB))
+        url, token = cdn.hls_url(media.name)
+        print(f"{url}{token} sha256={media.sha256}")
+    print(f"CDN 替身: {cdn.base_url}（Ctrl+C 退出）", flush=True)
+    cdn.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        cdn.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+VideoDownloader 吞吐量矩阵
+用本地 CDN 替身（benchmarks.cdn_standin，支持 Range）按 文件大小 × 线程数 × 分段大小 × 读取大小 × RTT × 带宽 的组合下载，
+记录 MB/s、每 GB 的 CPU 时间、峰值 RSS 和每 MB 的系统调用数，用于确定 thread_count / chunk_size / read_size 的默认值
+
+每个组合在单独的子进程中下载（CDN 在父进程，不计入 CPU 和内存），
+系统调用数为子进程中 socket.recv_into 的调用次数加上 /proc/self/io 的 syscr / syscw（文件读写，仅 Linux）
+
+用法: python -m benchmarks.downloader_matrix [--sizes 16,64] [--threads 1,4,8] [--chunks 1,4] [--reads 8,64,256] [--rtt 0,50]
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.cdn_standin import MB, Behavior, Catalog, StandinCDN, sha256_file
+
+ROOT = Path(__file__).resolve().parent.parent
+
+KB = 1024
+GB = 1024 * MB
+
+# 当前默认值，表格中标出
+DEFAULTS = {'threads': 4, 'chunk': 1 * MB, 'read': 8 * KB}
+
+
+def read_io() -> dict:
+    """当前进程的 syscr / syscw，不支持时为 0"""
+    result = {'syscr': 0, 'syscw': 0}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in result:
+                    result[key] = int(value)
+    except OSError:
+        pass
+    return result
+
+
+def run_child(spec: dict) -> None:
+    import socket
+
+    from downloaders.video_downloader import VideoDownloader
+
+    # /proc/self/io 不统计 socket 读取，在这里计数（requests 经 SocketIO.readinto 调用 recv_into）
+    calls = {'recv': 0}
+    recv_into = socket.socket.recv_into
+
+    def counting_recv_into(self, *args, **kwargs):
+        calls['recv'] += 1
+        return recv_into(self, *args, **kwargs)
+
+    socket.socket.recv_into = counting_recv_into
+
+    downloader = VideoDownloader(
+        url=spec['url'],
+        save_path=spec['save_path'],
+        thread_count=spec['threads'],
+        chunk_size=spec['chunk'],
+        read_size=spec['read'],
+    )
+    io_before = read_io()
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+    ok = downloader.start()
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - started_cpu
+    io_after = read_io()
+    socket.socket.recv_into = recv_into
+
+    if ok:
+        ok = sha256_file(spec['save_path']) == spec['sha256']
+    result = {
+        'ok': ok,
+        'wall': wall,
+        'cpu': cpu,
+        # Linux 上 ru_maxrss 单位为 KB
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'recv': calls['recv'],
+        'file_io': (io_after['syscr'] - io_before['syscr']) + (io_after['syscw'] - io_before['syscw']),
+    }
+    print(json.dumps(result), flush=True)
+
+
+def run_case(spec: dict) -> dict:
+    process = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.downloader_matrix', '--child', json.dumps(spec)],
+        cwd=str(ROOT), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    if os.path.exists(spec['save_path']):
+        os.remove(spec['save_path'])
+    if process.returncode != 0:
+        raise RuntimeError(f"子进程运行失败: {process.returncode}")
+    return json.loads(process.stdout.decode().strip().splitlines()[-1])
+
+
+def parse_list(value: str, unit: float = 1) -> list:
+    return [int(float(item) * unit) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VideoDownloader 吞吐量矩阵（本地 CDN 替身）')
+    parser.add_argument('--sizes', default='16,64', help='文件大小（MB），逗号分隔 (默认: %(default)s)')
+    parser.add_argument('--threads', default='1,4,8', help='线程数 (默认: %(default)s)')
+    parser.add_argument('--chunks', default='1,4', help='分段大小 chunk_size（MB） (默认: %(default)s)')
+    parser.add_argument('--reads', default='8,64,256', help='读取大小 read_size（KB） (默认: %(default)s)')
+    parser.add_argument('--rtt', default='0,50', help='每个请求的延迟（毫秒） (默认: %(default)s)')
+    parser.add_argument('--bandwidth', default='0',
+                        help='每个连接的带宽（KB/s），0 为不限 (默认: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=1, help='每个组合重复次数，取最快的一次 (默认: %(default)s)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+
+    sizes = parse_list(args.sizes, MB)
+    threads = parse_list(args.threads)
+    chunks = parse_list(args.chunks, MB)
+    reads = parse_list(args.reads, KB)
+    rtts = parse_list(args.rtt)
+    bandwidths = parse_list(args.bandwidth, KB)
+    if not all([sizes, threads, chunks, reads, rtts, bandwidths]) or min(threads + chunks + reads) <= 0:
+        parser.error('参数列表不能为空，线程数和大小必须为正数')
+
+    catalog = Catalog()
+    cdn = StandinCDN(catalog).start()
+    media = {size: catalog.add_mp4(f"size{size}", size, encrypted=False) for size in sizes}
+    work_dir = Path(tempfile.mkdtemp(prefix='downloader_matrix_'))
+
+    cases = list(itertools.product(sizes, rtts, bandwidths, threads, chunks, reads))
+    print(f"{len(cases)} 个组合，每个重复 {args.repeat} 次，CDN 替身 {cdn.base_url}；* 为当前默认值")
+    print(f"{'size MB':>7} {'rtt ms':>6} {'bw KB/s':>7} {'threads':>7} {'chunk MB':>8} {'read KB':>7} "
+          f"{'MB/s':>8} {'cpu s/GB':>9} {'peak RSS MB':>11} {'recv/MB':>8} {'syscalls/MB':>11}")
+    best = {}
+    try:
+        for size, rtt, bandwidth, thread_count, chunk, read in cases:
+            cdn.behavior = Behavior(latency=rtt / 1000, bandwidth=bandwidth)
+            url, token = cdn.mp4_url(media[size].name)
+            spec = {
+                'url': url + token,
+                'save_path': str(work_dir / 'download.mp4'),
+                'sha256': media[size].sha256,
+                'threads': thread_count,
+                'chunk': chunk,
+                'read': read,
+            }
+            result = min((run_case(spec) for _ in range(args.repeat)), key=lambda r: r['wall'])
+            megabytes = size / MB
+            speed = megabytes / result['wall'] if result['ok'] else 0.0
+            is_default = (thread_count, chunk, read) == (DEFAULTS['threads'], DEFAULTS['chunk'], DEFAULTS['read'])
+            mark = '*' if is_default else ' '
+            print(f"{megabytes:>7.0f} {rtt:>6} {bandwidth // KB:>7} {thread_count:>7} {chunk / MB:>8g} "
+                  f"{read // KB:>7} {speed:>8.1f} {result['cpu'] / size * GB:>9.2f} {result['peak_rss']:>11.1f} "
+                  f"{result['recv'] / megabytes:>8.0f} {(result['recv'] + result['file_io']) / megabytes:>11.0f}"
+                  f"{mark}{'' if result['ok'] else ' 失败'}", flush=True)
+
+            group = best.setdefault((size, rtt, bandwidth), {'best': None, 'default': None})
+            if group['best'] is None or speed > group['best'][0]:
+                group['best'] = (speed, thread_count, chunk, read)
+            if is_default:
+                group['default'] = speed
+    finally:
+        cdn.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    print(f"{'size MB':>7} {'rtt ms':>6} {'bw KB/s':>7} {'best MB/s':>9} {'threads':>7} {'chunk MB':>8} "
+          f"{'read KB':>7} {'default MB/s':>12}")
+    for (size, rtt, bandwidth), group in best.items():
+        speed, thread_count, chunk, read = group['best']
+        default = f"{group['default']:.1f}" if group['default'] is not None else '-'
+        print(f"{size / MB:>7.0f} {rtt:>6} {bandwidth // KB:>7} {speed:>9.1f} {thread_count:>7} {chunk / MB:>8g} "
+              f"{read // KB:>7} {default:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+"""
+端到端回放测试
+启动本地 CDN 替身（benchmarks.cdn_standin）和真实的代理（mitmdump + core/addon_server.py，可选独立下载服务），
+像页面一样把视频信息 POST 到 /res-downloader/wechat，经 WechatVideoAddon 提交下载，
+轮询控制接口 /res-downloader/jobs 判断每个媒体何时离开流水线，最后校验下载内容并输出吞吐量和延迟报告
+
+视频信息可以是合成的，也可以是之前捕获的 JSONL（与 main_batch.py 的输入相同）：
+回放时每个媒体换成 CDN 替身上同样大小的合成内容（有 decodeKey 的加密），描述换成编号以便对应输出文件
+
+失败的媒体可以换新 token 重新上报（模拟用户重新打开视频），延迟从第一次上报算起
+
+用法: python -m benchmarks.e2e_replay [--count 8] [--hls 2] [--size 8] [--payloads captured.jsonl] [--service]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+
+from benchmarks.cdn_standin import MB, Catalog, Media, StandinCDN, add_arguments, behavior_from_args, sha256_file
+from benchmarks.proxy_overhead import read_rss, wait_port
+
+ROOT = Path(__file__).resolve().parent.parent
+
+REPORT_URL = 'http://wxapp.tc.qq.com/res-downloader/wechat?type=1'
+JOBS_URL = 'http://wxapp.tc.qq.com/res-downloader/jobs'
+METRICS_URL = 'http://wxapp.tc.qq.com/res-downloader/metrics'
+SERVICE_KEY = 'e2e-replay'
+
+STAGE_PATTERN = re.compile(r'^wechat_downloader_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+# 每个任务结束时这三个计数之一加 1
+FINISHED_PATTERN = re.compile(r'^wechat_downloader_(completed|failures|cancelled)_total(\{[^}]*\})? (\S+)$')
+
+
+@dataclass
+class Tracked:
+    """一个上报的媒体"""
+    media: Media
+    kind: str                      # mp4 / hls / image
+    template: dict                 # 上报的 media 字段（url 和 urlToken 每次上报时重新生成）
+    description: str
+    url: str = ""                  # 最近一次上报的完整地址（含 token），与 /jobs 中的 url 对应
+    posted_at: float = 0.0         # 第一次上报的时间
+    reported_at: float = 0.0       # 最近一次上报的时间
+    seen: bool = False
+    done_at: Optional[float] = None
+    ok: bool = False
+    reposts: int = 0
+
+
+@dataclass
+class Run:
+    tracked: List[Tracked] = field(default_factory=list)
+    report_latencies: List[float] = field(default_factory=list)
+    report_errors: int = 0
+
+
+class Replay:
+    def __init__(self, cdn: StandinCDN, proxy_port: int, save_dir: Path, reposts: int, poll: float):
+        self.cdn = cdn
+        self.proxies = {'http': f'http://127.0.0.1:{proxy_port}'}
+        self.save_dir = save_dir
+        self.reposts = reposts
+        self.poll = poll
+        self.run = Run()
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        # 输出文件 (路径, 大小, 修改时间) -> sha256，避免重复计算
+        self.hashes: Dict[tuple, str] = {}
+        # 已经对应到上报媒体的任务结束次数（与指标中结束的任务数比较）
+        self.attributed = 0
+
+    def _address(self, tracked: Tracked):
+        if tracked.kind == 'hls':
+            return self.cdn.hls_url(tracked.media.name)
+        return self.cdn.mp4_url(tracked.media.name)
+
+    def post(self, group: List[Tracked], base: dict) -> None:
+        """以新 token 上报一组媒体（同一帖子）"""
+        media_list = []
+        for tracked in group:
+            url, token = self._address(tracked)
+            tracked.url = url + token
+            tracked.seen = False
+            tracked.done_at = None
+            media_list.append(dict(tracked.template, url=url, urlToken=token))
+        payload = dict(base, description=group[0].description, media=media_list)
+
+        started = time.perf_counter()
+        with self.lock:
+            for tracked in group:
+                tracked.reported_at = time.monotonic()
+                tracked.posted_at = tracked.posted_at or tracked.reported_at
+        try:
+            # 监视线程重新上报时也会调用，不共用 session
+            response = requests.post(REPORT_URL, data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                                     proxies=self.proxies, timeout=10)
+            if response.status_code != 200:
+                raise RuntimeError(response.status_code)
+            self.run.report_latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            self.run.report_errors += 1
+            print(f"上报失败: {e}", file=sys.stderr)
+
+    def _active_urls(self) -> Optional[set]:
+        try:
+            response = self.session.get(JOBS_URL, proxies=self.proxies, timeout=5)
+            return {job['url'] for job in response.json()['jobs']}
+        except Exception:
+            return None
+
+    def _outputs(self) -> set:
+        """下载目录中已完成文件的 sha256（跳过临时文件和 m3u8 片段目录）"""
+        digests = set()
+        for directory, dirs, files in os.walk(self.save_dir):
+            dirs[:] = [d for d in dirs if not d.endswith('_ts_temp')]
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                key = (path, stat.st_size, stat.st_mtime_ns)
+                if key not in self.hashes:
+                    self.hashes[key] = sha256_file(path)
+                digests.add(self.hashes[key])
+        return digests
+
+    def _finished_jobs(self) -> Optional[int]:
+        """流水线中已结束（完成、失败或取消）的任务数"""
+        total = 0
+        text = self.metrics()
+        if not text:
+            return None
+        for line in text.splitlines():
+            match = FINISHED_PATTERN.match(line)
+            if match:
+                total += float(match.group(3))
+        return int(total)
+
+    def monitor(self, posting: threading.Event, timeout: float) -> None:
+        """
+        轮询进行中的任务，直到全部媒体结束（或超时）
+
+        两次轮询之间就结束的任务在 /jobs 中看不到：完成的以输出文件为准，
+        失败的以 CDN 替身的请求记录为准，再用指标中结束的任务数兜底
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # 先取结束的任务数再取 /jobs：计入结束数的任务在 /jobs 中一定已经不在了
+            finished = self._finished_jobs()
+            polled_at = time.monotonic()
+            active = self._active_urls()
+            if active is None:
+                time.sleep(self.poll)
+                continue
+            now = time.monotonic()
+            outputs = None
+            ended = []
+            unseen = []
+            with self.lock:
+                pending = [t for t in self.run.tracked if t.posted_at and t.done_at is None]
+            for tracked in pending:
+                if tracked.url in active:
+                    tracked.seen = True
+                    continue
+                if outputs is None:
+                    outputs = self._outputs()
+                tracked.ok = tracked.media.sha256 in outputs
+                with self.cdn.stats_lock:
+                    requested_at = self.cdn.last_request.get(tracked.media.name, 0.0)
+                # 任务先登记再请求 CDN：本次上报后已经请求过 CDN、/jobs 中却没有，说明已经结束
+                if tracked.seen or tracked.ok or tracked.reported_at < requested_at < polled_at:
+                    ended.append(tracked)
+                else:
+                    unseen.append(tracked)
+
+            if unseen:
+                # 请求 CDN 之前就失败的：指标中结束的任务数比已对应的多出几个，依次认定为最早上报的几个
+                if finished is not None:
+                    surplus = finished - self.attributed - len(ended)
+                    unseen.sort(key=lambda t: t.reported_at)
+                    ended.extend(unseen[:max(0, surplus)])
+
+            retry = []
+            for tracked in ended:
+                self.attributed += 1
+                if not tracked.ok and tracked.reposts < self.reposts:
+                    tracked.reposts += 1
+                    retry.append(tracked)
+                    continue
+                tracked.done_at = now
+            for tracked in retry:
+                self.post([tracked], {})
+            if not posting.is_set() and all(t.done_at is not None for t in self.run.tracked):
+                return
+            time.sleep(self.poll)
+
+    def metrics(self) -> str:
+        try:
+            return self.session.get(METRICS_URL, proxies=self.proxies, timeout=5).text
+        except Exception:
+            return ""
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def build_synthetic(catalog: Catalog, count: int, hls: int, size: int, segments: int) -> List[tuple]:
+    """返回 [(帖子其余字段, [Tracked])]"""
+    posts = []
+    for index in range(count + hls):
+        name = f"bench{index:04d}"
+        if index < count:
+            media = catalog.add_mp4(name, size)
+            template = {'fileSize': media.size, 'mediaType': 4}
+            if media.decode_key:
+                template['decodeKey'] = media.decode_key
+            posts.append(({}, [Tracked(media, 'mp4', template, name)]))
+        else:
+            media = catalog.add_hls(name, size, segments)
+            posts.append(({}, [Tracked(media, 'hls', {'fileSize': media.size, 'mediaType': 4}, name)]))
+    return posts
+
+
+def build_recorded(catalog: Catalog, path: str, default_size: int, max_size: int, segments: int) -> List[tuple]:
+    """按捕获的视频信息生成同样形状的帖子，媒体内容换成 CDN 替身上的合成内容"""
+    posts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                payload = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(payload, dict) or not payload.get('media'):
+                continue
+            description = f"replay{len(posts):04d}"
+            base = {key: value for key, value in payload.items() if key not in ('media', 'description')}
+            group = []
+            for index, original in enumerate(payload['media']):
+                if not original.get('url'):
+                    continue
+                size = min(int(original.get('fileSize') or default_size), max_size)
+                name = f"{description}m{index}"
+                template = {key: value for key, value in original.items()
+                            if key not in ('url', 'urlToken', 'coverUrl', 'decodeKey')}
+                if '.m3u8' in original['url'].lower():
+                    media = catalog.add_hls(name, size, segments)
+                    kind = 'hls'
+                else:
+                    media = catalog.add_mp4(name, size, encrypted=bool(original.get('decodeKey')))
+                    kind = 'image' if original.get('mediaType') == 9 else 'mp4'
+                    if media.decode_key:
+                        template['decodeKey'] = media.decode_key
+                template['fileSize'] = media.size
+                group.append(Tracked(media, kind, template, description))
+            if group:
+                posts.append((base, group))
+    return posts
+
+
+def start_processes(args, save_dir: Path) -> List[subprocess.Popen]:
+    env = os.environ.copy()
+    env['PYTHONPATH'] = str(ROOT) + os.pathsep + env.get('PYTHONPATH', '')
+    env.update({
+        'SAVE_DIR': str(save_dir),
+        'SHARD_MODE': 'none',
+        'PASSIVE_CAPTURE': '0',
+        'CONTENT_STORE': '0',
+        'FASTSTART': '0',
+        'DOWNLOAD_COVERS': '0',
+        'STAGE_WORKERS': f"fetch={args.jobs}",
+    })
+    for name in ('DOWNLOAD_SERVICE', 'DOWNLOAD_SERVICE_KEY', 'BANDWIDTH_LIMIT_KB'):
+        env.pop(name, None)
+
+    processes = []
+    if args.service:
+        env['DOWNLOAD_SERVICE'] = f"127.0.0.1:{args.port + 1}"
+        env['DOWNLOAD_SERVICE_KEY'] = SERVICE_KEY
+        processes.append(subprocess.Popen([sys.executable, '-m', 'core.download_service'], env=env, cwd=str(ROOT),
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        if not wait_port(args.port + 1):
+            raise RuntimeError('下载服务启动失败')
+
+    cmd = [
+        'mitmdump',
+        '-s', str(ROOT / 'core' / 'addon_server.py'),
+        '-p', str(args.port),
+        '--set', 'block_global=false',
+        '--quiet'
+    ]
+    processes.append(subprocess.Popen(cmd, env=env, cwd=str(ROOT), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    if not wait_port(args.port):
+        raise RuntimeError('mitmdump 启动失败')
+    return processes
+
+
+def print_report(replay: Replay, cdn: StandinCDN, wall: float, peaks: Dict[str, float]) -> None:
+    run = replay.run
+    tracked = run.tracked
+    completed = [t for t in tracked if t.ok]
+    failed = [t for t in tracked if t.done_at is not None and not t.ok]
+    timed_out = [t for t in tracked if t.done_at is None]
+    total_bytes = sum(t.media.size for t in completed)
+    kinds = {}
+    for t in tracked:
+        kinds[t.kind] = kinds.get(t.kind, 0) + 1
+
+    print()
+    print(f"媒体 {len(tracked)} 个（{', '.join(f'{k} {v}' for k, v in sorted(kinds.items()))}），"
+          f"完成且内容一致 {len(completed)}，失败 {len(failed)}，超时 {len(timed_out)}，"
+          f"重新上报 {sum(t.reposts for t in tracked)} 次，上报失败 {run.report_errors} 次")
+    print(f"耗时 {wall:.2f}s，下载 {total_bytes / MB:.1f}MB，"
+          f"吞吐 {total_bytes / MB / wall:.2f}MB/s，{len(completed) / wall * 60:.1f} 个/分钟")
+    stats = cdn.stats
+    print(f"CDN: {stats['requests']} 个请求，发送 {stats['bytes'] / MB:.1f}MB，注入 503 {stats['errors']} 次，"
+          f"断连 {stats['resets']} 次，token 过期 {stats['expired']} 次")
+
+    print()
+    print(f"{'latency':<14} {'n':>4} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = [('report', run.report_latencies)]
+    for kind in sorted(kinds):
+        rows.append((f"e2e {kind}", [t.done_at - t.posted_at for t in completed if t.kind == kind]))
+    for label, values in rows:
+        ms = [v * 1000 for v in values]
+        print(f"{label:<14} {len(ms):>4} {percentile(ms, 50):>9.1f} {percentile(ms, 90):>9.1f} "
+              f"{percentile(ms, 99):>9.1f} {max(ms, default=0):>9.1f}")
+
+    stages: Dict[str, Dict[str, float]] = {}
+    for line in replay.metrics().splitlines():
+        match = STAGE_PATTERN.match(line)
+        if match:
+            stages.setdefault(match.group(2), {})[match.group(1)] = float(match.group(3))
+    if stages:
+        print()
+        print(f"{'stage':<10} {'count':>6} {'mean ms':>9} {'total s':>9}")
+        for stage, values in sorted(stages.items()):
+            count = values.get('count', 0)
+            mean = values.get('sum', 0) / count * 1000 if count else 0
+            print(f"{stage:<10} {int(count):>6} {mean:>9.1f} {values.get('sum', 0):>9.2f}")
+
+    if peaks:
+        print()
+        print('  '.join(f"{name} 峰值 RSS {peak:.1f}MB" for name, peak in peaks.items()))
+    for t in failed + timed_out:
+        print(f"  ❌{t.media.name} {t.kind} {t.media.size / MB:.1f}MB", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端回放测试：CDN 替身 + 真实代理插件 + 下载流水线')
+    parser.add_argument('--payloads', help='捕获的视频信息 JSONL，不给出时使用合成的帖子')
+    parser.add_argument('--count', type=int, default=8, help='合成的 MP4 帖子数 (默认: %(default)s)')
+    parser.add_argument('--hls', type=int, default=2, help='合成的 HLS 帖子数 (默认: %(default)s)')
+    parser.add_argument('--size', type=float, default=8, help='合成媒体的大小（MB），也是回放时缺少 fileSize 的默认值 (默认: %(default)s)')
+    parser.add_argument('--max-size', type=float, default=64, help='回放时单个媒体的大小上限（MB） (默认: %(default)s)')
+    parser.add_argument('--segments', type=int, default=8, help='每个 HLS 的片段数 (默认: %(default)s)')
+    parser.add_argument('--interval', type=float, default=0.2, help='两次上报之间的间隔（秒） (默认: %(default)s)')
+    parser.add_argument('--reposts', type=int, default=1, help='失败的媒体换新 token 重新上报的次数 (默认: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=2, help='同时下载的媒体数 (默认: %(default)s)')
+    parser.add_argument('--service', action='store_true', help='使用独立的下载服务进程（DOWNLOAD_SERVICE）')
+    parser.add_argument('-p', '--port', type=int, default=18899, help='代理端口，下载服务使用下一个端口 (默认: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=300, help='等待全部媒体结束的最长时间（秒） (默认: %(default)s)')
+    parser.add_argument('--poll', type=float, default=0.05, help='轮询 /res-downloader/jobs 的间隔（秒） (默认: %(default)s)')
+    parser.add_argument('--keep', action='store_true', help='保留下载目录')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    catalog = Catalog(seed=args.seed)
+    if args.payloads:
+        posts = build_recorded(catalog, args.payloads, int(args.size * MB), int(args.max_size * MB), args.segments)
+    else:
+        posts = build_synthetic(catalog, args.count, args.hls, int(args.size * MB), args.segments)
+    if not posts:
+        parser.error('没有可回放的帖子')
+
+    cdn = StandinCDN(catalog, behavior_from_args(args), certfile=args.certfile, seed=args.seed).start()
+    save_dir = Path(tempfile.mkdtemp(prefix='e2e_replay_'))
+    print(f"{sum(len(group) for _, group in posts)} 个媒体，CDN 替身 {cdn.base_url}，下载目录 {save_dir}")
+
+    processes = start_processes(args, save_dir)
+    replay = Replay(cdn, args.port, save_dir, args.reposts, args.poll)
+    peaks: Dict[str, float] = {}
+    try:
+        posting = threading.Event()
+        posting.set()
+        for _, group in posts:
+            replay.run.tracked.extend(group)
+        started = time.monotonic()
+        monitor = threading.Thread(target=replay.monitor, args=(posting, args.timeout), daemon=True)
+        monitor.start()
+        for base, group in posts:
+            replay.post(group, base)
+            time.sleep(args.interval)
+        posting.clear()
+        monitor.join()
+        finished = [t.done_at for t in replay.run.tracked if t.done_at is not None]
+        wall = max(max(finished, default=time.monotonic()) - started, 1e-6)
+
+        names = ['service', 'mitmdump'] if args.service else ['mitmdump']
+        peaks = {name: read_rss(process.pid)['VmHWM'] / 1024 for name, process in zip(names, processes)}
+        print_report(replay, cdn, wall, peaks)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        cdn.stop()
+        if not args.keep:
+            shutil.rmtree(save_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
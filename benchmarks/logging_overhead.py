@@ -0,0 +1,128 @@
+"""
+日志开销测试
+模拟下载时下载线程上的日志路径：每个任务 4 个线程，每收到 8KB 在锁内调用一次进度回调（与 VideoDownloader 相同），
+比较不同日志模式下每下载 1GB 的 CPU 时间和耗时，不产生网络和磁盘 IO
+
+每种模式在单独的子进程中运行（日志只在进程第一次输出时配置），终端输出接到管道上由父进程读取丢弃
+
+用法: python -m benchmarks.logging_overhead [--gb 1] [--jobs 10] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from threading import Lock, Thread
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CHUNK_SIZE = 8192
+THREADS_PER_JOB = 4
+GB = 1024 * 1024 * 1024
+
+# 模式 -> 环境变量
+MODES = {
+    'off': {},
+    'default': {},
+    'async': {'LOG_ENQUEUE': '1'},
+    'sampled': {'LOG_SAMPLE_INTERVAL': '1'},
+    'async+sampled': {'LOG_ENQUEUE': '1', 'LOG_SAMPLE_INTERVAL': '1'},
+    'json': {'LOG_JSON': '1'},
+}
+
+
+def simulate(total_bytes: int, jobs: int, with_progress: bool) -> None:
+    """依次模拟 jobs 个任务，每个任务 THREADS_PER_JOB 个线程分段累加进度"""
+    from core.pipeline import create_progress_callback
+
+    job_size = total_bytes // jobs
+    for job_id in range(1, jobs + 1):
+        callback = create_progress_callback(f"job{job_id}.mp4", job_id) if with_progress else None
+        lock = Lock()
+        state = {'downloaded': 0}
+        part_chunks = job_size // CHUNK_SIZE // THREADS_PER_JOB
+
+        def part():
+            for _ in range(part_chunks):
+                with lock:
+                    state['downloaded'] += CHUNK_SIZE
+                    if callback:
+                        callback(state['downloaded'], part_chunks * CHUNK_SIZE * THREADS_PER_JOB)
+
+        threads = [Thread(target=part) for _ in range(THREADS_PER_JOB)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def run_child(mode: str, gb: float, jobs: int) -> None:
+    from utils.logger import logger
+
+    # 先完成日志配置，不计入测试时间
+    logger.debug("日志开销测试开始")
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+    simulate(int(gb * GB), jobs, with_progress=(mode != 'off'))
+    logger.complete()
+    result = {
+        'wall': (time.perf_counter() - started) / gb,
+        'cpu': (time.process_time() - started_cpu) / gb,
+    }
+    print(json.dumps(result), flush=True)
+
+
+def run_mode(mode: str, gb: float, jobs: int) -> dict:
+    env = dict(os.environ, **MODES[mode])
+    for name in ('LOG_ENQUEUE', 'LOG_JSON', 'LOG_SAMPLE_INTERVAL'):
+        if name not in MODES[mode]:
+            env.pop(name, None)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.logging_overhead', '--child', mode, '--gb', str(gb), '--jobs', str(jobs)],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=str(ROOT)
+    )
+    lines = {'count': 0}
+
+    def drain():
+        for _ in process.stderr:
+            lines['count'] += 1
+
+    reader = Thread(target=drain, daemon=True)
+    reader.start()
+    stdout = process.stdout.read()
+    process.wait()
+    reader.join()
+    if process.returncode != 0:
+        raise RuntimeError(f"{mode} 运行失败: {process.returncode}")
+    result = json.loads(stdout.decode().strip().splitlines()[-1])
+    result['lines'] = lines['count']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='日志开销测试（每 GB）')
+    parser.add_argument('--gb', type=float, default=1.0, help='模拟下载的数据量 (默认: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=10, help='任务数，数据量平均分配 (默认: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='每种模式重复次数，取 CPU 时间最小的一次 (默认: %(default)s)')
+    parser.add_argument('--child', choices=list(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.gb, args.jobs)
+        return
+
+    print(f"模拟 {args.gb}GB，{args.jobs} 个任务，每个任务 {THREADS_PER_JOB} 个线程，每 {CHUNK_SIZE // 1024}KB 回调一次")
+    print(f"{'mode':<14} {'stderr lines':>12} {'wall s/GB':>10} {'cpu s/GB':>9} {'added cpu ms/GB':>16}")
+    baseline = None
+    for mode in MODES:
+        result = min((run_mode(mode, args.gb, args.jobs) for _ in range(args.repeat)), key=lambda r: r['cpu'])
+        if baseline is None:
+            baseline = result['cpu']
+        overhead = (result['cpu'] - baseline) * 1000
+        print(f"{mode:<14} {result['lines']:>12} {result['wall']:>10.3f} {result['cpu']:>9.3f} {overhead:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+代理开销测试
+对比直连与经过 mitmdump + WechatVideoAddon 时的首字节延迟、总耗时以及代理进程内存峰值，
+分别在关闭 / 开启 stream_passthrough 时运行，用于衡量流式直通的效果
+
+用法: python -m benchmarks.proxy_overhead [-n 40] [-c 8]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SIZES = {
+    'small': 64 * 1024,
+    'medium': 1024 * 1024,
+    'large': 4 * 1024 * 1024,
+}
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    """源站：/<size 名称> 返回对应大小的响应，分块写出模拟慢速 CDN"""
+    protocol_version = 'HTTP/1.1'
+    payloads = {name: os.urandom(size) for name, size in SIZES.items()}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.payloads.get(self.path.strip('/'))
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        view = memoryview(body)
+        for i in range(0, len(body), 256 * 1024):
+            self.wfile.write(view[i:i + 256 * 1024])
+            time.sleep(0.002)
+
+
+def wait_port(port: int, timeout: float = 15.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def read_rss(pid: int) -> dict:
+    """读取进程当前和峰值 RSS（KB），仅 Linux"""
+    result = {'VmRSS': 0, 'VmHWM': 0}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                key = line.split(':', 1)[0]
+                if key in result:
+                    result[key] = int(line.split()[1])
+    except OSError:
+        pass
+    return result
+
+
+def run_requests(url: str, proxy_port: int, count: int, concurrency: int) -> dict:
+    proxies = {'http': f'http://127.0.0.1:{proxy_port}'} if proxy_port else None
+    local = threading.local()
+
+    def one(_):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        with session.get(url, proxies=proxies, stream=True, timeout=60) as response:
+            ttfb = time.perf_counter() - start
+            for _chunk in response.iter_content(256 * 1024):
+                pass
+        return ttfb, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(count)))
+
+    ttfbs = [r[0] for r in results]
+    totals = [r[1] for r in results]
+    return {
+        'ttfb_ms': statistics.median(ttfbs) * 1000,
+        'total_ms': statistics.median(totals) * 1000,
+    }
+
+
+def start_proxy(port: int, passthrough: bool) -> subprocess.Popen:
+    env = os.environ.copy()
+    env['PYTHONPATH'] = str(ROOT) + os.pathsep + env.get('PYTHONPATH', '')
+    env['STREAM_PASSTHROUGH'] = '1' if passthrough else '0'
+    env['PASSIVE_CAPTURE'] = '0'
+    cmd = [
+        'mitmdump',
+        '-s', str(ROOT / 'core' / 'addon_server.py'),
+        '-p', str(port),
+        '--set', 'block_global=false',
+        '--set', 'stream_large_bodies=5m',
+        '--quiet'
+    ]
+    return subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='代理开销测试')
+    parser.add_argument('-n', '--requests', type=int, default=40, help='每种大小的请求数')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='并发数')
+    parser.add_argument('-p', '--port', type=int, default=18899, help='测试用代理端口')
+    args = parser.parse_args()
+
+    origin = ThreadingHTTPServer(('127.0.0.1', 0), OriginHandler)
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{origin.server_port}'
+
+    rows = []
+    direct = {name: run_requests(f'{base}/{name}', 0, args.requests, args.concurrency) for name in SIZES}
+    for name, stats in direct.items():
+        rows.append(('direct', name, stats['ttfb_ms'], stats['total_ms'], 0.0, '-'))
+
+    for passthrough in (False, True):
+        process = start_proxy(args.port, passthrough)
+        try:
+            if not wait_port(args.port):
+                print('mitmdump 启动失败', file=sys.stderr)
+                sys.exit(1)
+            mode = 'passthrough' if passthrough else 'buffered'
+            for name in SIZES:
+                stats = run_requests(f'{base}/{name}', args.port, args.requests, args.concurrency)
+                added = stats['total_ms'] - direct[name]['total_ms']
+                peak = read_rss(process.pid)['VmHWM'] / 1024
+                rows.append((mode, name, stats['ttfb_ms'], stats['total_ms'], added, f'{peak:.1f}'))
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(f"{'mode':<12} {'size':<8} {'ttfb p50 ms':>12} {'total p50 ms':>13} {'added ms':>9} {'peak RSS MB':>12}")
+    for mode, name, ttfb, total, added, peak in rows:
+        print(f"{mode:<12} {name:<8} {ttfb:>12.1f} {total:>13.1f} {added:>9.1f} {peak:>12}")
+
+
+if __name__ == '__main__':
+    main()
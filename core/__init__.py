@@ -1,10 +1,23 @@
 """核心功能模块"""
-from core.proxy_addon import WechatVideoAddon, extract_video_url
-from core.proxy_manager import check_certificate, ProxyManager
-
-__all__ = [
-    'WechatVideoAddon',
-    'extract_video_url',
-    'ProxyManager',
-    'check_certificate',
-]
+import importlib
+
+# 名称 -> 所在模块，第一次访问时才导入：
+# main.py 只用到 core.startup、core.proxy_manager，不需要加载 mitmproxy
+_exports = {
+    'WechatVideoAddon': 'core.proxy_addon',
+    'extract_video_url': 'core.video_info',
+    'extract_video_urls': 'core.video_info',
+    'media_key': 'downloaders.media_rules',
+    'PassiveCapture': 'core.passive_capture',
+    'ProxyManager': 'core.proxy_manager',
+    'check_certificate': 'core.proxy_manager',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module), name)
@@ -1,156 +1,97 @@
 """
 mitmproxy 插件服务器
 这个文件会被 mitmdump 加载
+
+配置了 DOWNLOAD_SERVICE 时只负责嗅探，下载交给独立的下载服务进程（core/download_service.py）；
+否则在本进程内下载
 """
 import os
-from pathlib import Path
-from queue import Queue
-from threading import Thread
-
-from core.proxy_addon import WechatVideoAddon, extract_video_url
-from crypto.decryptor import decrypt_wechat_video
-from downloaders.m3u8_downloader import M3U8Downloader, is_m3u8_url
-from downloaders.video_downloader import VideoDownloader, format_size, generate_filename
-from models.entities import VideoData
-from models.exceptions import DecryptError, DownloadError
-from utils.config import config
-from utils.logger import logger
+from typing import List
 
-download_queue = Queue()
-downloaded_urls = set()
+from utils import import_profiler
 
+# --profile-startup：在导入下面的模块之前开始计时
+import_profiler.install_from_env()
 
-def create_progress_callback():
-    """进度回调"""
-    import time
-    
-    state = {
-        'last_progress': 0,
-        'last_time': time.time(),
-        'last_percent': -1
-    }
-    
-    def progress_callback(downloaded, total):
-        if total > 0:
-            percent = int(downloaded * 100 / total)
-            percent_tier = percent // 10
-            
-            if percent_tier > state['last_percent']:
-                current_time = time.time()
-                elapsed = current_time - state['last_time']
-                if elapsed > 0:
-                    speed = (downloaded - state['last_progress']) / elapsed
-                    speed_str = format_size(int(speed)) + "/s"
-                    logger.info(f"{percent}% ({format_size(int(downloaded))}/{format_size(int(total))}) {speed_str}")
-                else:
-                    logger.info(f"{percent}% ({format_size(int(downloaded))}/{format_size(int(total))})")
-                
-                state['last_progress'] = downloaded
-                state['last_time'] = current_time
-                state['last_percent'] = percent_tier
+from core.coalescer import DiscoveryCoalescer
+from core.intercept_policy import InterceptPolicy
+from core.passive_capture import PassiveCapture
+from core.proxy_addon import WechatVideoAddon
+from core.service_client import ServiceClient
+from core.video_info import extract_video_urls
+from downloaders.media_rules import is_m3u8_url, is_small_object
+from models.entities import VideoData
+from utils.config import config
+from utils.logger import logger
+from utils.metrics import registry
+
+# 多个代理进程时各自使用单独的捕获目录，同一媒体只采用最先开始捕获的代理进程
+capture_dir = os.path.join(config.download_dir, '.capture', config.worker_name)
+passive_capture = PassiveCapture(capture_dir) if config.passive_capture else None
+intercept_policy = InterceptPolicy(WechatVideoAddon.HOST_RULES, config.intercept_mode)
+
+if config.service_address:
+    backend = ServiceClient(config.service_address, config.service_authkey, capture=passive_capture,
+                            name=config.worker_name)
+    if passive_capture:
+        passive_capture.on_change = backend.capture_changed
+    logger.info(f"🔗下载交给下载服务: {config.service_address[0]}:{config.service_address[1]}")
+else:
+    # 下载流水线和 requests 只在进程内下载时加载
+    from core.download_service import DownloadService
+    backend = DownloadService(capture=passive_capture)
+    backend.start()
+
+
+def render_metrics() -> str:
+    """本进程的指标；使用下载服务时拼上下载服务进程的指标"""
+    text = registry.render()
+    if isinstance(backend, ServiceClient):
+        text += backend.metrics()
+    return text
+
+
+def on_video_found(video_info: dict, source_url: str = "") -> None:
+    """视频发现回调：登记捕获后交给合并器，窗口结束后整组交给下载后端"""
+    group = extract_video_urls(video_info)
+    if not group:
+        return
     
-    return progress_callback
-
-
-def download_worker():
-    """下载工作线程"""
-    while True:
-        item = download_queue.get()
-        if item is None:
-            break
-        
-        video_data: VideoData = item
+    for video_data in group:
         url = video_data.url
-        
-        filename = generate_filename(
-            video_data.description,
-            video_data.url,
-            video_data.suffix
-        )
-        filepath = Path(os.path.join(config.download_dir, filename))
-        
-        counter = 1
-        while filepath.exists():
-            filepath = Path(os.path.join(config.download_dir, f"{filepath.stem}_{counter}{video_data.suffix}"))
-            counter += 1
-        
-        logger.info(f"⬇️{filepath.name} 下载中...")
-        
-        progress_callback = create_progress_callback()
-
-        if is_m3u8_url(url):
-            downloader = M3U8Downloader(
-                m3u8_url=url,
-                save_path=str(filepath),
-                headers={}
-            )
-            success = downloader.download()
-        else:
-            downloader = VideoDownloader(
-                url=url,
-                save_path=str(filepath),
-                thread_count=4,
-                progress_callback=progress_callback
-            )
-            success = downloader.start()
-        
-        try:
-            if success:
-                actual_file = filepath
-                if hasattr(downloader, 'save_path'):
-                    actual_file = Path(downloader.save_path)
-
-                if video_data.is_encrypted:
-                    logger.info(f"🔓{actual_file.name} 解密中...")
-                    if decrypt_wechat_video(str(actual_file), video_data.decode_key):
-                        logger.success(f"✅{actual_file.name} 下载完成")
-                    else:
-                        raise DecryptError(f"[Crawler-Retry] 解密失败: {actual_file.name}")
-                else:
-                    logger.success(f"✅{actual_file.name} 下载完成")
-            else:
-                if url in downloaded_urls:
-                    downloaded_urls.discard(url)
-
-                temp_file = str(filepath) + '.tmp'
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                raise DownloadError(f"[Crawler-Retry] {url}视频下载失败")
-        except DecryptError or DownloadError as e:
-            logger.error(e)
-        except Exception as e:
-            logger.error(str(e), exc_info=True)
-        finally:
-            download_queue.task_done()
-
-
-def on_video_found(video_info: dict) -> None:
-    """视频发现回调"""
-    video_data = extract_video_url(video_info)
-    if not video_data:
-        return
+        intercept_policy.allow_url(url)
+        if (passive_capture and video_data.media_type == 'video' and not is_m3u8_url(url)
+                and not is_small_object(video_data)):
+            passive_capture.register(video_data)
     
-    url = video_data.url
-    if url in downloaded_urls:
-        return
+    coalescer.submit(group)
 
-    desc = video_data.display_name
-    size_info = f" ({format_size(video_data.size)})" if video_data.size else ""
-    encrypt_info = " 🔐" if video_data.is_encrypted else ""
 
-    logger.info(f"📥 {desc}{size_info}{encrypt_info}")
-    downloaded_urls.add(url)
-    download_queue.put(video_data)
+def enqueue_group(group: List[VideoData]) -> None:
+    """合并后的一组媒体（同一帖子）交给下载后端"""
+    rejected = backend.submit(group)
+    if passive_capture:
+        for url in rejected or []:
+            passive_capture.discard(url)
 
 
+coalescer = DiscoveryCoalescer(enqueue_group, window=config.coalesce_window)
+# 下载失败后清空上报体摘要，用户重新打开视频时的上报不会被当作重复丢弃
+backend.on_failed = lambda _: coalescer.forget_bodies()
+
 addon_instance = WechatVideoAddon(
     video_callback=on_video_found,
-    version="1.0.0"
+    version="1.0.0",
+    capture=passive_capture,
+    stream_passthrough=config.stream_passthrough,
+    policy=intercept_policy,
+    coalescer=coalescer,
+    name=config.worker_name,
+    metrics=render_metrics,
+    control=backend.control,
+    control_token=config.control_token
 )
 
-download_thread = Thread(target=download_worker, daemon=True)
-download_thread.start()
-
 
 addons = [
     addon_instance
@@ -0,0 +1,128 @@
+"""
+上报合并
+同一个视频会在几毫秒内被多次上报（get media()、finderGetCommentDetail、重复渲染），
+这里在下载队列前做一个短时间窗口的合并：
+完全相同的上报体在 json 解析前直接丢弃，同一媒体的多次上报只保留最新的地址（token）
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Condition, Thread
+from typing import Callable, Dict, List, Tuple
+
+from downloaders.media_rules import media_key
+from models.entities import VideoData
+from utils.logger import logger
+
+
+class DiscoveryCoalescer:
+    """上报合并器"""
+
+    def __init__(
+        self,
+        sink: Callable[[List[VideoData]], None],
+        window: float = 0.3,
+        body_ttl: float = 10.0,
+        max_bodies: int = 1024
+    ):
+        """
+        Args:
+            sink: 窗口结束后接收合并结果的回调（一组媒体）
+            window: 合并窗口（秒）
+            body_ttl: 相同上报体的去重时间（秒）
+            max_bodies: 最多记录的上报体摘要数
+        """
+        self.sink = sink
+        self.window = window
+        self.body_ttl = body_ttl
+        self.max_bodies = max_bodies
+
+        self.recent_bodies: "OrderedDict[bytes, float]" = OrderedDict()
+        self.pending: Dict[Tuple[str, ...], Tuple[float, List[VideoData]]] = {}
+        self.condition = Condition()
+
+        self.reports = 0
+        self.duplicate_bodies = 0
+        self.merged = 0
+        self.flushed = 0
+
+        self.thread = Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+
+    def is_duplicate_body(self, body: bytes) -> bool:
+        """上报体与 body_ttl 内某次已处理的上报完全相同时返回 True（不需要再解析）"""
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+
+        with self.condition:
+            self.reports += 1
+            self._expire_bodies(time.monotonic())
+            if digest in self.recent_bodies:
+                self.duplicate_bodies += 1
+                return True
+            return False
+
+    def remember_body(self, body: bytes) -> None:
+        """上报解析并处理成功后再记录摘要，解析或处理失败的上报重发时不会被当作重复丢弃"""
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        now = time.monotonic()
+
+        with self.condition:
+            self._expire_bodies(now)
+            self.recent_bodies[digest] = now
+            self.recent_bodies.move_to_end(digest)
+
+    def forget_bodies(self) -> None:
+        """有媒体下载失败时清空摘要，用户重新打开视频的上报不会因为与之前的相同而被丢弃"""
+        with self.condition:
+            self.recent_bodies.clear()
+
+    def _expire_bodies(self, now: float) -> None:
+        while self.recent_bodies:
+            oldest, seen_at = next(iter(self.recent_bodies.items()))
+            if now - seen_at <= self.body_ttl and len(self.recent_bodies) < self.max_bodies:
+                break
+            del self.recent_bodies[oldest]
+
+    def submit(self, group: List[VideoData]) -> None:
+        """提交一组媒体，窗口内同一媒体的后续上报替换之前的（保留最新 token）"""
+        key = tuple(media_key(video_data.url) for video_data in group)
+
+        with self.condition:
+            if key in self.pending:
+                deadline, _ = self.pending[key]
+                self.pending[key] = (deadline, group)
+                self.merged += 1
+                return
+
+            self.pending[key] = (time.monotonic() + self.window, group)
+            self.condition.notify()
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+
+                now = time.monotonic()
+                ready = [key for key, (deadline, _) in self.pending.items() if deadline <= now]
+                if not ready:
+                    self.condition.wait(min(deadline for deadline, _ in self.pending.values()) - now)
+                    continue
+
+                groups = [self.pending.pop(key)[1] for key in ready]
+                self.flushed += len(groups)
+
+            for group in groups:
+                try:
+                    self.sink(group)
+                except Exception as e:
+                    logger.error(str(e), exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            'reports': self.reports,
+            'duplicate_bodies': self.duplicate_bodies,
+            'merged': self.merged,
+            'flushed': self.flushed,
+            'dropped': self.duplicate_bodies + self.merged,
+        }
@@ -0,0 +1,174 @@
+"""
+内容寻址存储
+下载时边写边算哈希（不需要额外读一遍文件），相同内容只在 .objects 下保存一份，
+用户看到的文件名是指向它的硬链接（或符号链接），重复抓取、重复上传的视频不再占用磁盘；
+索引是追加写入的日志（每保存一个文件追加一行），启动时重放
+"""
+import hashlib
+import json
+import os
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from utils.logger import logger
+
+BLOCK_SIZE = 1024 * 1024
+
+LINK_HARD = 'hardlink'
+LINK_SYMBOLIC = 'symlink'
+
+
+class BlockHasher:
+    """
+    分块哈希：多线程按区间写文件时，每个块只要是从头顺序写入的就直接在写入时计算，
+    乱序写入、被客户端流量捕获或解密改写过的块标记为脏块，最后从文件中重新读取这些块
+
+    最终哈希 = sha256(各块 sha256 依次拼接)，与块的写入顺序无关
+    """
+
+    def __init__(self, total_size: int, block_size: int = BLOCK_SIZE):
+        self.total_size = total_size
+        self.block_size = block_size
+        count = (total_size + block_size - 1) // block_size
+        self.hashers = [hashlib.sha256() for _ in range(count)]
+        # 每个块下一个期望写入的位置（块内偏移），-1 表示脏块
+        self.positions = [0] * count
+        self.digests: List[Optional[bytes]] = [None] * count
+        self.locks = [Lock() for _ in range(count)]
+        self.rehashed_bytes = 0
+
+    def _block_length(self, index: int) -> int:
+        return min(self.block_size, self.total_size - index * self.block_size)
+
+    def update(self, offset: int, data: bytes) -> None:
+        """记录写入 [offset, offset + len(data)) 的数据"""
+        view = memoryview(data)
+        while view and offset < self.total_size:
+            index = offset // self.block_size
+            inner = offset - index * self.block_size
+            piece = view[:self._block_length(index) - inner]
+
+            with self.locks[index]:
+                if self.positions[index] == inner:
+                    self.hashers[index].update(piece)
+                    self.positions[index] += len(piece)
+                    if self.positions[index] == self._block_length(index):
+                        self.digests[index] = self.hashers[index].digest()
+                elif self.digests[index] is None:
+                    self.positions[index] = -1
+
+            offset += len(piece)
+            view = view[len(piece):]
+
+    def invalidate(self, start: int, end: int) -> None:
+        """[start, end] 区间被改写过（例如原地解密），对应块需要重新读取"""
+        for index in range(start // self.block_size, min(end // self.block_size + 1, len(self.positions))):
+            with self.locks[index]:
+                self.positions[index] = -1
+                self.digests[index] = None
+
+    def hexdigest(self, path: str) -> str:
+        """补算脏块 / 未写完的块后返回整个文件的哈希"""
+        with open(path, 'rb') as f:
+            for index, digest in enumerate(self.digests):
+                if digest is None:
+                    f.seek(index * self.block_size)
+                    data = f.read(self._block_length(index))
+                    self.digests[index] = hashlib.sha256(data).digest()
+                    self.rehashed_bytes += len(data)
+        return hashlib.sha256(b''.join(self.digests)).hexdigest()
+
+
+class ContentStore:
+    """按内容哈希保存文件，文件名以链接形式指向 blob"""
+
+    def __init__(self, root: str, link_mode: str = LINK_HARD):
+        """
+        Args:
+            root: 下载目录，blob 保存在 root/.objects/<前两位>/<哈希><后缀>，哈希为 blob 内容的 BlockHasher 哈希
+            link_mode: hardlink 或 symlink；硬链接失败（跨文件系统等）时自动改用符号链接
+        """
+        self.root = root
+        self.objects_dir = os.path.join(root, '.objects')
+        self.index_path = os.path.join(self.objects_dir, 'index.jsonl')
+        self.link_mode = link_mode
+        self.lock = Lock()
+        # 哈希 -> {'size': 字节数, 'names': [相对 root 的文件名]}
+        self.index: Dict[str, dict] = {}
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self) -> None:
+        """重放索引日志，每行 {"digest", "size", "name"}；写到一半的行（进程被杀）跳过"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        entry = self.index.setdefault(record['digest'], {'size': record['size'], 'names': []})
+                        entry['names'].append(record['name'])
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning(f"[内容存储] 跳过损坏的索引记录: {line.strip()[:80]}")
+        except OSError as e:
+            logger.warning(f"[内容存储] 索引读取失败，重新开始记录: {e}")
+            self.index = {}
+
+    def _append_index(self, digest: str, size: int, name: str) -> None:
+        record = {'digest': digest, 'size': size, 'name': name}
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def blob_path(self, digest: str, suffix: str = '') -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest + suffix)
+
+    def store(self, path: str, digest: str, name_path: str) -> Tuple[str, bool]:
+        """
+        把已下载好的文件 path 存为 blob，并在 name_path 创建链接
+
+        Returns:
+            (blob 路径, 是否为重复内容)
+        """
+        suffix = os.path.splitext(name_path)[1]
+        blob = self.blob_path(digest, suffix)
+        size = os.path.getsize(path)
+
+        with self.lock:
+            duplicate = os.path.exists(blob)
+            if duplicate:
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(path, blob)
+
+            self._link(blob, name_path)
+
+            name = os.path.relpath(name_path, self.root)
+            entry = self.index.setdefault(digest, {'size': size, 'names': []})
+            entry['names'].append(name)
+            self._append_index(digest, size, name)
+
+        return blob, duplicate
+
+    def _link(self, blob: str, name_path: str) -> None:
+        if self.link_mode == LINK_HARD:
+            try:
+                os.link(blob, name_path)
+                return
+            except OSError as e:
+                logger.debug(f"[内容存储] 硬链接失败，改用符号链接: {e}")
+        os.symlink(os.path.relpath(blob, os.path.dirname(name_path)), name_path)
+
+    def stats(self) -> dict:
+        with self.lock:
+            logical = sum(entry['size'] * len(entry['names']) for entry in self.index.values())
+            stored = sum(entry['size'] for entry in self.index.values())
+            return {
+                'blobs': len(self.index),
+                'names': sum(len(entry['names']) for entry in self.index.values()),
+                'logical_bytes': logical,
+                'stored_bytes': stored,
+                'saved_bytes': logical - stored,
+            }
@@ -0,0 +1,146 @@
+"""
+下载任务控制接口
+代理在保留路径上提供本地 HTTP/JSON 接口（与 /res-downloader/wechat 上报接口一样，只响应 qq.com 域名下的路径）：
+
+    GET  /res-downloader/jobs                  未结束的任务（阶段、状态、进度、优先级）和当前限制
+    POST /res-downloader/jobs/<编号>/pause      暂停
+    POST /res-downloader/jobs/<编号>/resume     继续
+    POST /res-downloader/jobs/<编号>/cancel     取消
+    POST /res-downloader/jobs/<编号>/priority   {"priority": 10}，越大越先下载
+    GET  /res-downloader/limits                当前限速和并发数
+    POST /res-downloader/limits                {"bandwidth": 字节/秒（0 不限速）, "concurrency": 同时下载数}
+
+POST 必须是 Content-Type: application/json：浏览器跨域发送 JSON 之前要先预检（代理不响应预检），
+普通网页不能借用户的浏览器调用这些接口；
+代理监听所有网卡，控制接口和指标只响应本机（回环地址）的客户端，
+其他设备需要带上 X-Control-Token 请求头（配置 CONTROL_TOKEN，未配置时一律拒绝）
+
+parse 在代理进程中把请求转换为 (操作, 参数)，execute 在下载流水线所在的进程中执行
+（进程内下载时是同一个进程，使用下载服务时经 IPC 转发）
+"""
+import hmac
+import ipaddress
+import json
+from typing import Tuple
+
+from models.exceptions import ControlError
+
+JOBS_PATH = '/res-downloader/jobs'
+LIMITS_PATH = '/res-downloader/limits'
+JOB_ACTIONS = ('pause', 'resume', 'cancel', 'priority')
+TOKEN_HEADER = 'X-Control-Token'
+
+
+def is_control_path(path: str) -> bool:
+    path = path.split('?', 1)[0].rstrip('/')
+    return path in (JOBS_PATH, LIMITS_PATH) or path.startswith(JOBS_PATH + '/')
+
+
+def is_authorized(peer: str, token: str, expected: str) -> bool:
+    """
+    Args:
+        peer: 客户端地址
+        token: 请求中 X-Control-Token 的值
+        expected: 配置的令牌，为空时只允许本机
+    """
+    try:
+        address = ipaddress.ip_address(peer)
+        # IPv4 映射的 IPv6 地址（::ffff:127.0.0.1）
+        address = getattr(address, 'ipv4_mapped', None) or address
+        if address.is_loopback:
+            return True
+    except ValueError:
+        pass
+    return bool(expected) and hmac.compare_digest(token.encode(), expected.encode())
+
+
+def _read_json(content_type: str, body: bytes) -> dict:
+    if 'application/json' not in content_type.lower():
+        raise ControlError(415, "POST 请求需要 Content-Type: application/json")
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise ControlError(400, f"JSON 格式错误: {e}")
+    if not isinstance(data, dict):
+        raise ControlError(400, "请求体应为 JSON 对象")
+    return data
+
+
+def _read_int(data: dict, name: str) -> int:
+    try:
+        return int(data[name])
+    except KeyError:
+        raise ControlError(400, f"缺少参数: {name}")
+    except (TypeError, ValueError):
+        raise ControlError(400, f"参数应为整数: {name}")
+
+
+def parse(method: str, path: str, content_type: str = "", body: bytes = b"") -> Tuple[str, dict]:
+    """
+    Returns:
+        (操作, 参数)
+
+    Raises:
+        ControlError: 路径、方法或参数不正确
+    """
+    path = path.split('?', 1)[0].rstrip('/')
+    method = method.upper()
+
+    if path == JOBS_PATH:
+        if method != 'GET':
+            raise ControlError(405, "任务列表只支持 GET")
+        return 'jobs', {}
+
+    if path == LIMITS_PATH:
+        if method == 'GET':
+            return 'limits', {}
+        if method != 'POST':
+            raise ControlError(405, "限制只支持 GET / POST")
+        data = _read_json(content_type, body)
+        params = {name: _read_int(data, name) for name in ('bandwidth', 'concurrency') if name in data}
+        if not params:
+            raise ControlError(400, "需要 bandwidth 或 concurrency")
+        return 'set_limits', params
+
+    parts = path[len(JOBS_PATH) + 1:].split('/') if path.startswith(JOBS_PATH + '/') else []
+    if len(parts) != 2 or parts[1] not in JOB_ACTIONS:
+        raise ControlError(404, f"未知路径: {path}")
+    if method != 'POST':
+        raise ControlError(405, "任务操作只支持 POST")
+    try:
+        params = {'job_id': int(parts[0])}
+    except ValueError:
+        raise ControlError(400, f"任务编号应为整数: {parts[0]}")
+    data = _read_json(content_type, body)
+    if parts[1] == 'priority':
+        params['priority'] = _read_int(data, 'priority')
+    return parts[1], params
+
+
+def execute(pipeline, action: str, params: dict) -> Tuple[int, dict]:
+    """
+    在下载流水线上执行操作
+
+    Returns:
+        (HTTP 状态码, 响应内容)
+    """
+    handlers = {
+        'jobs': lambda: {'jobs': pipeline.list_jobs(), 'limits': pipeline.limits()},
+        'limits': pipeline.limits,
+        'set_limits': lambda: pipeline.set_limits(**params),
+        'pause': lambda: pipeline.pause(params['job_id']),
+        'resume': lambda: pipeline.resume(params['job_id']),
+        'cancel': lambda: pipeline.cancel(params['job_id']),
+        'priority': lambda: pipeline.set_priority(params['job_id'], params['priority']),
+    }
+    handler = handlers.get(action)
+    if handler is None:
+        return 404, {'error': f"未知操作: {action}"}
+    try:
+        return 200, handler()
+    except KeyError as e:
+        return 404, {'error': e.args[0] if e.args else str(e)}
+    except ValueError as e:
+        return 400, {'error': str(e)}
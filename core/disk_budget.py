@@ -0,0 +1,50 @@
+"""
+磁盘空间准入
+任务开始下载前按文件大小预留空间：剩余空间减去正在下载的任务已预留的部分，
+低于下限时任务延后执行，而不是下载到一半因磁盘写满失败
+"""
+import shutil
+from threading import Lock
+
+from utils.logger import logger
+
+
+class DiskBudget:
+    """下载目录所在磁盘的空间预算"""
+
+    def __init__(self, path: str, min_free: int = 512 * 1024 * 1024):
+        """
+        Args:
+            path: 下载目录
+            min_free: 至少保留的剩余空间（字节）
+        """
+        self.path = path
+        self.min_free = min_free
+        self.reserved = 0
+        self.deferred = 0
+        self.lock = Lock()
+
+    def acquire(self, size: int) -> bool:
+        """预留 size 字节，空间不足时返回 False（调用方稍后再试）"""
+        with self.lock:
+            try:
+                free = shutil.disk_usage(self.path).free
+            except OSError as e:
+                logger.debug(f"[磁盘] 获取剩余空间失败: {e}")
+                self.reserved += size
+                return True
+
+            if free - self.reserved - size < self.min_free:
+                self.deferred += 1
+                return False
+            self.reserved += size
+            return True
+
+    def release(self, size: int) -> None:
+        with self.lock:
+            self.reserved = max(0, self.reserved - size)
+
+    def stats(self) -> dict:
+        with self.lock:
+            free = shutil.disk_usage(self.path).free
+            return {'free': free, 'reserved': self.reserved, 'deferred': self.deferred}
@@ -0,0 +1,465 @@
+"""
+下载服务
+下载、解密、写文件都放到独立的进程中，mitmdump 进程只负责嗅探，
+通过本地 IPC（multiprocessing.connection，带 authkey）把 VideoData 交给下载服务，
+代理处理流量时不再和下载线程争抢 GIL
+
+协议为请求 / 响应：客户端发送 (操作, 参数)，服务端回复 ('ok', 结果) 或 ('error', 原因)
+
+代理进程一侧的客户端见 core/service_client.py
+
+启动: python -m core.download_service
+"""
+import itertools
+import time
+from multiprocessing.connection import Connection, Listener
+from threading import Condition, Lock, Thread
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils import import_profiler
+
+# --profile-startup：在导入下面的模块之前开始计时
+import_profiler.install_from_env()
+
+from core import startup
+from core import control_api
+from core.content_store import ContentStore
+from core.disk_budget import DiskBudget
+from core.name_index import NameIndex
+from core.passive_capture import merge_ranges
+from core.pipeline import DownloadPipeline
+from core.resume import STATE_ACTIVE, ResumeIndex
+from downloaders.media_rules import media_key
+from downloaders.small_downloader import SmallObjectDownloader
+from downloaders.video_downloader import format_size
+from models.entities import VideoData
+from utils.config import config
+from utils.logger import logger
+from utils.metrics import registry
+
+
+class DownloadService:
+    """下载后端：去重、续传、下载流水线；既可以在代理进程内使用，也可以由 ServiceServer 对外提供"""
+
+    def __init__(self, capture=None, on_failed: Optional[Callable[[VideoData], None]] = None):
+        """
+        Args:
+            capture: 被动捕获（进程内为 PassiveCapture，独立进程时为 CaptureMirror）
+            on_failed: 任务最终失败时额外的回调（批量下载据此重试）
+        """
+        self.on_failed = on_failed
+        self.downloaded_urls = set()
+        self.lock = Lock()
+        # 来源（代理进程）-> 计数；媒体标识 -> 入队它的来源
+        self.sources: Dict[str, Dict[str, int]] = {}
+        self.key_sources: Dict[str, str] = {}
+        self.resume_index = ResumeIndex()
+        self.pipeline = DownloadPipeline(
+            download_dir=config.download_dir,
+            capture=capture,
+            resume_index=self.resume_index,
+            small_downloader=SmallObjectDownloader(max_workers=config.small_object_workers),
+            content_store=ContentStore(config.download_dir, config.link_mode) if config.content_store else None,
+            name_index=NameIndex(config.download_dir, config.shard_mode),
+            disk_budget=DiskBudget(config.download_dir, config.min_free_space),
+            on_failed=self._on_failed,
+            on_completed=self._on_completed,
+            workers=config.stage_workers,
+            queue_size=config.stage_queue_size,
+            bandwidth_limit=config.bandwidth_limit
+        )
+        registry.collected('media_total', '各代理进程上报的媒体数（discovered 上报，accepted 入队，completed 完成，failed 失败）',
+                           self._collect_media, ('source', 'state'), kind='counter')
+        registry.collected('captured_bytes_total', '各代理进程从客户端流量中捕获的字节数',
+                           lambda: [((source,), c['captured']) for source, c in sorted(self.source_stats().items())],
+                           ('source',), kind='counter')
+
+    def start(self) -> None:
+        self.pipeline.start()
+
+    def submit(self, group: List[VideoData], source: str = "") -> List[str]:
+        """
+        一组媒体（同一帖子）入队：跳过已下载的；进行中的任务只换用新地址
+
+        Args:
+            group: 同一帖子的媒体
+            source: 上报的代理进程，用于分别统计
+
+        Returns:
+            没有入队、也没有进行中任务的地址（调用方据此移除被动捕获的登记）
+        """
+        accepted = []
+        with self.lock:
+            for video_data in group:
+                if video_data.url in self.downloaded_urls:
+                    continue
+                if self.resume_index.refresh(video_data) == STATE_ACTIVE:
+                    continue
+                # 还没开始下载的任务（排队、等待重试或磁盘空间）不在续传索引中，在流水线上换用新地址
+                if self.pipeline.refresh_url(video_data):
+                    continue
+                self.downloaded_urls.add(video_data.url)
+                self.key_sources[media_key(video_data.url)] = source
+                accepted.append(video_data)
+            counters = self._counters(source)
+            counters['discovered'] += len(group)
+            counters['accepted'] += len(accepted)
+
+        accepted_urls = {v.url for v in accepted}
+        rejected = [v.url for v in group if v.url not in accepted_urls and not self.pipeline.in_flight(v.url)]
+        if not accepted:
+            return rejected
+
+        for video_data in accepted:
+            desc = video_data.display_name
+            if len(group) > 1:
+                desc += f" [{video_data.index + 1}]"
+            size_info = f" ({format_size(video_data.size)})" if video_data.size else ""
+            encrypt_info = " 🔐" if video_data.is_encrypted else ""
+            logger.info(f"📥 {desc}{size_info}{encrypt_info}")
+
+        self.pipeline.submit(accepted)
+        return rejected
+
+    def _on_failed(self, video_data: VideoData) -> None:
+        """失败的任务允许再次嗅探后重新下载"""
+        with self.lock:
+            self.downloaded_urls.discard(video_data.url)
+            source = self.key_sources.pop(media_key(video_data.url), None)
+            if source is not None:
+                self._counters(source)['failed'] += 1
+        if self.on_failed:
+            self.on_failed(video_data)
+
+    def _on_completed(self, video_data: VideoData, size: int) -> None:
+        with self.lock:
+            source = self.key_sources.pop(media_key(video_data.url), None)
+            if source is not None:
+                counters = self._counters(source)
+                counters['completed'] += 1
+                counters['bytes'] += size
+
+    def _counters(self, source: str) -> Dict[str, int]:
+        counters = self.sources.get(source)
+        if counters is None:
+            counters = dict.fromkeys(('discovered', 'accepted', 'completed', 'failed', 'bytes', 'captured'), 0)
+            self.sources[source] = counters
+        return counters
+
+    def count_captured(self, source: str, size: int) -> None:
+        """代理进程从客户端流量中捕获的字节数"""
+        with self.lock:
+            self._counters(source)['captured'] += size
+
+    def control(self, action: str, params: dict) -> Tuple[int, dict]:
+        """控制接口的操作（core/control_api.py），返回 (HTTP 状态码, 响应内容)"""
+        return control_api.execute(self.pipeline, action, params)
+
+    def _collect_media(self) -> List[Tuple[Tuple[str, str], int]]:
+        return [
+            ((source, state), counters[state])
+            for source, counters in sorted(self.source_stats().items())
+            for state in ('discovered', 'accepted', 'completed', 'failed')
+        ]
+
+    def source_stats(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            return {source: dict(counters) for source, counters in self.sources.items()}
+
+    def stats(self) -> dict:
+        return {
+            'pipeline': self.pipeline.stats(),
+            'downloaded': len(self.downloaded_urls),
+            'sources': self.source_stats(),
+        }
+
+
+class MirrorEntry:
+    """代理进程中 CaptureEntry 在下载服务进程里的镜像，接口与 CaptureEntry 相同"""
+
+    def __init__(self, client_id: int, snapshot: dict):
+        self.client_id = client_id
+        self.condition = Condition()
+        self.update(snapshot)
+
+    def update(self, snapshot: dict) -> None:
+        with self.condition:
+            self.key = snapshot['key']
+            self.temp_path = snapshot['temp_path']
+            self.total_size = snapshot['total_size']
+            self.ranges = merge_ranges(snapshot['ranges'])
+            self.active = snapshot['active']
+            self.updated_at = time.monotonic()
+            self.condition.notify_all()
+
+    def completed_ranges(self) -> List[Tuple[int, int]]:
+        with self.condition:
+            return list(self.ranges)
+
+    @property
+    def captured_size(self) -> int:
+        return sum(end - start + 1 for start, end in self.completed_ranges())
+
+    def wait_idle(self, idle: float = 1.0, timeout: float = 15.0) -> int:
+        """等待代理进程中没有进行中的流（没有时立即返回），最多 timeout 秒；idle 只为与 CaptureEntry 接口一致"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.active:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                self.condition.wait(deadline - now)
+        return self.captured_size
+
+
+class CaptureMirror:
+    """
+    下载服务进程中的被动捕获视图：代理进程在流开始 / 结束时推送进度，
+    discard 时通知对应的代理进程停止写入并等待确认，之后才能重命名 / 改写临时文件
+    """
+
+    def __init__(self, server: 'ServiceServer', ack_timeout: float = 3.0):
+        self.server = server
+        self.ack_timeout = ack_timeout
+        self.entries: Dict[str, MirrorEntry] = {}
+        self.lock = Lock()
+
+    def update(self, client_id: int, snapshot: dict) -> int:
+        """
+        更新镜像；同一媒体只采用最先上报的代理进程的捕获
+
+        Returns:
+            新增的捕获字节数；其他代理进程已经在捕获时返回 -1
+        """
+        with self.lock:
+            entry = self.entries.get(snapshot['key'])
+            if entry is None:
+                entry = MirrorEntry(client_id, snapshot)
+                self.entries[snapshot['key']] = entry
+                return entry.captured_size
+        if entry.client_id != client_id:
+            return -1
+        before = entry.captured_size
+        entry.update(snapshot)
+        return entry.captured_size - before
+
+    def forget(self, url: str) -> None:
+        """只移除镜像，不通知代理进程"""
+        with self.lock:
+            self.entries.pop(media_key(url), None)
+
+    def get(self, url: str) -> Optional[MirrorEntry]:
+        with self.lock:
+            return self.entries.get(media_key(url))
+
+    def discard(self, url: str) -> None:
+        with self.lock:
+            entry = self.entries.pop(media_key(url), None)
+        if entry is None:
+            # 没有流经过代理时没有镜像，不知道是哪个代理进程登记的，通知所有代理进程（不等待确认）
+            self.server.broadcast(('discard', url))
+            return
+        if not self.server.notify(entry.client_id, ('discard', url), self.ack_timeout):
+            logger.warning(f"[下载服务] 代理进程 {entry.client_id} 未确认停止捕获: {url}")
+        # 其他代理进程也可能嗅探到同一媒体并登记了捕获
+        self.server.broadcast(('discard', url), exclude=entry.client_id)
+
+
+class ServiceServer:
+    """下载服务的 IPC 服务端，每个连接一个线程"""
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self.capture = CaptureMirror(self)
+        # 失败的媒体通知所有代理进程，重新打开视频的上报不会被当作重复丢弃
+        self.service = DownloadService(capture=self.capture,
+                                       on_failed=lambda video_data: self.broadcast(('failed', video_data.url)))
+
+        self.client_ids = itertools.count(1)
+        self.names: Dict[int, str] = {}
+        self.condition = Condition()
+        # 客户端编号 -> 待推送的事件
+        self.events: Dict[int, List[tuple]] = {}
+        # 等待确认的 (客户端编号, 事件) 和已确认的
+        self.waiting = set()
+        self.acked = set()
+
+        self.handlers: Dict[str, Callable] = {
+            'hello': self._hello,
+            'submit': self._submit,
+            'capture': self._capture,
+            'events': self._events,
+            'ack': self._ack,
+            'stats': self._stats,
+            'metrics': self._metrics,
+            'control': self._control,
+        }
+
+    def serve_forever(self) -> None:
+        self.service.start()
+        Thread(target=self._report_loop, name="service-report", daemon=True).start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            logger.success(f"✅下载服务已启动: {self.address[0]}:{self.address[1]} ({startup.elapsed_ms():.0f}ms)")
+            startup.log_import_profile()
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError) as e:
+                    logger.warning(f"[下载服务] 拒绝连接: {e}")
+                    continue
+                Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: Connection) -> None:
+        # 这个连接用于长轮询事件时对应的客户端，断开后清理它的事件队列
+        event_client = None
+        with conn:
+            while True:
+                try:
+                    op, payload = conn.recv()
+                except (EOFError, OSError):
+                    break
+                if op == 'events':
+                    event_client = payload[0]
+
+                handler = self.handlers.get(op)
+                try:
+                    if handler is None:
+                        raise ValueError(f"未知操作: {op}")
+                    reply = ('ok', handler(payload))
+                except Exception as e:
+                    logger.error(f"[下载服务] {op} 处理失败: {e}", exc_info=True)
+                    reply = ('error', str(e))
+
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    break
+
+        if event_client is not None:
+            with self.condition:
+                self.events.pop(event_client, None)
+            name = self.names.get(event_client, "")
+            logger.info(f"🔌代理进程已断开: #{event_client} {self._format_source(name)}")
+
+    def notify(self, client_id: int, event: tuple, timeout: float) -> bool:
+        """给代理进程推送事件并等待确认"""
+        token = (client_id, event)
+        with self.condition:
+            if client_id not in self.events:
+                return False
+            self.events[client_id].append(event)
+            self.waiting.add(token)
+            self.condition.notify_all()
+            acked = self.condition.wait_for(lambda: token in self.acked, timeout)
+            self.waiting.discard(token)
+            self.acked.discard(token)
+        return acked
+
+    def post(self, client_id: int, event: tuple) -> None:
+        """给代理进程推送事件，不等待确认"""
+        with self.condition:
+            if client_id in self.events:
+                self.events[client_id].append(event)
+                self.condition.notify_all()
+
+    def broadcast(self, event: tuple, exclude: Optional[int] = None) -> None:
+        with self.condition:
+            for client_id, events in self.events.items():
+                if client_id != exclude:
+                    events.append(event)
+            self.condition.notify_all()
+
+    def _format_source(self, name: str) -> str:
+        counters = self.service.source_stats().get(name)
+        if not counters:
+            return name
+        return (
+            f"{name} 上报: {counters['discovered']} | 入队: {counters['accepted']} | "
+            f"完成: {counters['completed']} ({format_size(counters['bytes'])}) | 失败: {counters['failed']} | "
+            f"捕获: {format_size(counters['captured'])}"
+        )
+
+    def report(self) -> None:
+        """输出各代理进程的嗅探和下载量"""
+        for name in sorted(self.service.source_stats()):
+            logger.info(f"[代理进程] {self._format_source(name)}")
+
+    def _report_loop(self, interval: float = 60.0) -> None:
+        """有变化时定期输出"""
+        last = {}
+        while True:
+            time.sleep(interval)
+            sources = self.service.source_stats()
+            if sources != last:
+                last = sources
+                self.report()
+
+    # ---- 各操作 ----
+
+    def _hello(self, payload: dict) -> int:
+        client_id = next(self.client_ids)
+        name = payload.get('name', '')
+        with self.condition:
+            self.events[client_id] = []
+            self.names[client_id] = name or f"#{client_id}"
+        logger.info(f"🔗代理进程已连接: #{client_id} {name}")
+        return client_id
+
+    def _submit(self, payload: Tuple[int, List[VideoData]]) -> List[str]:
+        client_id, group = payload
+        rejected = self.service.submit(group, source=self.names.get(client_id, ""))
+        for url in rejected:
+            self.capture.forget(url)
+        return rejected
+
+    def _capture(self, payload: Tuple[int, dict]) -> None:
+        client_id, snapshot = payload
+        captured = self.capture.update(client_id, snapshot)
+        if captured < 0:
+            # 另一个代理进程已经在捕获这个媒体，这里的登记和临时文件作废
+            self.post(client_id, ('drop', snapshot['key']))
+        elif captured:
+            self.service.count_captured(self.names.get(client_id, ""), captured)
+
+    def _events(self, payload: Tuple[int, float]) -> List[tuple]:
+        """长轮询：有事件或超时后返回"""
+        client_id, timeout = payload
+        with self.condition:
+            self.condition.wait_for(lambda: self.events.get(client_id), timeout)
+            events = self.events.get(client_id, [])
+            self.events[client_id] = []
+            return events
+
+    def _ack(self, payload: Tuple[int, List[tuple]]) -> None:
+        client_id, events = payload
+        with self.condition:
+            self.acked.update(token for token in ((client_id, event) for event in events) if token in self.waiting)
+            self.condition.notify_all()
+
+    def _stats(self, payload) -> dict:
+        return self.service.stats()
+
+    def _control(self, payload: Tuple[str, dict]) -> Tuple[int, dict]:
+        action, params = payload
+        return self.service.control(action, params)
+
+    def _metrics(self, payload) -> str:
+        """本进程（下载流水线）的指标文本，由代理进程拼到自己的指标后面"""
+        return registry.render()
+
+
+def main():
+    address = config.service_address
+    if address is None:
+        logger.error("❌未配置 DOWNLOAD_SERVICE（host:port）")
+        return
+    server = ServiceServer(address, config.service_authkey)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+拦截策略
+只对插件关心的域名做 TLS 解密，其余连接原样透传，并按域名统计流量数和 CPU 耗时
+"""
+import time
+from collections import defaultdict
+from threading import Lock
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+from mitmproxy import tls
+
+from utils.logger import logger
+
+INTERCEPT_ALL = 'all'
+INTERCEPT_SELECTIVE = 'selective'
+
+
+class HostStats:
+    """单个域名的统计"""
+
+    __slots__ = ('flows', 'passthrough', 'cpu_time')
+
+    def __init__(self):
+        self.flows = 0
+        self.passthrough = 0
+        self.cpu_time = 0.0
+
+
+class InterceptPolicy:
+    """拦截策略：域名白名单 + 统计"""
+
+    def __init__(self, host_rules: Iterable[str], mode: str = INTERCEPT_SELECTIVE):
+        """
+        Args:
+            host_rules: 需要拦截的域名后缀（来自插件的域名规则）
+            mode: all 拦截全部，selective 只拦截白名单
+        """
+        self.mode = mode
+        self.host_rules = tuple(rule.lower().lstrip('.') for rule in host_rules)
+        self.dynamic_hosts = set()
+        self.stats: Dict[str, HostStats] = defaultdict(HostStats)
+        self.lock = Lock()
+        self.started = time.process_time()
+
+    def allow_url(self, url: str) -> None:
+        """把嗅探到的视频 CDN 域名加入白名单"""
+        host = (urlsplit(url).hostname or '').lower()
+        if host and not self.is_allowed(host):
+            with self.lock:
+                self.dynamic_hosts.add(host)
+            logger.debug(f"[拦截策略] 加入 CDN 域名: {host}")
+
+    def is_allowed(self, host: Optional[str]) -> bool:
+        if self.mode == INTERCEPT_ALL:
+            return True
+        if not host:
+            return False
+
+        host = host.lower().rstrip('.')
+        if host in self.dynamic_hosts:
+            return True
+        return any(host == rule or host.endswith('.' + rule) for rule in self.host_rules)
+
+    def tls_clienthello(self, data: tls.ClientHelloData) -> None:
+        """不在白名单中的 TLS 连接不解密，直接透传"""
+        host = data.client_hello.sni
+        if not host and data.context.server.address:
+            host = data.context.server.address[0]
+
+        if not self.is_allowed(host):
+            data.ignore_connection = True
+            self.stats[host or '<unknown>'].passthrough += 1
+
+    def record(self, host: str, cpu_time: float, new_flow: bool = False) -> None:
+        """记录插件在某个域名上的处理耗时"""
+        stats = self.stats[host]
+        stats.cpu_time += cpu_time
+        if new_flow:
+            stats.flows += 1
+
+    def summary(self, top: int = 10) -> str:
+        rows = sorted(self.stats.items(), key=lambda item: (item[1].cpu_time, item[1].flows), reverse=True)
+        intercepted = sum(s.flows for s in self.stats.values())
+        passthrough = sum(s.passthrough for s in self.stats.values())
+
+        lines = [
+            f"拦截模式: {self.mode} | 解密流量: {intercepted} | 透传连接: {passthrough} | "
+            f"进程 CPU: {time.process_time() - self.started:.2f}s"
+        ]
+        for host, s in rows[:top]:
+            lines.append(f"  {host:<40} flows={s.flows:<6} passthrough={s.passthrough:<6} cpu={s.cpu_time * 1000:.1f}ms")
+        return '\n'.join(lines)
@@ -0,0 +1,93 @@
+"""
+下载阶段的任务队列
+替代下载阶段的 Queue：优先级高的任务先出队（同优先级先进先出），暂停的任务留在队列里但不出队，
+同时处理的任务数不超过 limit，limit 可以在运行中调整（控制接口调整并发数）
+"""
+from threading import Condition
+from typing import List, Optional
+
+
+class JobQueue:
+    """与 queue.Queue 相同的 put / get / task_done / qsize 接口，供 Stage 使用"""
+
+    def __init__(self, maxsize: int = 16, limit: int = 1):
+        """
+        Args:
+            maxsize: 未暂停的任务数达到该值时 put 阻塞（背压），暂停的任务不占名额
+            limit: 同时处理（get 之后、task_done 之前）的任务数上限
+        """
+        self.maxsize = maxsize
+        self.limit = limit
+        self.active = 0
+        # 按入队顺序，同优先级时先入队的先出队
+        self.items: List[object] = []
+        self.condition = Condition()
+
+    def _waiting(self) -> int:
+        return sum(1 for item in self.items if not getattr(item, 'paused', False))
+
+    def put(self, item) -> None:
+        with self.condition:
+            if not getattr(item, 'paused', False):
+                while self.maxsize > 0 and self._waiting() >= self.maxsize:
+                    self.condition.wait()
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def _next_index(self) -> Optional[int]:
+        best = None
+        for index, item in enumerate(self.items):
+            if item is None:
+                return index
+            if getattr(item, 'paused', False):
+                continue
+            if best is None or getattr(item, 'priority', 0) > getattr(self.items[best], 'priority', 0):
+                best = index
+        return best
+
+    def get(self):
+        """取出优先级最高的未暂停任务；正在处理的任务数达到 limit 时等待"""
+        with self.condition:
+            while True:
+                index = self._next_index()
+                if index is not None and (self.items[index] is None or self.active < self.limit):
+                    break
+                self.condition.wait()
+            item = self.items.pop(index)
+            if item is not None:
+                self.active += 1
+            self.condition.notify_all()
+            return item
+
+    def task_done(self) -> None:
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def qsize(self) -> int:
+        with self.condition:
+            return self._waiting()
+
+    def remove(self, item) -> bool:
+        """从队列中移除（取消），不在队列中时返回 False"""
+        with self.condition:
+            for index, queued in enumerate(self.items):
+                if queued is item:
+                    del self.items[index]
+                    self.condition.notify_all()
+                    return True
+            return False
+
+    def __contains__(self, item) -> bool:
+        with self.condition:
+            return any(queued is item for queued in self.items)
+
+    def changed(self) -> None:
+        """任务的优先级 / 暂停状态变化后调用，唤醒等待的线程"""
+        with self.condition:
+            self.condition.notify_all()
+
+    def set_limit(self, limit: int) -> None:
+        with self.condition:
+            self.limit = max(1, limit)
+            self.condition.notify_all()
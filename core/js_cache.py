@@ -0,0 +1,81 @@
+"""
+JS 改写结果缓存
+同一个页面 / JS 包在每次加载、每个客户端上都会重复解码、正则替换、再编码，
+这里按 请求地址 + ETag（没有时用内容摘要）缓存改写后的原始字节，命中时直接替换响应体
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from mitmproxy import http
+
+
+class RewriteCache:
+    """改写结果 LRU 缓存，按条目数和总字节数限制大小"""
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple, Tuple[bytes, int]]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    @staticmethod
+    def make_key(flow: http.HTTPFlow) -> Tuple:
+        """
+        缓存键：地址 + 编码 + ETag，没有 ETag 时对原始响应体做一次摘要
+        只用于 200 响应，206 等部分内容不能按地址缓存
+        """
+        response = flow.response
+        etag = response.headers.get('ETag')
+        version = etag or hashlib.blake2b(response.raw_content or b'', digest_size=16).digest()
+        return flow.request.url, response.headers.get('Content-Encoding', ''), version
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        item = self.entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.bytes_saved += item[1]
+        return item[0]
+
+    def put(self, key: Tuple, raw_content: bytes, source_size: int) -> None:
+        """
+        Args:
+            key: 缓存键
+            raw_content: 改写并重新编码后的响应体
+            source_size: 改写前解码后的大小，命中时计入节省的处理字节数
+        """
+        if len(raw_content) > self.max_bytes:
+            return
+
+        old = self.entries.pop(key, None)
+        if old:
+            self.size -= len(old[0])
+
+        self.entries[key] = (raw_content, source_size)
+        self.size += len(raw_content)
+
+        while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self.entries),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'bytes_saved': self.bytes_saved,
+        }
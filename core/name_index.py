@@ -0,0 +1,93 @@
+"""
+文件名索引
+启动时扫描一次下载目录，之后在内存中分配不重名的文件名（name、name_1、name_2 ...），
+每个文件名只需要常数时间，不再对大目录逐个 stat；
+可选按日期或哈希前缀分子目录保存，避免单个目录过大
+"""
+import hashlib
+import os
+import time
+from threading import Lock
+from typing import Dict, Optional, Set, Tuple
+
+SHARD_NONE = 'none'
+SHARD_DATE = 'date'
+SHARD_HASH = 'hash'
+
+
+class NameIndex:
+    """下载目录的文件名索引"""
+
+    def __init__(self, root: str, shard: str = SHARD_NONE):
+        """
+        Args:
+            root: 下载目录
+            shard: none 不分目录；date 按日期（2024-01-31/）；hash 按文件名哈希前两位（3f/）
+        """
+        self.root = root
+        self.shard = shard
+        self.lock = Lock()
+        # 目录 -> 已占用的文件名（包括正在下载的）
+        self.taken: Dict[str, Set[str]] = {}
+        # (目录, 文件名主体, 后缀) -> 下一个尝试的序号
+        self.next_counter: Dict[Tuple[str, str, str], int] = {}
+
+        with self.lock:
+            self._names_in(root)
+
+    def _names_in(self, directory: str) -> Set[str]:
+        """目录第一次用到时扫描一次"""
+        names = self.taken.get(directory)
+        if names is None:
+            os.makedirs(directory, exist_ok=True)
+            with os.scandir(directory) as entries:
+                names = {entry.name for entry in entries}
+            self.taken[directory] = names
+        return names
+
+    def _directory_for(self, filename: str) -> str:
+        if self.shard == SHARD_DATE:
+            return os.path.join(self.root, time.strftime('%Y-%m-%d'))
+        if self.shard == SHARD_HASH:
+            return os.path.join(self.root, hashlib.md5(filename.encode()).hexdigest()[:2])
+        return self.root
+
+    def reserve(self, filename: str, directory: Optional[str] = None) -> str:
+        """
+        分配一个不重名的路径并立即占用
+
+        Returns:
+            完整路径
+        """
+        stem, suffix = os.path.splitext(filename)
+
+        with self.lock:
+            directory = directory or self._directory_for(filename)
+            names = self._names_in(directory)
+
+            if filename in names:
+                key = (directory, stem, suffix)
+                counter = self.next_counter.get(key, 1)
+                filename = f"{stem}_{counter}{suffix}"
+                while filename in names:
+                    counter += 1
+                    filename = f"{stem}_{counter}{suffix}"
+                self.next_counter[key] = counter + 1
+
+            names.add(filename)
+        return os.path.join(directory, filename)
+
+    def release(self, path: str) -> None:
+        """下载失败、没有生成文件时释放文件名"""
+        directory, filename = os.path.split(path)
+        with self.lock:
+            names = self.taken.get(directory)
+            if names is not None:
+                names.discard(filename)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'directories': len(self.taken),
+                'names': sum(len(names) for names in self.taken.values()),
+            }
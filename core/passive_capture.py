@@ -0,0 +1,265 @@
+"""
+被动捕获
+微信客户端自己播放视频时的 CDN 流量本来就经过代理，
+这里把这些响应体（包括 206 分段）顺手写入任务的 .tmp 文件，
+下载器只需要补齐客户端没有请求过的区间
+"""
+import hashlib
+import os
+import re
+import time
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from downloaders.media_rules import media_key
+from models.entities import VideoData
+from utils.logger import logger
+
+if TYPE_CHECKING:
+    # 只用于类型标注；下载服务进程用到 merge_ranges 时不需要加载 mitmproxy
+    from mitmproxy import http
+
+CONTENT_RANGE_REGEX = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """合并闭区间列表"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class CaptureEntry:
+    """单个视频的捕获状态"""
+
+    def __init__(
+        self,
+        key: str,
+        temp_path: str,
+        total_size: int = 0,
+        on_change: Optional[Callable[[dict], None]] = None
+    ):
+        """
+        Args:
+            on_change: 流开始 / 结束时调用，参数为 snapshot()（把捕获进度同步给下载服务进程）
+        """
+        self.key = key
+        self.temp_path = temp_path
+        self.total_size = total_size
+        self.on_change = on_change
+        self.lock = Lock()
+        self.closed = False
+        self._ranges: List[Tuple[int, int]] = []
+        self._active: Dict[int, List[int]] = {}
+        self._next_stream_id = 0
+
+    def completed_ranges(self) -> List[Tuple[int, int]]:
+        """已经写入文件的字节区间（闭区间），包含仍在传输中的流"""
+        with self.lock:
+            ranges = self._ranges + [
+                (start, pos - 1) for start, pos in self._active.values() if pos > start
+            ]
+        return merge_ranges(ranges)
+
+    def snapshot(self) -> dict:
+        """已结束的流写入的区间和进行中的流数量"""
+        with self.lock:
+            return {
+                'key': self.key,
+                'temp_path': self.temp_path,
+                'total_size': self.total_size,
+                'ranges': list(self._ranges),
+                'active': len(self._active),
+            }
+
+    def _notify(self) -> None:
+        if self.on_change:
+            self.on_change(self.snapshot())
+
+    @property
+    def captured_size(self) -> int:
+        return sum(end - start + 1 for start, end in self.completed_ranges())
+
+    def wait_idle(self, idle: float = 1.0, timeout: float = 15.0) -> int:
+        """
+        等待客户端的流量告一段落（没有进行中的流且 idle 秒内没有新数据）；
+        没有进行中的流时立即返回，不让下载等待
+
+        Returns:
+            已捕获的字节数
+        """
+        with self.lock:
+            if not self._active:
+                return sum(end - start + 1 for start, end in self._ranges)
+        deadline = time.monotonic() + timeout
+        last_size = -1
+        last_change = time.monotonic()
+        while time.monotonic() < deadline:
+            size = self.captured_size
+            if size != last_size:
+                last_size = size
+                last_change = time.monotonic()
+            with self.lock:
+                active = bool(self._active)
+            if not active and time.monotonic() - last_change >= idle:
+                break
+            time.sleep(0.2)
+        return last_size
+
+    def open_stream(self, start: int) -> Callable[[bytes], bytes]:
+        """
+        返回 mitmproxy 的流式回调，把经过的数据写入 start 开始的位置；
+        流正常结束时 mitmproxy 以 b"" 调用，被中止时不会调用，需要调用回调的 finish()
+        """
+        with self.lock:
+            stream_id = self._next_stream_id
+            self._next_stream_id += 1
+            self._active[stream_id] = [start, start]
+        self._notify()
+
+        fd = os.open(self.temp_path, os.O_RDWR | os.O_CREAT, 0o644)
+        state = {'fd': fd}
+
+        def finish():
+            with self.lock:
+                span = self._active.pop(stream_id, None)
+                if span and span[1] > span[0]:
+                    self._ranges = merge_ranges(self._ranges + [(span[0], span[1] - 1)])
+            if state['fd'] is not None:
+                os.close(state['fd'])
+                state['fd'] = None
+                # 已经 discard / drop 的不再上报，避免下载服务重新建立镜像
+                if not self.closed:
+                    self._notify()
+
+        def stream(data: bytes) -> bytes:
+            if state['fd'] is None:
+                return data
+            if not data:
+                finish()
+                return data
+            try:
+                with self.lock:
+                    span = self._active.get(stream_id)
+                    if self.closed or span is None:
+                        span = None
+                    else:
+                        os.pwrite(state['fd'], data, span[1])
+                        span[1] += len(data)
+                if span is None:
+                    finish()
+            except OSError as e:
+                logger.warning(f"[被动捕获] 写入失败: {e}")
+                finish()
+            return data
+
+        stream.finish = finish
+        return stream
+
+    def close(self) -> None:
+        """停止接收新的数据，之后的流只转发不写入"""
+        with self.lock:
+            self.closed = True
+            for start, pos in self._active.values():
+                if pos > start:
+                    self._ranges.append((start, pos - 1))
+            self._ranges = merge_ranges(self._ranges)
+            self._active.clear()
+
+
+class PassiveCapture:
+    """被动捕获管理：按媒体标识匹配客户端的 CDN 请求"""
+
+    def __init__(self, capture_dir: str, on_change: Optional[Callable[[dict], None]] = None):
+        """
+        Args:
+            capture_dir: 临时文件目录
+            on_change: 传给每个 CaptureEntry 的进度回调
+        """
+        self.capture_dir = capture_dir
+        self.on_change = on_change
+        self.entries: Dict[str, CaptureEntry] = {}
+        # flow.id -> 流的 finish()，流被中止（error 钩子）时用来关闭文件并记录已写入的区间
+        self.streams: Dict[str, Callable[[], None]] = {}
+        self.lock = Lock()
+        os.makedirs(capture_dir, exist_ok=True)
+
+    def register(self, video_data: VideoData) -> CaptureEntry:
+        """登记一个已嗅探的视频，之后客户端对同一媒体的请求都会被捕获"""
+        key = media_key(video_data.url)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                name = hashlib.md5(key.encode()).hexdigest()[:16]
+                temp_path = os.path.join(self.capture_dir, f"{name}.tmp")
+                entry = CaptureEntry(key, temp_path, video_data.size, self.on_change)
+                self.entries[key] = entry
+            return entry
+
+    def get(self, url: str) -> Optional[CaptureEntry]:
+        with self.lock:
+            return self.entries.get(media_key(url))
+
+    def discard(self, url: str) -> None:
+        """任务结束后移除捕获状态（文件由下载器负责）"""
+        with self.lock:
+            entry = self.entries.pop(media_key(url), None)
+        if entry:
+            entry.close()
+
+    def drop(self, key: str) -> None:
+        """另一个代理进程已经在捕获同一媒体：停止捕获并删除临时文件"""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        if entry:
+            entry.close()
+            if os.path.exists(entry.temp_path):
+                os.remove(entry.temp_path)
+
+    def attach(self, flow: 'http.HTTPFlow') -> bool:
+        """在 responseheaders 阶段调用，命中时为响应挂上流式写入回调"""
+        request = flow.request
+        response = flow.response
+        if request.method != 'GET' or response.status_code not in (200, 206):
+            return False
+        if response.headers.get('Content-Encoding'):
+            return False
+
+        entry = self.get(request.url)
+        if entry is None or entry.closed:
+            return False
+
+        if response.status_code == 206:
+            match = CONTENT_RANGE_REGEX.match(response.headers.get('Content-Range', ''))
+            if not match:
+                return False
+            start = int(match.group(1))
+            total = int(match.group(3)) if match.group(3) != '*' else 0
+        else:
+            start = 0
+            total = int(response.headers.get('Content-Length', 0) or 0)
+
+        if total:
+            if entry.total_size and entry.total_size != total:
+                logger.debug(f"[被动捕获] 大小不一致，跳过: {entry.total_size} != {total}")
+                return False
+            entry.total_size = total
+
+        stream = entry.open_stream(start)
+        with self.lock:
+            self.streams[flow.id] = stream.finish
+        flow.response.stream = stream
+        logger.debug(f"[被动捕获] 捕获客户端流量: {request.host} offset={start}")
+        return True
+
+    def finish_flow(self, flow: 'http.HTTPFlow') -> None:
+        """流结束（response 钩子）或被中止（error 钩子，客户端拖动进度或关闭播放器）后调用"""
+        with self.lock:
+            finish = self.streams.pop(flow.id, None)
+        if finish:
+            finish()
@@ -0,0 +1,822 @@
+"""
+下载流水线
+发现 -> 下载 -> 解密 -> 校验 -> 完成（重命名），各阶段之间用有界队列连接，
+每个阶段有独立的线程数；下游处理不过来时上游阻塞（背压），
+一个视频解密时不会再挡住下一个视频的网络传输
+
+运行指标（utils/metrics.py）：各阶段耗时、重试 / 失败原因、解密 CPU 时间，
+队列深度、进行中的下载和已下载字节数在导出时读取
+
+控制接口（core/control_api.py）：列出任务，暂停 / 继续 / 取消 / 调整优先级，
+调整全局限速和下载并发数；下载阶段的队列为 JobQueue，取消在下载器中协作完成
+"""
+import itertools
+import os
+import shutil
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from queue import Queue
+from threading import Lock, Thread, Timer
+from typing import Callable, Dict, List, Optional
+
+from core.content_store import BlockHasher, ContentStore
+from core.disk_budget import DiskBudget
+from core.job_queue import JobQueue
+from core.name_index import NameIndex
+from core.passive_capture import merge_ranges
+from core.resume import ResumeIndex
+from crypto.decryptor import ENCRYPTED_LENGTH, decrypt_wechat_video
+from downloaders.m3u8_downloader import M3U8Downloader
+from downloaders.media_rules import is_m3u8_url, is_small_object, media_key
+from downloaders.rate_limiter import RateLimiter
+from downloaders.small_downloader import SmallObjectDownloader
+from downloaders.video_downloader import VideoDownloader, format_size, generate_filename
+from models.entities import DownloadJob, SmallObjectTask, VideoData
+from models.exceptions import DecryptError, DownloadError
+from utils.config import config
+from utils.logger import logger, progress_throttle
+from utils.metrics import registry
+from utils.mp4 import faststart, verify_mp4
+
+STAGE_SECONDS = registry.histogram(
+    'stage_seconds', '各阶段耗时（秒），probe / transfer 为 fetch 中的探测和传输，finalize 为重命名', ('stage',))
+RETRIES = registry.counter('retries_total', '重新下载的次数', ('reason',))
+FAILURES = registry.counter('failures_total', '最终失败的任务数', ('reason',))
+COMPLETED = registry.counter('completed_total', '完成的任务数', ('media_type',))
+CANCELLED = registry.counter('cancelled_total', '通过控制接口取消的任务数')
+DECRYPT_CPU = registry.counter('decrypt_cpu_seconds_total', '解密消耗的 CPU 时间（秒）')
+
+
+def create_progress_callback(name: str = "", job_id: Optional[int] = None):
+    """
+    进度回调，name 不为空时作为日志前缀（并发下载时区分文件）；
+    设置了 LOG_SAMPLE_INTERVAL 时同一任务的进度日志限频，100% 总是输出
+    """
+    prefix = f"{name} " if name else ""
+    log = logger.bind(job=job_id) if job_id is not None else logger
+    state = {
+        'last_progress': 0,
+        'last_time': time.time(),
+        'last_percent': -1
+    }
+    throttle_key = f"progress-{job_id if job_id is not None else id(state)}"
+
+    def progress_callback(downloaded, total):
+        if total > 0:
+            percent = int(downloaded * 100 / total)
+            percent_tier = percent // 10
+
+            if percent_tier > state['last_percent']:
+                state['last_percent'] = percent_tier
+                if progress_throttle.allow(throttle_key, force=percent >= 100) is None:
+                    return
+                if percent >= 100:
+                    progress_throttle.forget(throttle_key)
+
+                current_time = time.time()
+                elapsed = current_time - state['last_time']
+                if elapsed > 0:
+                    speed = (downloaded - state['last_progress']) / elapsed
+                    speed_str = format_size(int(speed)) + "/s"
+                    log.info(f"{prefix}{percent}% ({format_size(int(downloaded))}/{format_size(int(total))}) {speed_str}")
+                else:
+                    log.info(f"{prefix}{percent}% ({format_size(int(downloaded))}/{format_size(int(total))})")
+
+                state['last_progress'] = downloaded
+                state['last_time'] = current_time
+
+    return progress_callback
+
+
+class Stage:
+    """流水线阶段：有界输入队列 + 固定数量的工作线程"""
+
+    def __init__(self, name: str, handler: Callable, workers: int = 1, maxsize: int = 16, queue=None):
+        """
+        Args:
+            name: 阶段名称
+            handler: 处理函数，返回 None 表示不再往下传，返回列表时逐个传给下一阶段
+            workers: 工作线程数
+            maxsize: 输入队列长度，满了之后 put 阻塞（背压）
+            queue: 自定义输入队列（JobQueue），默认为 Queue(maxsize)
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = queue if queue is not None else Queue(maxsize=maxsize)
+        self.next: Optional['Stage'] = None
+        self.threads = 0
+
+        self.lock = Lock()
+        self.active = 0
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.max_time = 0.0
+
+    def put(self, item) -> None:
+        if isinstance(item, DownloadJob):
+            item.stage, item.running = self.name, False
+        self.queue.put(item)
+
+    def start(self) -> None:
+        self.add_workers(self.workers)
+
+    def add_workers(self, count: int) -> None:
+        """增加工作线程（调高并发数时），线程不会减少"""
+        for _ in range(count):
+            Thread(target=self._run, name=f"{self.name}-{self.threads}", daemon=True).start()
+            self.threads += 1
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            with self.lock:
+                self.active += 1
+            if isinstance(item, DownloadJob):
+                item.running = True
+            started = time.perf_counter()
+            result = None
+            try:
+                # 处理过程中的日志带上任务编号（JSON 日志中的 job 字段）
+                with logger.contextualize(job=getattr(item, 'job_id', None)):
+                    result = self.handler(item)
+            except Exception as e:
+                logger.error(f"[{self.name}] {e}", exc_info=True)
+                with self.lock:
+                    self.errors += 1
+            finally:
+                elapsed = time.perf_counter() - started
+                if isinstance(item, DownloadJob):
+                    item.running = False
+                with self.lock:
+                    self.active -= 1
+                    self.processed += 1
+                    self.busy_time += elapsed
+                    self.max_time = max(self.max_time, elapsed)
+                STAGE_SECONDS.observe(elapsed, stage=self.name)
+
+            if result is not None and self.next:
+                for output in (result if isinstance(result, list) else [result]):
+                    self.next.put(output)
+            self.queue.task_done()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'depth': self.queue.qsize(),
+                'active': self.active,
+                'processed': self.processed,
+                'errors': self.errors,
+                'avg_ms': self.busy_time / self.processed * 1000 if self.processed else 0.0,
+                'max_ms': self.max_time * 1000,
+            }
+
+
+class DownloadPipeline:
+    """下载流水线"""
+
+    STAGES = ('discover', 'fetch', 'decrypt', 'verify', 'finalize')
+
+    # 磁盘空间不足时任务延后的时间（秒）
+    DEFER_DELAY = 30.0
+
+    def __init__(
+        self,
+        download_dir: str,
+        capture=None,
+        resume_index: Optional[ResumeIndex] = None,
+        small_downloader: Optional[SmallObjectDownloader] = None,
+        content_store: Optional[ContentStore] = None,
+        name_index: Optional[NameIndex] = None,
+        disk_budget: Optional[DiskBudget] = None,
+        on_failed: Optional[Callable[[VideoData], None]] = None,
+        on_completed: Optional[Callable[[VideoData, int], None]] = None,
+        workers: Optional[Dict[str, int]] = None,
+        queue_size: int = 16,
+        max_retries: int = 2,
+        report_interval: float = 30.0,
+        bandwidth_limit: int = 0
+    ):
+        """
+        Args:
+            download_dir: 保存目录
+            capture: 被动捕获管理器（PassiveCapture）
+            resume_index: 断点续传索引
+            small_downloader: 小文件下载器
+            content_store: 内容寻址存储，为 None 时直接保存为文件
+            name_index: 文件名索引，默认为不分子目录的 download_dir
+            disk_budget: 磁盘空间准入，默认保留 512MB
+            on_failed: 任务最终失败时的回调（例如允许再次嗅探）
+            on_completed: 任务完成时的回调，参数为媒体和文件大小
+            workers: 各阶段线程数，如 {'fetch': 2}
+            queue_size: 各阶段输入队列长度
+            max_retries: 解密 / 校验失败后重新下载的次数
+            report_interval: 有任务时输出各阶段统计的间隔（秒，debug 级别）
+            bandwidth_limit: 所有下载共用的限速（字节/秒），0 为不限速，可通过控制接口调整
+        """
+        self.download_dir = download_dir
+        self.capture = capture
+        self.resume_index = resume_index or ResumeIndex()
+        self.content_store = content_store
+        self.on_failed = on_failed
+        self.on_completed = on_completed
+        self.max_retries = max_retries
+        self.report_interval = report_interval
+        self.job_ids = itertools.count(1)
+        # 媒体标识 -> 未结束的任务数；任务编号 -> 未结束的任务（控制接口）
+        self.in_flight_keys: Dict[str, int] = {}
+        self.jobs: Dict[int, DownloadJob] = {}
+        self.in_flight_lock = Lock()
+        self.names = name_index or NameIndex(download_dir)
+        # 续传索引淘汰失败任务时释放它预留的文件名
+        if self.resume_index.names is None:
+            self.resume_index.names = self.names
+        self.disk_budget = disk_budget or DiskBudget(download_dir)
+        # 任务编号 -> 进行中的下载器；已结束的下载从网络读取的字节数（只在下载开始 / 结束和导出指标时加锁）
+        self.downloaders: Dict[int, object] = {}
+        self.transferred_bytes = 0
+        self.transfer_lock = Lock()
+        self.rate_limiter = RateLimiter(bandwidth_limit)
+        self.small_downloader = small_downloader or SmallObjectDownloader()
+        # 小文件与视频共用限速；传入的下载器没有自己的限速器时也接上
+        if self.small_downloader.rate_limiter is None:
+            self.small_downloader.rate_limiter = self.rate_limiter
+
+        workers = workers or {}
+        handlers = [self._discover, self._fetch, self._decrypt, self._verify, self._finalize]
+        # 下载阶段：按优先级出队，并发数可调
+        self.fetch_queue = JobQueue(queue_size, limit=workers.get('fetch', 1))
+        self.stages = [
+            Stage(name, self._guard(handler), workers.get(name, 1), queue_size,
+                  queue=self.fetch_queue if name == 'fetch' else None)
+            for name, handler in zip(self.STAGES, handlers)
+        ]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next = next_stage
+        self.stage = {stage.name: stage for stage in self.stages}
+        self._register_metrics()
+
+    def _register_metrics(self) -> None:
+        registry.collected('stage_queue_depth', '各阶段队列中等待的任务数',
+                           lambda: [((name,), s['depth']) for name, s in self.stats().items()], ('stage',))
+        registry.collected('stage_active', '各阶段正在处理的任务数',
+                           lambda: [((name,), s['active']) for name, s in self.stats().items()], ('stage',))
+        registry.collected('active_downloads', '进行中的下载数', lambda: [((), len(self.downloaders))])
+        registry.collected('disk_free_bytes', '下载目录所在磁盘的剩余空间',
+                           lambda: [((), self.disk_budget.stats()['free'])])
+        registry.collected('disk_reserved_bytes', '进行中的下载预留的磁盘空间',
+                           lambda: [((), self.disk_budget.stats()['reserved'])])
+        registry.collected('disk_deferred_total', '准入时磁盘空间不足而延后的次数',
+                           lambda: [((), self.disk_budget.stats()['deferred'])], kind='counter')
+        registry.collected('downloaded_bytes_total', '从网络下载的字节数（含进行中的下载）',
+                           lambda: [((), self.downloaded_bytes())], kind='counter')
+
+    def downloaded_bytes(self) -> int:
+        """已结束和进行中的下载从网络读取的字节数；进行中的从下载器读取，不在读数据的循环里累加"""
+        with self.transfer_lock:
+            return self.transferred_bytes + sum(d.transferred_size() for d in self.downloaders.values())
+
+    def _count_transferred(self, size: int) -> None:
+        with self.transfer_lock:
+            self.transferred_bytes += size
+
+    def start(self) -> None:
+        for stage in self.stages:
+            stage.start()
+        if self.report_interval > 0:
+            Thread(target=self._report_loop, name="pipeline-report", daemon=True).start()
+
+    def submit(self, group: List[VideoData]) -> None:
+        """提交一组媒体（同一帖子），队列满时阻塞"""
+        with self.in_flight_lock:
+            for video_data in group:
+                key = media_key(video_data.url)
+                self.in_flight_keys[key] = self.in_flight_keys.get(key, 0) + 1
+        self.stage['discover'].put(group)
+
+    def pending(self) -> int:
+        """未结束的任务数（包括还在发现阶段队列中的）"""
+        with self.in_flight_lock:
+            return sum(self.in_flight_keys.values())
+
+    def in_flight(self, url: str) -> bool:
+        """同一媒体是否有尚未完成的任务"""
+        with self.in_flight_lock:
+            return media_key(url) in self.in_flight_keys
+
+    def refresh_url(self, video_data: VideoData) -> bool:
+        """
+        同一媒体换了 token 再次被嗅探：还没开始下载的任务（排队、等待重试或磁盘空间）换用新地址，
+        下载中的由续传索引换到下载器上
+
+        Returns:
+            同一媒体是否有尚未完成的任务
+        """
+        key = media_key(video_data.url)
+        with self.in_flight_lock:
+            jobs = [job for job in self.jobs.values()
+                    if media_key(job.video_data.url) == key and job.video_data.size == video_data.size]
+            pending = key in self.in_flight_keys
+        for job in jobs:
+            if job.video_data.url != video_data.url:
+                job.video_data.url = video_data.url
+                logger.info(f"🔄{job.name} 地址已刷新")
+        return pending
+
+    def _job_done(self, job: DownloadJob) -> None:
+        key = media_key(job.video_data.url)
+        with self.in_flight_lock:
+            self.jobs.pop(job.job_id, None)
+            count = self.in_flight_keys.get(key, 0) - 1
+            if count > 0:
+                self.in_flight_keys[key] = count
+            else:
+                self.in_flight_keys.pop(key, None)
+
+    def stats(self) -> Dict[str, dict]:
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def summary(self) -> str:
+        return ' | '.join(
+            f"{name}: 队列 {s['depth']} 处理中 {s['active']} 完成 {s['processed']} 平均 {s['avg_ms']:.0f}ms"
+            for name, s in self.stats().items()
+        )
+
+    def _report_loop(self) -> None:
+        while True:
+            time.sleep(self.report_interval)
+            if any(s['depth'] or s['active'] for s in self.stats().values()):
+                logger.debug(f"[流水线] {self.summary()}")
+
+    # ---- 控制接口 ----
+
+    def job_info(self, job: DownloadJob) -> dict:
+        downloader = self.downloaders.get(job.job_id)
+        if job.cancelled:
+            status = 'cancelling'
+        elif job.paused:
+            status = 'paused'
+        else:
+            status = 'running' if job.running else 'queued'
+        return {
+            'id': job.job_id,
+            'name': job.name,
+            'url': job.video_data.url,
+            'stage': job.stage,
+            'status': status,
+            'priority': job.priority,
+            'size': job.video_data.size,
+            'downloaded': downloader.downloaded_size if downloader else sum(e - s + 1 for s, e in job.resume_ranges),
+            'attempts': job.attempts,
+        }
+
+    def list_jobs(self) -> List[dict]:
+        """未结束的任务，按任务编号排序"""
+        with self.in_flight_lock:
+            jobs = sorted(self.jobs.values(), key=lambda job: job.job_id)
+        return [self.job_info(job) for job in jobs]
+
+    def _get_job(self, job_id: int) -> DownloadJob:
+        with self.in_flight_lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"任务不存在或已结束: {job_id}")
+        return job
+
+    def pause(self, job_id: int) -> dict:
+        """
+        暂停等待下载或下载中的任务：下载中的停止传输并放回队列，已下载的部分保留，继续时接着下载
+        （m3u8 不能续传，继续时重新下载；跟随中的直播列表暂停即停止，保存已录制的部分）
+        """
+        job = self._get_job(job_id)
+        if job.cancelled:
+            raise ValueError(f"任务已取消: {job_id}")
+        if job.stage != 'fetch':
+            raise ValueError(f"只能暂停等待下载或下载中的任务，当前阶段: {job.stage}")
+        if not job.paused:
+            job.paused = True
+            # 先设置标记再查找下载器，与 _run_downloader 的登记顺序相反，不会两边都错过
+            downloader = self.downloaders.get(job_id)
+            if downloader:
+                downloader.cancel()
+            self.fetch_queue.changed()
+            logger.info(f"⏸️{job.name} 已暂停")
+        return self.job_info(job)
+
+    def resume(self, job_id: int) -> dict:
+        job = self._get_job(job_id)
+        if job.paused:
+            job.paused = False
+            self.fetch_queue.changed()
+            logger.info(f"▶️{job.name} 继续下载")
+        return self.job_info(job)
+
+    def cancel(self, job_id: int) -> dict:
+        """
+        取消任务：等待下载的从队列中移除；下载中的停止传输；
+        其他阶段正在处理的在进入下一阶段时丢弃。取消的媒体本次运行内不会因再次嗅探而重新下载
+        """
+        job = self._get_job(job_id)
+        if not job.cancelled:
+            job.cancelled = True
+            job.paused = False
+            downloader = self.downloaders.get(job_id)
+            if downloader:
+                downloader.cancel()
+            elif self.fetch_queue.remove(job):
+                self._cancelled(job)
+        return self.job_info(job)
+
+    def set_priority(self, job_id: int, priority: int) -> dict:
+        """优先级越大越先开始下载，只影响还在等待下载的任务"""
+        job = self._get_job(job_id)
+        job.priority = priority
+        self.fetch_queue.changed()
+        return self.job_info(job)
+
+    def limits(self) -> dict:
+        return {'bandwidth': self.rate_limiter.rate, 'concurrency': self.fetch_queue.limit}
+
+    def set_limits(self, bandwidth: Optional[int] = None, concurrency: Optional[int] = None) -> dict:
+        """
+        Args:
+            bandwidth: 全局限速（字节/秒），0 为不限速
+            concurrency: 同时下载的任务数，超过现有线程数时增加下载线程
+        """
+        if bandwidth is not None:
+            self.rate_limiter.set_rate(bandwidth)
+        if concurrency is not None:
+            if concurrency < 1:
+                raise ValueError("并发数至少为 1")
+            stage = self.stage['fetch']
+            if concurrency > stage.threads:
+                stage.add_workers(concurrency - stage.threads)
+            stage.workers = concurrency
+            self.fetch_queue.set_limit(concurrency)
+        limits = self.limits()
+        bandwidth_text = f"{format_size(limits['bandwidth'])}/s" if limits['bandwidth'] else "不限速"
+        logger.info(f"🎚️限速: {bandwidth_text} | 并发: {limits['concurrency']}")
+        return limits
+
+    def _guard(self, handler: Callable) -> Callable:
+        """已取消的任务进入下一阶段时丢弃"""
+        def run(item):
+            if isinstance(item, DownloadJob) and item.cancelled:
+                self._cancelled(item)
+                return None
+            return handler(item)
+        return run
+
+    def _cancelled(self, job: DownloadJob) -> None:
+        """清理取消的任务；不调用 on_failed，再次嗅探到同一媒体时不会重新下载"""
+        self.resume_index.finish(job.video_data)
+        if self.capture:
+            self.capture.discard(job.video_data.url)
+        self._remove_temp(job)
+        self._job_done(job)
+        CANCELLED.inc()
+        logger.warning(f"🚫{job.name} 已取消")
+
+    # ---- 各阶段处理函数 ----
+
+    def _discover(self, group: List[VideoData]) -> List[DownloadJob]:
+        """为一组媒体分配文件名，生成下载任务"""
+        if len(group) > 1:
+            logger.info(f"📦{group[0].display_name} 共 {len(group)} 个媒体")
+
+        jobs = []
+        for video_data in group:
+            job = DownloadJob(job_id=next(self.job_ids), video_data=video_data, group_size=len(group))
+            failed_job = None if is_m3u8_url(video_data.url) else self.resume_index.take_failed(video_data)
+            if failed_job:
+                job.filepath = str(failed_job.filepath)
+                job.temp_path = failed_job.temp_path
+                job.resume_ranges = failed_job.completed_ranges
+            else:
+                job.filepath = self._resolve_filepath(video_data, len(group))
+            jobs.append(job)
+        with self.in_flight_lock:
+            for job in jobs:
+                self.jobs[job.job_id] = job
+        return jobs
+
+    def _fetch(self, job: DownloadJob) -> Optional[DownloadJob]:
+        """先按文件大小预留磁盘空间，空间不足时延后再试"""
+        size = job.video_data.size
+        if not self.disk_budget.acquire(size):
+            self._defer(job)
+            return None
+
+        if is_small_object(job.video_data):
+            # 小文件交给小文件下载器的线程池并发下载，不占用下载阶段的线程，完成后直接进入解密阶段
+            self._fetch_small(job, size)
+            return None
+
+        try:
+            downloaded = self._download(job)
+        finally:
+            self.disk_budget.release(size)
+        if downloaded:
+            # 暂停之前已经下载完成
+            downloaded.paused = False
+        return downloaded
+
+    def _download(self, job: DownloadJob) -> Optional[DownloadJob]:
+        video_data = job.video_data
+        url = video_data.url
+        logger.info(f"⬇️{job.name} 下载中...")
+
+        if is_m3u8_url(url):
+            downloader = M3U8Downloader(
+                m3u8_url=url,
+                save_path=job.filepath,
+                headers={},
+                rate_limiter=self.rate_limiter
+            )
+            job.temp_path = job.filepath
+            if self._run_downloader(job, downloader, downloader.download):
+                if job.cancelled or job.paused:
+                    # 跟随中途取消 / 暂停：已录制的片段按完成处理，不丢弃
+                    logger.info(f"⏹️{job.name} 已停止跟随，保留已录制的部分")
+                    job.cancelled = False
+                return job
+            # 输出直接写在保存路径上，释放文件名或重新下载之前先删除
+            downloader.discard()
+            if job.cancelled:
+                self._cancelled(job)
+            elif job.paused:
+                self.stage['fetch'].put(job)
+            else:
+                self._fail(job, DownloadError(f"[Crawler-Retry] {url}视频下载失败"), 'm3u8')
+            return None
+
+        capture = self.capture.get(url) if self.capture else None
+        if capture and capture.wait_idle():
+            logger.info(f"📡{job.name} 已从客户端流量捕获 {format_size(capture.captured_size)}")
+        temp_path = capture.temp_path if capture else None
+        completed_ranges = capture.completed_ranges() if capture else []
+
+        if job.resume_ranges:
+            if temp_path == job.temp_path:
+                completed_ranges = merge_ranges(completed_ranges + job.resume_ranges)
+            else:
+                temp_path, completed_ranges = job.temp_path, job.resume_ranges
+            resumed = sum(end - start + 1 for start, end in completed_ranges)
+            logger.info(f"♻️{job.name} 使用新地址从 {format_size(resumed)} 处继续下载")
+
+        if self.content_store and video_data.size > 0:
+            job.hasher = BlockHasher(video_data.size)
+
+        downloader = VideoDownloader(
+            url=url,
+            save_path=job.filepath,
+            thread_count=4,
+            progress_callback=create_progress_callback(job.name if job.group_size > 1 else "", job.job_id),
+            temp_path=temp_path,
+            completed_ranges=completed_ranges,
+            keep_temp_on_failure=True,
+            rename_on_complete=False,
+            hasher=job.hasher,
+            rate_limiter=self.rate_limiter
+        )
+        job.temp_path = downloader.temp_path
+        self.resume_index.start(video_data, Path(job.filepath), downloader.temp_path, downloader)
+        success = self._run_downloader(job, downloader, downloader.start)
+        for step, seconds in downloader.timings.items():
+            STAGE_SECONDS.observe(seconds, stage=step)
+        if self.capture:
+            self.capture.discard(url)
+
+        if success:
+            self.resume_index.finish(video_data)
+            job.expected_size = downloader.total_size
+            return job
+
+        if job.cancelled:
+            self._cancelled(job)
+            return None
+
+        ranges = downloader.downloaded_ranges()
+        if job.paused or downloader.disk_full:
+            # 续传索引中的记录保留为进行中，期间再次嗅探到的新地址会更新到任务上
+            job.resume_ranges = ranges
+            job.hasher = None
+            if job.paused:
+                self.stage['fetch'].put(job)
+            else:
+                # 准入之后磁盘被其他程序写满：与准入失败一样延后，之后从已下载的部分续传
+                self._defer(job)
+            return None
+
+        if ranges:
+            self.resume_index.fail(video_data, ranges)
+            kept = format_size(sum(end - start + 1 for start, end in ranges))
+            self._fail(job, DownloadError(f"[Crawler-Retry] {url}视频下载失败，已保留 {kept}，再次打开视频后续传"),
+                       'transfer', remove_temp=False)
+        else:
+            self.resume_index.finish(video_data)
+            self._fail(job, DownloadError(f"[Crawler-Retry] {url}视频下载失败"), 'transfer')
+        return None
+
+    def _run_downloader(self, job: DownloadJob, downloader, run: Callable[[], bool]) -> bool:
+        """登记为进行中的下载（控制接口取消 / 暂停、已下载字节数），结束后累计本次下载的字节数"""
+        with self.transfer_lock:
+            self.downloaders[job.job_id] = downloader
+        # 登记之前已经取消 / 暂停的任务，cancel / pause 时还找不到下载器
+        if job.cancelled or job.paused:
+            downloader.cancel()
+        try:
+            return run()
+        finally:
+            with self.transfer_lock:
+                self.downloaders.pop(job.job_id, None)
+                self.transferred_bytes += downloader.transferred_size()
+
+    def _fetch_small(self, job: DownloadJob, reserved: int) -> None:
+        """
+        小文件在小文件下载器的线程池中一次 GET 读入内存，内存中解密后一次写入；
+        同一帖子的多张图片并发下载，不受下载阶段并发数限制
+
+        Args:
+            job: 任务
+            reserved: 已预留的磁盘空间，下载结束后释放
+        """
+        video_data = job.video_data
+        logger.info(f"⬇️{job.name} 下载中...")
+        job.temp_path = job.filepath + '.tmp'
+        task = SmallObjectTask(url=video_data.url, save_path=job.temp_path, decode_key=video_data.decode_key)
+        future = self.small_downloader.submit(task)
+        future.add_done_callback(lambda done: self._small_fetched(job, done, reserved))
+
+    def _small_fetched(self, job: DownloadJob, future: Future, reserved: int) -> None:
+        """小文件下载结束（在小文件下载器的线程中）：成功的放入解密阶段（已解密，直接往下传），失败的结束任务"""
+        self.disk_budget.release(reserved)
+        with logger.contextualize(job=job.job_id):
+            if not future.cancelled() and future.result():
+                self._count_transferred(os.path.getsize(job.temp_path))
+                job.decrypted = True
+                # 小文件下载不能中断，下载期间的暂停不生效
+                job.paused = False
+                self.stage['decrypt'].put(job)
+                return
+
+            self._fail(job, DownloadError(f"[Crawler-Retry] {job.video_data.url}下载失败"), 'small')
+
+    def _decrypt(self, job: DownloadJob) -> Optional[DownloadJob]:
+        video_data = job.video_data
+        if not video_data.is_encrypted or job.decrypted:
+            return job
+
+        logger.info(f"🔓{job.name} 解密中...")
+        started = time.thread_time()
+        decrypted = decrypt_wechat_video(job.temp_path, video_data.decode_key)
+        DECRYPT_CPU.inc(time.thread_time() - started)
+        if decrypted:
+            job.decrypted = True
+            if job.hasher:
+                job.hasher.invalidate(0, ENCRYPTED_LENGTH - 1)
+            return job
+
+        self._retry(job, DecryptError(f"[Crawler-Retry] 解密失败: {job.name}"), 'decrypt')
+        return None
+
+    def _verify(self, job: DownloadJob) -> Optional[DownloadJob]:
+        """校验大小和 MP4 顶层结构，失败时重新下载"""
+        video_data = job.video_data
+        if not os.path.exists(job.temp_path) or os.path.getsize(job.temp_path) == 0:
+            self._retry(job, DownloadError(f"[Crawler-Retry] 文件为空: {job.name}"), 'empty')
+            return None
+
+        size = os.path.getsize(job.temp_path)
+        for expected in (job.expected_size, video_data.size):
+            if expected and size != expected and not is_m3u8_url(video_data.url):
+                self._retry(job, DownloadError(f"[Crawler-Retry] 文件大小不一致: {job.name} {size} != {expected}"),
+                            'size')
+                return None
+
+        if self._is_mp4(video_data):
+            error = verify_mp4(job.temp_path)
+            if error:
+                self._retry(job, DownloadError(f"[Crawler-Retry] MP4 校验失败: {job.name} {error}"), 'mp4')
+                return None
+
+        return job
+
+    def _finalize(self, job: DownloadJob) -> None:
+        remuxed = False
+        if config.faststart and self._is_mp4(job.video_data) and job.temp_path != job.filepath:
+            remuxed = self._faststart(job)
+
+        digest = None
+        if self.content_store and job.temp_path != job.filepath:
+            # 哈希对应保存的内容：faststart 改写过文件时下载中算的哈希已经不对应，重新读取整个文件
+            hasher = job.hasher if job.hasher and not remuxed else BlockHasher(os.path.getsize(job.temp_path))
+            digest = hasher.hexdigest(job.temp_path)
+            logger.debug(f"[内容存储] {job.name} 重新读取 {format_size(hasher.rehashed_bytes)} 计算哈希")
+
+        if digest:
+            _, duplicate = self.content_store.store(job.temp_path, digest, job.filepath)
+            if duplicate:
+                saved = format_size(self.content_store.stats()['saved_bytes'])
+                logger.info(f"♻️{job.name} 内容与已下载的文件相同，只保存链接（累计节省 {saved}）")
+        elif job.temp_path != job.filepath:
+            os.replace(job.temp_path, job.filepath)
+        self._job_done(job)
+        COMPLETED.inc(media_type=job.video_data.media_type)
+        logger.success(f"✅{job.name} 下载完成")
+        if self.on_completed:
+            self.on_completed(job.video_data, os.path.getsize(job.filepath))
+        self._download_cover(job)
+
+    # ---- 辅助方法 ----
+
+    @staticmethod
+    def _is_mp4(video_data: VideoData) -> bool:
+        return video_data.media_type == 'video' and video_data.suffix == '.mp4' and not is_m3u8_url(video_data.url)
+
+    def _faststart(self, job: DownloadJob) -> bool:
+        """moov 移到文件开头；失败时保留原文件。返回文件是否被改写"""
+        remuxed = job.temp_path + '.faststart'
+        try:
+            if faststart(job.temp_path, remuxed):
+                os.replace(remuxed, job.temp_path)
+                logger.debug(f"[faststart] {job.name} moov 已移到文件开头")
+                return True
+        except (OSError, ValueError) as e:
+            logger.warning(f"[faststart] {job.name} 处理失败，保留原文件: {e}")
+            if os.path.exists(remuxed):
+                os.remove(remuxed)
+        return False
+
+    def _defer(self, job: DownloadJob) -> None:
+        """磁盘空间不足：DEFER_DELAY 秒后放回下载队列"""
+        job.deferred += 1
+        if job.deferred == 1:
+            logger.warning(f"💾{job.name} 磁盘剩余空间不足，{self.DEFER_DELAY:.0f} 秒后再试")
+        Timer(self.DEFER_DELAY, self.stage['fetch'].put, [job]).start()
+
+    def _retry(self, job: DownloadJob, error: Exception, reason: str) -> None:
+        """解密 / 校验失败：删除已下载的数据，稍后重新下载；reason 为指标中的原因标签"""
+        if os.path.exists(job.temp_path) and job.temp_path != job.filepath:
+            os.remove(job.temp_path)
+
+        if job.attempts >= self.max_retries:
+            self._fail(job, error, reason)
+            return
+
+        RETRIES.inc(reason=reason)
+        job.attempts += 1
+        job.decrypted = False
+        job.resume_ranges = []
+        job.temp_path = ""
+        job.hasher = None
+        logger.warning(f"{error}，第 {job.attempts} 次重试")
+        # 在定时器线程里放回下载队列，避免阶段线程之间互相等待
+        Timer(2.0, self.stage['fetch'].put, [job]).start()
+
+    def _fail(self, job: DownloadJob, error: Exception, reason: str, remove_temp: bool = True) -> None:
+        FAILURES.inc(reason=reason)
+        if remove_temp:
+            self._remove_temp(job)
+        self._job_done(job)
+        logger.error(error)
+        if self.on_failed:
+            self.on_failed(job.video_data)
+
+    def _remove_temp(self, job: DownloadJob) -> None:
+        """
+        删除未完成的数据并释放文件名；m3u8 直接写在保存路径上（temp_path == filepath），
+        不删除的话之后分到同一路径的任务会追加到残留数据后面或把它覆盖
+        """
+        if job.temp_path and os.path.exists(job.temp_path):
+            os.remove(job.temp_path)
+        if job.temp_path == job.filepath:
+            ts_dir = job.filepath + '_ts_temp'
+            if os.path.isdir(ts_dir):
+                shutil.rmtree(ts_dir, ignore_errors=True)
+        self.names.release(job.filepath)
+
+    def _resolve_filepath(self, video_data: VideoData, group_size: int = 1) -> str:
+        """分配不重名的保存路径"""
+        filename = generate_filename(
+            video_data.description,
+            video_data.url,
+            video_data.suffix
+        )
+        if group_size > 1:
+            filename = f"{Path(filename).stem}_{video_data.index + 1}{video_data.suffix}"
+        return self.names.reserve(filename)
+
+    def _download_cover(self, job: DownloadJob) -> None:
+        """后台下载视频封面，保存为 <视频名>_cover.jpg"""
+        video_data = job.video_data
+        if config.download_covers and video_data.cover_url and video_data.media_type == 'video':
+            filepath = Path(job.filepath)
+            cover_path = self.names.reserve(f"{filepath.stem}_cover.jpg", directory=str(filepath.parent))
+            self.small_downloader.submit(SmallObjectTask(url=video_data.cover_url, save_path=cover_path))
@@ -2,47 +2,176 @@
 微信视频号代理拦截插件
 基于 mitmproxy 实现流量拦截和 JS 注入
 """
+import functools
 import json
 import re
-from typing import Optional
+import time
+from mitmproxy import ctx, http, tls
 
-from mitmproxy import http
-
-from models.entities import VideoData
+from core import control_api, startup
+from core.js_cache import RewriteCache
+from core.video_info import extract_video_url, extract_video_urls  # 兼容旧的导入路径
+from models.exceptions import ControlError
 from utils.logger import logger
+from utils.metrics import registry
+
+INJECT_MEDIA_CODE = b'''
+get media(){
+    if(this.objectDesc){
+        fetch("https://wxapp.tc.qq.com/res-downloader/wechat?type=1", {
+          method: "POST",
+          mode: "no-cors",
+          body: JSON.stringify(this.objectDesc),
+        });
+    };
+'''
+
+INJECT_COMMENT_CODE = rb'''
+async finderGetCommentDetail(\1) {
+    var res = await\2;
+    if (res?.data?.object?.objectDesc) {
+        fetch("https://wxapp.tc.qq.com/res-downloader/wechat?type=2", {
+          method: "POST",
+          mode: "no-cors",
+          body: JSON.stringify(res.data.object.objectDesc),
+        });
+    }
+    return res;
+}async
+'''
+
+
+# 代理上的保留路径：返回 Prometheus 文本格式的运行指标
+METRICS_PATH = '/res-downloader/metrics'
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REPORTS = registry.counter('reports_total', '页面上报的视频信息请求数', ('result',))
+JS_REWRITES = registry.counter('js_rewrites_total', 'JS / 页面改写次数（rewritten 改写，cache_hit 使用缓存）', ('result',))
+
+
+def timed_hook(new_flow: bool = False):
+    """统计插件钩子在每个域名上的 CPU 耗时（需要设置 policy）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, flow: http.HTTPFlow):
+            if self.policy is None:
+                return func(self, flow)
+            started = time.thread_time()
+            try:
+                return func(self, flow)
+            finally:
+                self.policy.record(flow.request.host, time.thread_time() - started, new_flow)
+        return wrapper
+    return decorator
 
 
 class WechatVideoAddon:
     """微信视频号拦截插件"""
     
-    def __init__(self, video_callback=None, version="1.0.0"):
+    # 需要解密的域名后缀：上报接口、视频号页面、JS 资源
+    HOST_RULES = ('qq.com', 'channels.weixin.qq.com', 'res.wx.qq.com')
+    
+    def __init__(self, video_callback=None, version="1.0.0", capture=None, stream_passthrough=True, policy=None,
+                 coalescer=None, name="", metrics=None, control=None, control_token=""):
         """
         初始化插件
         
         Args:
             video_callback: 视频信息回调函数
             version: 版本号，防止缓存
+            capture: 被动捕获管理器（PassiveCapture），为空时不捕获客户端流量
+            stream_passthrough: 不需要改写的响应在收到响应头后直接流式转发，不在代理内缓冲
+            policy: 拦截策略（InterceptPolicy），为空时解密全部 TLS 连接
+            coalescer: 上报合并器（DiscoveryCoalescer），完全相同的上报体在解析前丢弃
+            name: 代理进程名，多个代理进程时用于区分统计输出
+            metrics: 返回指标文本的函数，请求 METRICS_PATH 时调用，默认只有本进程的指标
+            control: 执行控制接口操作的函数 (操作, 参数) -> (状态码, 响应内容)，为空时不提供控制接口
+            control_token: 其他设备访问控制接口和指标时需要的令牌，为空时只响应本机的客户端
         """
         self.video_callback = video_callback
         self.version = version
+        self.capture = capture
+        self.stream_passthrough = stream_passthrough
+        self.policy = policy
+        self.coalescer = coalescer
+        self.name = name
+        self.metrics = metrics or registry.render
+        self.control = control
+        self.control_token = control_token
         self.source_url = ""
+        self.version_bytes = version.encode('utf-8')
+        self.js_cache = RewriteCache()
+        registry.collected('js_cache_size_bytes', 'JS 改写缓存占用的字节数',
+                           lambda: [((), self.js_cache.size)])
+        registry.collected('js_cache_saved_bytes_total', 'JS 改写命中缓存省去处理的字节数（改写前解码后的大小）',
+                           lambda: [((), self.js_cache.bytes_saved)], kind='counter')
         
-        self.media_regex = re.compile(r'get\s+media\(\)\{', re.MULTILINE)
+        self.media_regex = re.compile(rb'get\s+media\(\)\{', re.MULTILINE)
         
         self.comment_regex = re.compile(
-            r'async\s+finderGetCommentDetail\((\w+)\)\s*\{return(.*?)\s*}\s*async',
+            rb'async\s+finderGetCommentDetail\((\w+)\)\s*\{return(.*?)\s*}\s*async',
             re.MULTILINE | re.DOTALL
         )
 
         logger.success("✅微信视频号插件初始化完成")
     
+    def running(self) -> None:
+        """代理已开始监听，发出就绪信号"""
+        proxyserver = ctx.master.addons.get('proxyserver')
+        startup.mark_ready(proxyserver.listen_addrs() if proxyserver else [])
+    
+    def tls_clienthello(self, data: tls.ClientHelloData) -> None:
+        if self.policy:
+            self.policy.tls_clienthello(data)
+    
+    def done(self) -> None:
+        prefix = f"[{self.name}]" if self.name else ""
+        if self.policy:
+            logger.info(f"{prefix}[拦截统计]\n{self.policy.summary()}")
+        if self.coalescer:
+            stats = self.coalescer.stats()
+            logger.info(
+                f"{prefix}[上报合并] 上报: {stats['reports']} | 相同上报体丢弃: {stats['duplicate_bodies']} | "
+                f"窗口内合并: {stats['merged']} | 入队: {stats['flushed']}"
+            )
+        stats = self.js_cache.stats()
+        if stats['hits'] or stats['misses']:
+            logger.info(
+                f"{prefix}[JS 缓存] 条目: {stats['entries']} | 占用: {stats['size'] / 1024:.0f} KB | "
+                f"命中率: {stats['hit_rate']:.0%} | 省去处理: {stats['bytes_saved'] / 1024 / 1024:.1f} MB"
+            )
+    
+    @timed_hook(new_flow=True)
     def request(self, flow: http.HTTPFlow) -> None:
         request = flow.request
+        startup.mark_flow(request.host)
+
+        if request.host.endswith('qq.com') and request.path.startswith(METRICS_PATH):
+            if not self._authorized(flow):
+                flow.response = http.Response.make(403, b"Forbidden", {"Content-Type": "text/plain"})
+                return
+            flow.response = http.Response.make(200, self.metrics().encode('utf-8'),
+                                               {"Content-Type": METRICS_CONTENT_TYPE})
+            return
+
+        if self.control and request.host.endswith('qq.com') and control_api.is_control_path(request.path):
+            if self._authorized(flow):
+                status, body = self._handle_control(request)
+            else:
+                status, body = 403, {'error': f"只允许本机访问，其他设备需要 {control_api.TOKEN_HEADER} 请求头"}
+            flow.response = http.Response.make(status, json.dumps(body, ensure_ascii=False).encode('utf-8'),
+                                               {"Content-Type": "application/json; charset=utf-8"})
+            return
 
         if (request.host.endswith('qq.com') and 
             '/res-downloader/wechat' in request.path):
             
             try:
+                if self.coalescer and self.coalescer.is_duplicate_body(request.content):
+                    REPORTS.inc(result='duplicate_body')
+                    flow.response = http.Response.make(200, b"OK", {"Content-Type": "text/plain"})
+                    return
+                
                 body = request.content.decode('utf-8')
                 video_info = json.loads(body)
                 
@@ -50,20 +179,78 @@ class WechatVideoAddon:
                     self.video_callback(video_info, self.source_url)
                     if self.source_url:
                         self.source_url = ""
+                if self.coalescer:
+                    self.coalescer.remember_body(request.content)
                 
+                REPORTS.inc(result='accepted')
                 flow.response = http.Response.make(
                     200,
                     b"OK",
                     {"Content-Type": "text/plain"}
                 )
             except Exception as e:
+                REPORTS.inc(result='error')
                 logger.error(f"[视频号错误] 解析视频信息失败: {e}")
                 flow.response = http.Response.make(500, b"Error")
     
+    def _authorized(self, flow: http.HTTPFlow) -> bool:
+        """控制接口和指标：本机的客户端，或带有正确令牌的请求"""
+        peername = flow.client_conn.peername
+        peer = peername[0] if peername else ""
+        token = flow.request.headers.get(control_api.TOKEN_HEADER, "")
+        if control_api.is_authorized(peer, token, self.control_token):
+            return True
+        logger.warning(f"[控制接口] 拒绝来自 {peer} 的请求: {flow.request.path}")
+        return False
+    
+    def _handle_control(self, request: http.Request) -> tuple:
+        try:
+            action, params = control_api.parse(request.method, request.path,
+                                               request.headers.get('content-type', ''), request.content)
+        except ControlError as e:
+            return e.status, {'error': str(e)}
+        logger.debug(f"[控制接口] {action} {params}")
+        return self.control(action, params)
+    
+    @timed_hook()
+    def responseheaders(self, flow: http.HTTPFlow) -> None:
+        if not flow.response:
+            return
+        
+        if self.capture and self.capture.attach(flow):
+            return
+        
+        if self.stream_passthrough and not self._needs_rewrite(flow):
+            flow.response.stream = True
+    
+    def _needs_rewrite(self, flow: http.HTTPFlow) -> bool:
+        """响应体是否需要改写（页面加版本号 / JS 注入）"""
+        host = flow.request.host
+        path = flow.request.path
+        
+        if host.endswith('channels.weixin.qq.com'):
+            return '/web/pages/feed' in path or '/web/pages/home' in path
+        
+        if host.endswith('res.wx.qq.com'):
+            return (path.endswith(f'.js?v={self.version}') or
+                    'web-finder/res/js/virtual_svg-icons-register.publish' in path)
+        
+        return False
+    
+    @timed_hook()
+    def error(self, flow: http.HTTPFlow) -> None:
+        """连接中止：正常结束时才会以 b"" 调用流式回调，中止的被动捕获流在这里关闭"""
+        if self.capture:
+            self.capture.finish_flow(flow)
+    
+    @timed_hook()
     def response(self, flow: http.HTTPFlow) -> None:
         response = flow.response
         request = flow.request
         
+        if self.capture:
+            self.capture.finish_flow(flow)
+        
         if not response or response.status_code not in [200, 206]:
             return
 
@@ -80,104 +267,60 @@ class WechatVideoAddon:
         if not (is_wechat_channels or is_wechat_res):
             return
         
+        rewriters = []
         if is_wechat_channels and ('/web/pages/feed' in path or '/web/pages/home' in path):
-            self._add_version_to_js(flow)
+            rewriters.append(self._add_version_to_js)
         
         if is_wechat_res:
             if path.endswith(f'.js?v={self.version}'):
-                self._add_version_to_js(flow)
+                rewriters.append(self._add_version_to_js)
             
             if 'web-finder/res/js/virtual_svg-icons-register.publish' in path:
-                self._inject_video_sniffer(flow)
+                rewriters.append(self._inject_video_sniffer)
+        
+        if rewriters:
+            self._rewrite(flow, rewriters)
     
-    def _add_version_to_js(self, flow: http.HTTPFlow) -> None:
+    def _rewrite(self, flow: http.HTTPFlow, rewriters: list) -> None:
+        """依次执行改写函数，结果按地址 + ETag/摘要缓存，重复的 JS 包直接使用缓存（只缓存 200 响应）"""
+        response = flow.response
+        key = self.js_cache.make_key(flow) if response.status_code == 200 else None
+        
+        cached = self.js_cache.get(key) if key else None
+        if cached is not None:
+            response.raw_content = cached
+            if 'transfer-encoding' not in response.headers:
+                response.headers['Content-Length'] = str(len(cached))
+            JS_REWRITES.inc(result='cache_hit')
+            logger.debug(f"[视频号] JS 改写命中缓存 (命中率 {self.js_cache.hit_rate:.0%}): {flow.request.path}")
+            return
+        
+        content = response.content
+        new_content = content
+        for rewriter in rewriters:
+            new_content = rewriter(new_content)
+        
+        if new_content != content:
+            response.content = new_content
+        JS_REWRITES.inc(result='rewritten')
+        if key:
+            self.js_cache.put(key, response.raw_content, len(content))
+    
+    def _add_version_to_js(self, content: bytes) -> bytes:
         try:
-            content = flow.response.content.decode('utf-8', errors='ignore')
-            new_content = content.replace('.js"', f'.js?v={self.version}"')
-            
-            if new_content != content:
-                flow.response.content = new_content.encode('utf-8')
-                flow.response.headers['Content-Length'] = str(len(flow.response.content))
+            return content.replace(b'.js"', b'.js?v=' + self.version_bytes + b'"')
         except Exception as e:
             logger.warning(e)
+            return content
     
-    def _inject_video_sniffer(self, flow: http.HTTPFlow) -> None:
+    def _inject_video_sniffer(self, content: bytes) -> bytes:
         try:
-            content = flow.response.content.decode('utf-8', errors='ignore')
-            
-            inject_media_code = '''
-get media(){
-    if(this.objectDesc){
-        fetch("https://wxapp.tc.qq.com/res-downloader/wechat?type=1", {
-          method: "POST",
-          mode: "no-cors",
-          body: JSON.stringify(this.objectDesc),
-        });
-    };
-'''
-            content = self.media_regex.sub(inject_media_code, content)
-            
-            inject_comment_code = r'''
-async finderGetCommentDetail(\1) {
-    var res = await\2;
-    if (res?.data?.object?.objectDesc) {
-        fetch("https://wxapp.tc.qq.com/res-downloader/wechat?type=2", {
-          method: "POST",
-          mode: "no-cors",
-          body: JSON.stringify(res.data.object.objectDesc),
-        });
-    }
-    return res;
-}async
-'''
-            content = self.comment_regex.sub(inject_comment_code, content)
-            
-            flow.response.content = content.encode('utf-8')
-            flow.response.headers['Content-Length'] = str(len(flow.response.content))
+            content = self.media_regex.sub(INJECT_MEDIA_CODE, content)
+            content = self.comment_regex.sub(INJECT_COMMENT_CODE, content)
             
             logger.success("✅[视频号] JS 注入成功，嗅探已激活")
+            return content
             
         except Exception as e:
             logger.error(f"❌[视频号] JS 注入失败: {e}")
-
-
-def extract_video_url(video_info: dict) -> Optional[VideoData]:
-    try:
-        media_list = video_info.get('media', [])
-        if not media_list:
-            return None
-        
-        first_media = media_list[0]
-        url = first_media.get('url', '')
-        if not url:
-            return None
-        
-        url_token = first_media.get('urlToken', '')
-        if url_token:
-            url += url_token
-        
-        media_type = first_media.get('mediaType', 0)
-        is_image = media_type == 9
-        
-        decode_key = first_media.get('decodeKey', '')
-        if decode_key and not isinstance(decode_key, str):
-            decode_key = str(decode_key)
-        
-        spec = first_media.get('spec', [])
-        formats = [s.get('fileFormat', '') for s in spec if 'fileFormat' in s] if spec else []
-        
-        return VideoData(
-            url=url,
-            description=video_info.get('description', ''),
-            size=first_media.get('fileSize', 0),
-            suffix='.png' if is_image else '.mp4',
-            decode_key=decode_key,
-            cover_url=first_media.get('coverUrl', ''),
-            media_type='image' if is_image else 'video',
-            formats=formats,
-        )
-        
-    except Exception as e:
-        logger.error(f"提取视频信息失败: {e}")
-        return None
-
+            return content
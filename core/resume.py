@@ -0,0 +1,108 @@
+"""
+断点续传索引
+urlToken 会过期，同一个媒体换了 token 再次被嗅探时，
+按去掉 token 的地址 + 文件大小识别出来：
+进行中的任务直接换用新地址，失败的任务从磁盘上已有的字节继续下载
+"""
+import os
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from downloaders.media_rules import media_key
+from models.entities import VideoData
+from utils.logger import logger
+
+STATE_ACTIVE = 'active'
+STATE_FAILED = 'failed'
+
+
+class ResumableJob:
+    """可续传的任务"""
+
+    def __init__(self, video_data: VideoData, filepath: Path, temp_path: str, downloader=None):
+        self.video_data = video_data
+        self.filepath = filepath
+        self.temp_path = temp_path
+        self.downloader = downloader
+        self.completed_ranges: List[Tuple[int, int]] = []
+        self.state = STATE_ACTIVE
+
+
+class ResumeIndex:
+    """按 (媒体标识, 大小) 记录进行中和失败的任务"""
+
+    def __init__(self, max_failed: int = 64, names=None):
+        """
+        Args:
+            max_failed: 最多保留的失败任务数，超出时删除最早的临时文件
+            names: 文件名索引（NameIndex），删除临时文件时释放预留的文件名
+        """
+        self.max_failed = max_failed
+        self.names = names
+        self.jobs: "OrderedDict[Tuple[str, int], ResumableJob]" = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def key_of(video_data: VideoData) -> Tuple[str, int]:
+        return media_key(video_data.url), video_data.size
+
+    def start(self, video_data: VideoData, filepath: Path, temp_path: str, downloader) -> ResumableJob:
+        job = ResumableJob(video_data, filepath, temp_path, downloader)
+        with self.lock:
+            self.jobs[self.key_of(video_data)] = job
+        return job
+
+    def take_failed(self, video_data: VideoData) -> Optional[ResumableJob]:
+        """取出同一媒体之前失败的任务（用于续传）"""
+        key = self.key_of(video_data)
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None or job.state != STATE_FAILED:
+                return None
+            del self.jobs[key]
+        return job
+
+    def refresh(self, video_data: VideoData) -> Optional[str]:
+        """
+        同一媒体被再次嗅探时调用
+
+        Returns:
+            active: 任务进行中，已换用新地址；failed: 有失败任务可续传；None: 没有记录
+        """
+        with self.lock:
+            job = self.jobs.get(self.key_of(video_data))
+            if job is None:
+                return None
+            if job.state == STATE_ACTIVE and job.video_data.url != video_data.url:
+                job.video_data.url = video_data.url
+                if job.downloader is not None:
+                    job.downloader.update_url(video_data.url)
+                logger.info(f"🔄{job.filepath.name} 地址已刷新")
+            return job.state
+
+    def fail(self, video_data: VideoData, completed_ranges: List[Tuple[int, int]]) -> None:
+        """记录失败任务及已下载区间，等待新 token 后续传"""
+        key = self.key_of(video_data)
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None:
+                return
+            job.state = STATE_FAILED
+            job.downloader = None
+            job.completed_ranges = completed_ranges
+            self.jobs.move_to_end(key)
+
+            failed = [k for k, j in self.jobs.items() if j.state == STATE_FAILED]
+            evicted = [self.jobs.pop(k) for k in failed[:max(0, len(failed) - self.max_failed)]]
+
+        for old in evicted:
+            if os.path.exists(old.temp_path):
+                os.remove(old.temp_path)
+            if self.names is not None:
+                self.names.release(str(old.filepath))
+
+    def finish(self, video_data: VideoData) -> None:
+        with self.lock:
+            self.jobs.pop(self.key_of(video_data), None)
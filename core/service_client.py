@@ -0,0 +1,156 @@
+"""
+下载服务客户端
+运行在代理进程中，把嗅探到的媒体和被动捕获的进度交给下载服务（core/download_service.py）；
+只依赖标准库的 IPC，不加载下载流水线和 requests
+"""
+import os
+import time
+from multiprocessing.connection import Client, Connection
+from queue import Queue
+from threading import Condition, Lock, Thread
+from typing import Callable, List, Optional, Tuple
+
+from models.entities import VideoData
+from utils.logger import logger
+
+
+class ServiceClient:
+    """
+    代理进程中的下载服务客户端
+    submit / 捕获进度都放入发送队列由后台线程发送，不阻塞 mitmproxy 的事件循环；
+    另一个线程长轮询服务端的事件（discard 停止捕获；drop 其他代理进程已在捕获，删除本进程的临时文件；
+    failed 有媒体下载失败，调用 on_failed）；
+    metrics / control 在调用线程上同步请求，使用单独的连接
+    """
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes, capture=None, name: str = ""):
+        self.address = address
+        self.authkey = authkey
+        self.capture = capture
+        self.name = name or f"mitmdump-{os.getpid()}"
+        # 下载服务中有任务最终失败时的回调，参数为地址
+        self.on_failed: Optional[Callable[[str], None]] = None
+        self.client_id = 0
+        self.outbox: Queue = Queue()
+        self.ready = Condition()
+        self.request_conn: Optional[Connection] = None
+        self.request_lock = Lock()
+
+        Thread(target=self._send_loop, name="service-send", daemon=True).start()
+        Thread(target=self._event_loop, name="service-events", daemon=True).start()
+
+    def _connect(self) -> Connection:
+        """连接下载服务，服务还没启动好时重试"""
+        delay = 0.2
+        while True:
+            try:
+                return Client(self.address, authkey=self.authkey)
+            except (OSError, EOFError) as e:
+                logger.debug(f"[下载服务] 连接失败，{delay:.1f}s 后重试: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    @staticmethod
+    def _call(conn: Connection, op: str, payload=None):
+        conn.send((op, payload))
+        status, result = conn.recv()
+        if status != 'ok':
+            raise RuntimeError(result)
+        return result
+
+    def submit(self, group: List[VideoData]) -> None:
+        self.outbox.put(('submit', group))
+
+    def capture_changed(self, snapshot: dict) -> None:
+        """PassiveCapture 的 on_change 回调"""
+        self.outbox.put(('capture', snapshot))
+
+    def _request(self, op: str, payload=None, timeout: float = 2.0):
+        """同步请求，连接失败或超时时抛出异常，不重试"""
+        with self.request_lock:
+            try:
+                if self.request_conn is None:
+                    self.request_conn = Client(self.address, authkey=self.authkey)
+                self.request_conn.send((op, payload))
+                if not self.request_conn.poll(timeout):
+                    raise TimeoutError(f"{timeout}s 内没有响应")
+                status, result = self.request_conn.recv()
+            except (OSError, EOFError):
+                # 超时后连接上可能还有迟到的响应，直接丢弃这个连接
+                if self.request_conn is not None:
+                    self.request_conn.close()
+                    self.request_conn = None
+                raise
+        if status != 'ok':
+            raise RuntimeError(result)
+        return result
+
+    def metrics(self) -> str:
+        """下载服务的指标文本；服务不可用时返回一行注释"""
+        try:
+            return self._request('metrics')
+        except (OSError, EOFError, RuntimeError) as e:
+            logger.debug(f"[下载服务] 获取指标失败: {e}")
+            return f"# 下载服务不可用: {e}\n"
+
+    def control(self, action: str, params: dict) -> Tuple[int, dict]:
+        """控制接口的操作交给下载服务执行，返回 (HTTP 状态码, 响应内容)"""
+        try:
+            return tuple(self._request('control', (action, params)))
+        except (OSError, EOFError, RuntimeError) as e:
+            logger.warning(f"[下载服务] 控制接口请求失败: {e}")
+            return 503, {'error': f"下载服务不可用: {e}"}
+
+    def _send_loop(self) -> None:
+        conn = None
+        while True:
+            op, payload = self.outbox.get()
+            while True:
+                if conn is None:
+                    conn = self._connect()
+                    client_id = self._call(conn, 'hello', {'name': self.name})
+                    with self.ready:
+                        self.client_id = client_id
+                        self.ready.notify_all()
+                try:
+                    result = self._call(conn, op, (self.client_id, payload))
+                    if op == 'submit' and self.capture:
+                        for url in result or []:
+                            self.capture.discard(url)
+                    break
+                except (OSError, EOFError) as e:
+                    logger.warning(f"[下载服务] 连接断开，重新连接: {e}")
+                    conn = None
+                except RuntimeError as e:
+                    logger.error(f"[下载服务] {op} 失败: {e}")
+                    break
+
+    def _event_loop(self) -> None:
+        with self.ready:
+            self.ready.wait_for(lambda: self.client_id)
+
+        conn = None
+        while True:
+            try:
+                if conn is None:
+                    conn = self._connect()
+                events = self._call(conn, 'events', (self.client_id, 10.0))
+                for kind, target in events:
+                    if kind == 'failed':
+                        if self.on_failed:
+                            self.on_failed(target)
+                    elif not self.capture:
+                        continue
+                    elif kind == 'discard':
+                        self.capture.discard(target)
+                    elif kind == 'drop':
+                        self.capture.drop(target)
+                if events:
+                    self._call(conn, 'ack', (self.client_id, events))
+            except (OSError, EOFError) as e:
+                logger.debug(f"[下载服务] 事件连接断开: {e}")
+                conn = None
+                time.sleep(1)
+            except RuntimeError as e:
+                logger.error(f"[下载服务] 获取事件失败: {e}")
+                time.sleep(1)
@@ -0,0 +1,78 @@
+"""
+启动就绪信号与启动耗时
+代理开始监听、插件加载完成后（mitmproxy 的 running 钩子）发出就绪信号：
+同进程用 threading.Event，mitmdump 子进程写就绪文件（READY_FILE），
+main.py 不再固定 sleep；同时记录到就绪、到第一个被拦截的请求的耗时，
+--profile-startup 时在就绪后输出各模块的导入耗时（utils/import_profiler.py）
+"""
+import json
+import os
+import subprocess
+import time
+from threading import Event, Lock
+from typing import List, Optional, Tuple
+
+from utils import import_profiler
+from utils.logger import logger
+
+# 启动时间：main.py 通过 STARTUP_TS 传给子进程，保证两个进程从同一时刻开始计时
+STARTED_AT = float(os.getenv("STARTUP_TS") or time.time())
+
+ready = Event()
+_first_flow_lock = Lock()
+_first_flow_seen = False
+
+
+def elapsed_ms() -> float:
+    return (time.time() - STARTED_AT) * 1000
+
+
+def mark_ready(listen_addrs: List[Tuple]) -> None:
+    """代理已监听、插件已加载"""
+    addrs = [f"{addr[0]}:{addr[1]}" for addr in listen_addrs]
+    logger.info(f"⏱️代理就绪: {elapsed_ms():.0f}ms {' '.join(addrs)}")
+    log_import_profile()
+
+    ready_file = os.getenv("READY_FILE")
+    if ready_file:
+        temp_path = ready_file + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'listen': addrs, 'elapsed_ms': elapsed_ms()}, f)
+        os.replace(temp_path, ready_file)
+    ready.set()
+
+
+def mark_flow(host: str) -> None:
+    """记录第一个被拦截的请求"""
+    global _first_flow_seen
+    if _first_flow_seen:
+        return
+    with _first_flow_lock:
+        if _first_flow_seen:
+            return
+        _first_flow_seen = True
+    logger.info(f"⏱️首个拦截请求: {elapsed_ms():.0f}ms ({host})")
+
+
+def log_import_profile() -> None:
+    """--profile-startup 时输出导入耗时最多的模块"""
+    for line in import_profiler.report():
+        logger.info(line)
+
+
+def wait_ready_file(path: str, process: Optional[subprocess.Popen] = None, timeout: float = 30.0) -> Optional[dict]:
+    """
+    等待子进程写出就绪文件
+
+    Returns:
+        就绪信息；子进程退出或超时返回 None
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        if process is not None and process.poll() is not None:
+            return None
+        time.sleep(0.02)
+    return None
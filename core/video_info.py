@@ -0,0 +1,77 @@
+"""
+视频信息解析
+把页面上报到 /res-downloader/wechat 的视频信息（objectDesc）解析为 VideoData，
+代理插件和批量下载（main_batch.py）共用；不依赖 mitmproxy
+"""
+import hashlib
+from typing import List, Optional
+
+from downloaders.media_rules import media_key
+from models.entities import VideoData
+from utils.logger import logger
+
+
+def extract_video_urls(video_info: dict) -> List[VideoData]:
+    """
+    提取帖子中的全部媒体（多图、多段视频），同一帖子的媒体共享描述和 post_id
+    """
+    try:
+        media_list = video_info.get('media', [])
+        if not media_list:
+            return []
+        
+        description = video_info.get('description', '')
+        post_id = str(video_info.get('id') or video_info.get('objectId') or '')
+        if not post_id:
+            first_url = media_list[0].get('url', '')
+            post_id = hashlib.md5(f"{description}|{media_key(first_url)}".encode()).hexdigest()[:16]
+        
+        videos = []
+        for index, media in enumerate(media_list):
+            video_data = _parse_media(media, description, post_id, index)
+            if video_data:
+                videos.append(video_data)
+        return videos
+        
+    except Exception as e:
+        logger.error(f"提取视频信息失败: {e}")
+        return []
+
+
+def extract_video_url(video_info: dict) -> Optional[VideoData]:
+    """只提取帖子中的第一个媒体"""
+    videos = extract_video_urls(video_info)
+    return videos[0] if videos else None
+
+
+def _parse_media(media: dict, description: str, post_id: str, index: int) -> Optional[VideoData]:
+    url = media.get('url', '')
+    if not url:
+        return None
+    
+    url_token = media.get('urlToken', '')
+    if url_token:
+        url += url_token
+    
+    media_type = media.get('mediaType', 0)
+    is_image = media_type == 9
+    
+    decode_key = media.get('decodeKey', '')
+    if decode_key and not isinstance(decode_key, str):
+        decode_key = str(decode_key)
+    
+    spec = media.get('spec', [])
+    formats = [s.get('fileFormat', '') for s in spec if 'fileFormat' in s] if spec else []
+    
+    return VideoData(
+        url=url,
+        description=description,
+        size=media.get('fileSize', 0),
+        suffix='.png' if is_image else '.mp4',
+        decode_key=decode_key,
+        cover_url=media.get('coverUrl', ''),
+        media_type='image' if is_image else 'video',
+        formats=formats,
+        post_id=post_id,
+        index=index,
+    )
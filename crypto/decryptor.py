@@ -11,6 +11,9 @@ from utils.logger import logger
 
 MASK64 = 0xFFFFFFFFFFFFFFFF
 
+# 只有文件开头这么多字节是加密的
+ENCRYPTED_LENGTH = 131072
+
 
 def mix(a, b, c, d, e, f, g, h):
     a = (a - e) & MASK64
@@ -148,7 +151,7 @@ def _read_and_decrypt(file_path: str, decode_key: str) -> Optional[bytearray]:
         with open(file_path, "rb") as f:
             data = bytearray(f.read())
         
-        if decrypt(data, 131072, int(decode_key)):
+        if decrypt(data, ENCRYPTED_LENGTH, int(decode_key)):
             return data
         return None
     except Exception as e:
@@ -1,12 +1,24 @@
 """下载器模块"""
-from downloaders.video_downloader import VideoDownloader, format_size, generate_filename
-from downloaders.m3u8_downloader import M3U8Downloader, is_m3u8_url
+import importlib
 
-__all__ = [
-    'VideoDownloader',
-    'format_size',
-    'generate_filename',
-    'M3U8Downloader',
-    'is_m3u8_url',
-]
+# 名称 -> 所在模块，第一次访问时才导入（requests / urllib3 只在真正下载时加载，见 core/__init__.py）
+_exports = {
+    'VideoDownloader': 'downloaders.video_downloader',
+    'format_size': 'downloaders.video_downloader',
+    'generate_filename': 'downloaders.video_downloader',
+    'M3U8Downloader': 'downloaders.m3u8_downloader',
+    'is_m3u8_url': 'downloaders.media_rules',
+    'is_small_object': 'downloaders.media_rules',
+    'media_key': 'downloaders.media_rules',
+    'SmallObjectDownloader': 'downloaders.small_downloader',
+    'RateLimiter': 'downloaders.rate_limiter',
+}
 
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module), name)
@@ -1,15 +1,19 @@
 """
 m3u8 视频流下载器
-支持下载和合并多段 TS 文件
+支持下载和合并多段 TS 文件，支持直播 / EVENT 列表的跟随下载；
+cancel() 后不再请求新的片段，跟随模式立即停止等待
 """
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Event, Lock
+from typing import List, Optional, Tuple
 from urllib.parse import urljoin
 
 import requests
 import urllib3
 
-from utils.logger import logger
+from downloaders.media_rules import is_m3u8_url  # 兼容旧的导入路径
+from utils.logger import logger, progress_throttle
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -17,11 +21,41 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 class M3U8Downloader:
     """m3u8 下载器"""
     
-    def __init__(self, m3u8_url: str, save_path: str, headers: dict = None):
+    def __init__(
+        self,
+        m3u8_url: str,
+        save_path: str,
+        headers: dict = None,
+        follow: Optional[bool] = None,
+        max_idle_reloads: int = 6,
+        max_workers: int = 8,
+        rate_limiter=None,
+        segment_retries: int = 2
+    ):
+        """
+        Args:
+            m3u8_url: m3u8 地址
+            save_path: 保存路径
+            headers: 请求头
+            follow: 跟随模式，None 表示列表没有 #EXT-X-ENDLIST 时自动跟随
+            max_idle_reloads: 连续多少次刷新没有新片段（或刷新失败）后停止跟随
+            max_workers: 片段并发下载数
+            rate_limiter: 共用的限速器（RateLimiter），为 None 时不限速
+            segment_retries: 单个片段失败后的重试次数；跟随模式下仍然失败的片段跳过，不中断跟随
+        """
         self.m3u8_url = m3u8_url
         self.save_path = save_path
         self.headers = headers or {}
         self.ts_urls = []
+        self.follow = follow
+        self.max_idle_reloads = max_idle_reloads
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter
+        self.segment_retries = segment_retries
+        self.skipped_segments = 0
+        self.downloaded_size = 0
+        self.lock = Lock()
+        self.cancelled = Event()
         
         if 'User-Agent' not in self.headers:
             self.headers['User-Agent'] = (
@@ -30,15 +64,38 @@ class M3U8Downloader:
                 'Chrome/120.0.0.0 Safari/537.36'
             )
     
+    def cancel(self) -> None:
+        """停止下载，download() 返回 False；跟随模式下保留已写入的片段，有片段时返回 True"""
+        self.cancelled.set()
+    
+    def discard(self) -> None:
+        """删除已写入的输出文件和片段临时目录（失败、暂停或取消后，保存路径会被释放或重新下载）"""
+        if os.path.exists(self.save_path):
+            os.remove(self.save_path)
+        self._cleanup(self.save_path + '_ts_temp')
+    
+    def transferred_size(self) -> int:
+        """已下载的片段字节数"""
+        return self.downloaded_size
+    
     def download(self) -> bool:
         try:
-            if not self._parse_m3u8():
+            content = self._load_media_playlist()
+            if content is None:
+                return False
+
+            if self.follow or (self.follow is None and '#EXT-X-ENDLIST' not in content):
+                return self._follow(content)
+
+            if not self._parse_m3u8(content):
                 return False
             
             ts_dir = self.save_path + '_ts_temp'
             os.makedirs(ts_dir, exist_ok=True)
             
             if not self._download_ts_files(ts_dir):
+                if self.cancelled.is_set():
+                    self._cleanup(ts_dir)
                 return False
             
             if not self._merge_ts_files(ts_dir):
@@ -53,37 +110,43 @@ class M3U8Downloader:
             logger.error(f"[错误] m3u8 下载失败: {e}")
             return False
     
-    def _parse_m3u8(self) -> bool:
+    def _fetch_playlist(self) -> Optional[str]:
+        response = requests.get(
+            self.m3u8_url,
+            headers=self.headers,
+            verify=False,
+            timeout=10
+        )
+        
+        if response.status_code != 200:
+            logger.error(f"[错误] 获取 m3u8 失败: {response.status_code}")
+            return None
+        
+        return response.text
+    
+    def _load_media_playlist(self) -> Optional[str]:
+        """获取媒体列表内容，遇到主列表时切换到第一个子列表"""
         try:
-            response = requests.get(
-                self.m3u8_url,
-                headers=self.headers,
-                verify=False,
-                timeout=10
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"[错误] 获取 m3u8 失败: {response.status_code}")
-                return False
-            
-            content = response.text
+            content = self._fetch_playlist()
+            if content is None:
+                return None
             
             if '#EXT-X-STREAM-INF' in content:
                 for line in content.split('\n'):
+                    line = line.strip()
                     if line and not line.startswith('#'):
-                        sub_m3u8_url = urljoin(self.m3u8_url, line.strip())
-                        self.m3u8_url = sub_m3u8_url
-                        return self._parse_m3u8()
+                        self.m3u8_url = urljoin(self.m3u8_url, line)
+                        return self._load_media_playlist()
             
-            base_url = self.m3u8_url.rsplit('/', 1)[0] + '/'
+            return content
             
-            for line in content.split('\n'):
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    if line.startswith('http'):
-                        self.ts_urls.append(line)
-                    else:
-                        self.ts_urls.append(urljoin(base_url, line))
+        except Exception as e:
+            logger.error(f"[错误] 获取 m3u8 失败: {e}")
+            return None
+    
+    def _parse_m3u8(self, content: str) -> bool:
+        try:
+            self.ts_urls = [url for _, url in self._parse_media_playlist(content)[2]]
             
             logger.info(f"[信息] 找到 {len(self.ts_urls)} 个视频片段")
             return len(self.ts_urls) > 0
@@ -92,32 +155,188 @@ class M3U8Downloader:
             logger.error(f"[错误] 解析 m3u8 失败: {e}")
             return False
     
-    def _download_ts_files(self, ts_dir: str) -> bool:
-        logger.info(f"[下载] 开始下载 {len(self.ts_urls)} 个片段...")
+    def _parse_media_playlist(self, content: str) -> Tuple[float, bool, List[Tuple[int, str]]]:
+        """
+        解析媒体列表
+
+        Returns:
+            (目标时长, 是否已结束, [(媒体序号, 片段地址), ...])
+        """
+        base_url = self.m3u8_url.rsplit('/', 1)[0] + '/'
+        target_duration = 0.0
+        sequence = 0
+        segments = []
         
-        def download_one_ts(index: int, url: str) -> bool:
-            try:
-                response = requests.get(
-                    url,
-                    headers=self.headers,
-                    verify=False,
-                    timeout=30
-                )
+        for line in content.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            
+            if line.startswith('#EXT-X-TARGETDURATION:'):
+                target_duration = float(line.split(':', 1)[1])
+            elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+                sequence = int(line.split(':', 1)[1])
+            elif not line.startswith('#'):
+                url = line if line.startswith('http') else urljoin(base_url, line)
+                segments.append((sequence, url))
+                sequence += 1
+        
+        return target_duration, '#EXT-X-ENDLIST' in content, segments
+    
+    def _follow(self, content: str) -> bool:
+        """
+        跟随直播 / EVENT 列表：按目标时长刷新列表，只下载新出现的片段并追加写入
+        内存中最多只保留一批（max_workers 个）片段；
+        刷新失败时退避重试，取消、刷新失败过多或出错时保留已写入的片段，有片段即返回 True
+        """
+        last_sequence = -1
+        idle_reloads = 0
+        written = 0
+        outfile = None
+        
+        logger.info(f"[跟随] 开始跟随 m3u8 列表: {self.m3u8_url}")
+        
+        try:
+            while True:
+                target_duration, ended, segments = self._parse_media_playlist(content)
+                new_segments = [(seq, url) for seq, url in segments if seq > last_sequence]
                 
-                if response.status_code == 200:
-                    ts_path = os.path.join(ts_dir, f'{index:05d}.ts')
-                    with open(ts_path, 'wb') as f:
-                        f.write(response.content)
-                    return True
-                else:
-                    logger.error(f"[错误] 片段 {index} 下载失败: {response.status_code}")
-                    return False
+                if new_segments and last_sequence >= 0 and new_segments[0][0] > last_sequence + 1:
+                    logger.warning(f"[跟随] 跳过了 {new_segments[0][0] - last_sequence - 1} 个已过期片段")
+                
+                for i in range(0, len(new_segments), self.max_workers):
+                    if self.cancelled.is_set():
+                        break
+                    batch = new_segments[i:i + self.max_workers]
+                    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                        datas = list(executor.map(lambda s: self._fetch_segment(s[0], s[1]), batch))
                     
+                    for (seq, _), data in zip(batch, datas):
+                        if data is None:
+                            if self.cancelled.is_set():
+                                break
+                            self.skipped_segments += 1
+                            last_sequence = seq
+                            logger.warning(f"[跟随] 片段 {seq} 重试后仍然失败，已跳过（共跳过 {self.skipped_segments} 个）")
+                            continue
+                        
+                        if outfile is None:
+                            # 新建输出文件，不追加到同名的残留文件后面
+                            outfile = open(self.save_path, 'wb')
+                        
+                        outfile.write(data)
+                        outfile.flush()
+                        written += 1
+                        last_sequence = seq
+                
+                if ended or self.cancelled.is_set():
+                    break
+                
+                if new_segments:
+                    idle_reloads = 0
+                    if progress_throttle.allow(f"m3u8-{id(self)}") is not None:
+                        logger.info(f"[跟随] 已写入 {written} 个片段")
+                else:
+                    idle_reloads += 1
+                    if idle_reloads >= self.max_idle_reloads:
+                        logger.warning(f"[跟随] 连续 {idle_reloads} 次刷新无新片段，停止跟随")
+                        break
+                
+                # RFC 8216 6.3.4: 有新片段时间隔一个目标时长刷新，否则间隔一半
+                interval = target_duration or 2.0
+                content, idle_reloads = self._reload_playlist(interval if new_segments else interval / 2, idle_reloads)
+                if content is None:
+                    break
+            
+        except Exception as e:
+            logger.error(f"[错误] m3u8 跟随失败，保留已写入的 {written} 个片段: {e}")
+        finally:
+            if outfile:
+                outfile.close()
+            progress_throttle.forget(f"m3u8-{id(self)}")
+        
+        if written == 0:
+            return False
+        
+        state = "已停止" if self.cancelled.is_set() else "结束"
+        logger.success(f"[完成] m3u8 跟随{state}，共 {written} 个片段: {self.save_path}")
+        return True
+    
+    def _reload_playlist(self, delay: float, idle_reloads: int) -> Tuple[Optional[str], int]:
+        """
+        等待 delay 秒后刷新列表；失败时加倍等待时间（最多 30 秒）再试，每次失败计入 idle_reloads
+
+        Returns:
+            (列表内容, 更新后的 idle_reloads)，取消或连续失败达到 max_idle_reloads 时内容为 None
+        """
+        while not self.cancelled.wait(delay):
+            try:
+                content = self._fetch_playlist()
             except Exception as e:
-                logger.error(f"[错误] 片段 {index} 下载异常: {e}")
+                logger.warning(f"[跟随] 刷新列表异常: {e}")
+                content = None
+            if content is not None:
+                return content, idle_reloads
+            
+            idle_reloads += 1
+            if idle_reloads >= self.max_idle_reloads:
+                logger.warning(f"[跟随] 连续 {idle_reloads} 次刷新失败或无新片段，停止跟随")
+                return None, idle_reloads
+            delay = min(delay * 2, 30.0)
+        
+        logger.info("[跟随] 已取消，保留已写入的片段")
+        return None, idle_reloads
+    
+    def _fetch_segment(self, index: int, url: str) -> Optional[bytes]:
+        """下载一个片段，失败时最多重试 segment_retries 次（间隔 1 秒，取消时立即放弃）"""
+        for attempt in range(self.segment_retries + 1):
+            if attempt and self.cancelled.wait(1):
+                return None
+            data = self._fetch_segment_once(index, url)
+            if data is not None:
+                return data
+        return None
+    
+    def _fetch_segment_once(self, index: int, url: str) -> Optional[bytes]:
+        if self.cancelled.is_set():
+            return None
+        try:
+            response = requests.get(
+                url,
+                headers=self.headers,
+                verify=False,
+                timeout=30
+            )
+            
+            if response.status_code == 200:
+                data = response.content
+                if self.rate_limiter:
+                    self.rate_limiter.consume(len(data))
+                with self.lock:
+                    self.downloaded_size += len(data)
+                return data
+            
+            logger.error(f"[错误] 片段 {index} 下载失败: {response.status_code}")
+            return None
+            
+        except Exception as e:
+            logger.error(f"[错误] 片段 {index} 下载异常: {e}")
+            return None
+    
+    def _download_ts_files(self, ts_dir: str) -> bool:
+        logger.info(f"[下载] 开始下载 {len(self.ts_urls)} 个片段...")
+        
+        def download_one_ts(index: int, url: str) -> bool:
+            data = self._fetch_segment(index, url)
+            if data is None:
                 return False
+            
+            ts_path = os.path.join(ts_dir, f'{index:05d}.ts')
+            with open(ts_path, 'wb') as f:
+                f.write(data)
+            return True
         
-        with ThreadPoolExecutor(max_workers=8) as executor:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
             futures = {
                 executor.submit(download_one_ts, i, url): i
                 for i, url in enumerate(self.ts_urls)
@@ -127,9 +346,10 @@ class M3U8Downloader:
             for future in as_completed(futures):
                 if future.result():
                     success_count += 1
-                    if success_count % 10 == 0:
+                    if success_count % 10 == 0 and progress_throttle.allow(f"m3u8-{id(self)}") is not None:
                         logger.info(f"[进度] {success_count}/{len(self.ts_urls)}")
         
+        progress_throttle.forget(f"m3u8-{id(self)}")
         logger.info(f"[完成] 已下载 {success_count}/{len(self.ts_urls)} 个片段")
         return success_count == len(self.ts_urls)
     
@@ -160,7 +380,3 @@ class M3U8Downloader:
         except Exception as e:
             logger.warning(f"[警告] 清理临时文件失败: {e}")
 
-
-def is_m3u8_url(url: str) -> bool:
-    return '.m3u8' in url.lower()
-
@@ -0,0 +1,37 @@
+"""
+媒体识别与分类规则
+代理进程嗅探时和下载服务进程都要用到，这里只依赖配置，不导入 mitmproxy、requests 等重量级依赖
+"""
+from urllib.parse import parse_qs, urlsplit
+
+from models.entities import VideoData
+from utils.config import config
+
+
+def is_m3u8_url(url: str) -> bool:
+    return '.m3u8' in url.lower()
+
+
+def is_small_object(video_data: VideoData) -> bool:
+    """图片和小于阈值的媒体走小文件下载"""
+    if is_m3u8_url(video_data.url):
+        return False
+    return video_data.media_type == 'image' or 0 < video_data.size <= config.small_object_threshold
+
+
+def media_key(url: str) -> str:
+    """
+    媒体标识：去掉 token 等会变化的参数，用于识别同一个媒体文件
+    
+    视频号 CDN 地址以 encfilekey 区分文件，X-snsvideoflag 区分清晰度
+    """
+    parsed = urlsplit(url)
+    params = parse_qs(parsed.query)
+    
+    if 'encfilekey' in params:
+        key = f"{parsed.path}?encfilekey={params['encfilekey'][0]}"
+        if 'X-snsvideoflag' in params:
+            key += f"&X-snsvideoflag={params['X-snsvideoflag'][0]}"
+        return key
+    
+    return f"{parsed.netloc}{parsed.path}"
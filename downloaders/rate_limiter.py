@@ -0,0 +1,42 @@
+"""
+全局限速
+所有下载线程共用一个令牌桶，限速可以在运行中调整；不限速时不加锁
+"""
+import time
+from threading import Lock
+
+
+class RateLimiter:
+    """令牌桶：每秒补充 rate 字节，最多积攒 1 秒的量"""
+
+    def __init__(self, rate: int = 0):
+        """
+        Args:
+            rate: 每秒字节数，0 表示不限速
+        """
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated_at = time.monotonic()
+        self.lock = Lock()
+
+    def set_rate(self, rate: int) -> None:
+        with self.lock:
+            self.rate = max(0, rate)
+            self.tokens = min(self.tokens, float(self.rate))
+            self.updated_at = time.monotonic()
+
+    def consume(self, size: int) -> None:
+        """取出 size 字节的令牌，不够时睡眠等待；各线程按到达顺序欠账，不会饿死"""
+        if self.rate <= 0:
+            return
+        with self.lock:
+            rate = self.rate
+            if rate <= 0:
+                return
+            now = time.monotonic()
+            self.tokens = min(float(rate), self.tokens + (now - self.updated_at) * rate)
+            self.updated_at = now
+            self.tokens -= size
+            wait = -self.tokens / rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
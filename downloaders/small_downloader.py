@@ -0,0 +1,95 @@
+"""
+小文件下载器
+图片、封面等几百 KB 的对象不走分段下载：
+共享连接池的一次 GET 直接读入内存，需要时在内存中解密，再一次写入文件
+读取时按块计入共用的限速器，与视频下载共享带宽限制
+"""
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from crypto.decryptor import ENCRYPTED_LENGTH, decrypt
+from models.entities import SmallObjectTask
+from utils.logger import logger
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# 每次从连接读取的字节数，也是限速器的计量粒度
+READ_SIZE = 64 * 1024
+
+
+class SmallObjectDownloader:
+    """小文件下载器：连接池 + 并发 + 单次写入"""
+    
+    def __init__(self, max_workers: int = 16, headers: Optional[dict] = None, rate_limiter=None):
+        """
+        Args:
+            max_workers: 并发下载数（同时也是连接池大小）
+            headers: 请求头
+            rate_limiter: 共用的限速器（RateLimiter），为 None 时不限速
+        """
+        self.max_workers = max_workers
+        self.headers = headers or {}
+        self.rate_limiter = rate_limiter
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='small')
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.verify = False
+        
+        if 'User-Agent' not in self.headers:
+            self.headers['User-Agent'] = (
+                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+                'AppleWebKit/537.36 (KHTML, like Gecko) '
+                'Chrome/120.0.0.0 Safari/537.36'
+            )
+    
+    def fetch(self, task: SmallObjectTask) -> bool:
+        try:
+            with self.session.get(task.url, headers=self.headers, timeout=30, stream=True) as response:
+                if response.status_code != 200:
+                    logger.error(f"[错误] 小文件下载失败: {response.status_code} {task.url}")
+                    return False
+                
+                data = bytearray()
+                for chunk in response.iter_content(chunk_size=READ_SIZE):
+                    data += chunk
+                    if self.rate_limiter:
+                        self.rate_limiter.consume(len(chunk))
+            
+            if task.decode_key:
+                if not decrypt(data, min(len(data), ENCRYPTED_LENGTH), int(task.decode_key)):
+                    return False
+            
+            self._write_file(task.save_path, data)
+            return True
+            
+        except Exception as e:
+            logger.error(f"[错误] 小文件下载异常: {e}")
+            return False
+    
+    def submit(self, task: SmallObjectTask) -> Future:
+        """后台下载，不等待结果"""
+        return self.executor.submit(self.fetch, task)
+    
+    def fetch_many(self, tasks: List[SmallObjectTask]) -> List[bool]:
+        """并发下载一批小文件，按输入顺序返回结果"""
+        futures = [self.submit(task) for task in tasks]
+        return [future.result() for future in futures]
+    
+    @staticmethod
+    def _write_file(path: str, data: bytes) -> None:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+        finally:
+            os.close(fd)
@@ -1,12 +1,14 @@
 """
 多线程视频下载器
-支持分段下载、断点续传、自动重试
+支持分段下载、断点续传、自动重试、限速和中途取消（cancel，各线程在下一个数据块前退出）
 """
+import errno
 import hashlib
 import os
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
-from typing import Optional, Callable, List
+from threading import Event, Lock
+from typing import Dict, Optional, Callable, List, Tuple
 
 import requests
 import urllib3
@@ -27,18 +29,50 @@ class VideoDownloader:
         headers: Optional[dict] = None,
         thread_count: int = 4,
         chunk_size: int = 1024 * 1024,
-        progress_callback: Optional[Callable] = None
+        read_size: int = 8192,
+        progress_callback: Optional[Callable] = None,
+        temp_path: Optional[str] = None,
+        completed_ranges: Optional[List[Tuple[int, int]]] = None,
+        keep_temp_on_failure: bool = False,
+        rename_on_complete: bool = True,
+        hasher=None,
+        rate_limiter=None
     ):
+        """
+        Args:
+            chunk_size: 分段大小，文件按它切分给各线程（分段边界对齐到它）
+            read_size: 每次从响应读取并写入文件的字节数，也是取消、限速和进度回调的粒度
+            temp_path: 临时文件路径，默认为 save_path + '.tmp'
+            completed_ranges: temp_path 中已经写好的字节区间（闭区间），只下载其余部分
+            keep_temp_on_failure: 失败时保留临时文件，配合 downloaded_ranges() 续传
+            rename_on_complete: 完成后把临时文件重命名为 save_path；为 False 时由调用方处理
+            hasher: 边写边算哈希，写入时调用 hasher.update(偏移, 数据)
+            rate_limiter: 共用的限速器（RateLimiter），为 None 时不限速
+        """
         self.url = url
         self.save_path = save_path
+        self.temp_path = temp_path or save_path + '.tmp'
+        self.completed_ranges = completed_ranges or []
+        self.keep_temp_on_failure = keep_temp_on_failure
+        self.rename_on_complete = rename_on_complete
+        self.hasher = hasher
+        self.rate_limiter = rate_limiter
         self.headers = headers or {}
         self.thread_count = thread_count
         self.chunk_size = chunk_size
+        self.read_size = read_size
         self.progress_callback = progress_callback
         
         self.total_size = 0
         self.downloaded_size = 0
+        # 开始传输前已有的字节数（续传 / 被动捕获），downloaded_size 减去它为本次下载的字节数
+        self.resumed_size = 0
+        # 各步骤耗时（秒）：probe 为获取大小和检查 Range 支持，transfer 为分段传输
+        self.timings: Dict[str, float] = {}
         self.lock = Lock()
+        self.cancelled = Event()
+        # 预分配或写入时磁盘已满（ENOSPC），调用方可以等空间释放后续传
+        self.disk_full = False
         self.tasks: List[DownloadTask] = []
         
         if 'User-Agent' not in self.headers:
@@ -48,19 +82,57 @@ class VideoDownloader:
                 'Chrome/120.0.0.0 Safari/537.36'
             )
     
+    def cancel(self) -> None:
+        """停止下载：各线程在下一个数据块前退出，start() 返回 False，已写入的区间见 downloaded_ranges()"""
+        self.cancelled.set()
+    
+    def update_url(self, url: str) -> None:
+        """换用新地址（token 刷新），之后的重试都使用新地址"""
+        self.url = url
+    
+    def downloaded_ranges(self) -> List[Tuple[int, int]]:
+        """临时文件中已经写好的字节区间（闭区间）"""
+        ranges = list(self.completed_ranges)
+        with self.lock:
+            for task in self.tasks:
+                if task.downloaded > 0:
+                    ranges.append((task.start, task.start + task.downloaded - 1))
+        
+        merged: List[Tuple[int, int]] = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+            else:
+                merged.append((start, end))
+        return merged
+    
+    def transferred_size(self) -> int:
+        """本次从网络下载的字节数"""
+        return max(0, self.downloaded_size - self.resumed_size)
+    
     def start(self) -> bool:
+        if self.cancelled.is_set():
+            return False
         try:
+            started = time.perf_counter()
             if not self._get_file_info():
                 return False
             
             support_range = self._check_range_support()
+            self.timings['probe'] = time.perf_counter() - started
             
-            if support_range and self.total_size > self.chunk_size:
+            if support_range and self.total_size > 0 and self.completed_ranges:
+                self._create_gap_tasks()
+            elif support_range and self.total_size > self.chunk_size:
                 self._create_multipart_tasks()
             else:
                 self._create_single_task()
             
-            return self._execute_download()
+            started = time.perf_counter()
+            try:
+                return self._execute_download()
+            finally:
+                self.timings['transfer'] = time.perf_counter() - started
             
         except Exception as e:
             logger.error(f"[错误] 下载失败: {e}")
@@ -74,6 +146,9 @@ class VideoDownloader:
                 timeout=10,
                 verify=False
             )
+            if response.status_code >= 400:
+                logger.error(f"[错误] 获取文件信息失败: {response.status_code}")
+                return False
             self.total_size = int(response.headers.get('Content-Length', 0))
             
             if self.total_size <= 0:
@@ -102,7 +177,9 @@ class VideoDownloader:
     
     def _create_multipart_tasks(self) -> None:
         chunk_count = min(self.thread_count, self.total_size // self.chunk_size + 1)
-        chunk_size = self.total_size // chunk_count
+        # 分段边界对齐到 chunk_size，分块哈希的每个块只由一个线程顺序写入
+        chunk_size = -(-self.total_size // chunk_count // self.chunk_size) * self.chunk_size
+        chunk_count = -(-self.total_size // chunk_size)
         
         for i in range(chunk_count):
             start = i * chunk_size
@@ -113,6 +190,33 @@ class VideoDownloader:
                 end=end
             ))
     
+    def _create_gap_tasks(self) -> None:
+        """只为 completed_ranges 以外的空缺区间创建任务，大的空缺再按线程数切分"""
+        gaps = []
+        position = 0
+        for start, end in sorted(self.completed_ranges):
+            if start > position:
+                gaps.append((position, min(start, self.total_size) - 1))
+            position = max(position, end + 1)
+        if position < self.total_size:
+            gaps.append((position, self.total_size - 1))
+        
+        self.resumed_size = self.downloaded_size = self.total_size - sum(end - start + 1 for start, end in gaps)
+        
+        missing = self.total_size - self.downloaded_size
+        piece_size = max(self.chunk_size, missing // self.thread_count + 1)
+        for start, end in gaps:
+            while start <= end:
+                piece_end = min(end, start + piece_size - 1)
+                self.tasks.append(DownloadTask(
+                    task_id=len(self.tasks),
+                    start=start,
+                    end=piece_end
+                ))
+                start = piece_end + 1
+        
+        logger.debug(f"[下载] 已有 {self.downloaded_size}/{self.total_size} 字节，补齐 {len(self.tasks)} 个区间")
+    
     def _create_single_task(self) -> None:
         self.tasks.append(DownloadTask(
             task_id=0,
@@ -121,15 +225,18 @@ class VideoDownloader:
         ))
     
     def _execute_download(self) -> bool:
-        temp_file = self.save_path + '.tmp'
+        temp_file = self.temp_path
         
         try:
             if self.total_size > 0:
-                with open(temp_file, 'wb') as f:
-                    f.seek(self.total_size - 1)
-                    f.write(b'\0')
+                keep = bool(self.completed_ranges) and os.path.exists(temp_file)
+                preallocate(temp_file, self.total_size, truncate=not keep)
             
-            with ThreadPoolExecutor(max_workers=len(self.tasks)) as executor:
+            if not self.tasks:
+                self._complete()
+                return True
+            
+            with ThreadPoolExecutor(max_workers=min(len(self.tasks), self.thread_count)) as executor:
                 futures = {
                     executor.submit(self._download_part, task, temp_file): task
                     for task in self.tasks
@@ -140,29 +247,43 @@ class VideoDownloader:
                     try:
                         success = future.result()
                         if not success:
-                            if os.path.exists(temp_file):
-                                os.remove(temp_file)
+                            self._discard_temp()
                             return False
                     except Exception as e:
-                        if os.path.exists(temp_file):
-                            os.remove(temp_file)
+                        self._discard_temp()
                         return False
             
-            if os.path.exists(temp_file):
-                os.rename(temp_file, self.save_path)
+            self._complete()
             return True
             
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                self.disk_full = True
+                logger.warning(f"[磁盘] 空间不足，无法写入临时文件: {temp_file}")
+            else:
+                logger.error(f"[错误] 写入临时文件失败: {e}")
+            self._discard_temp()
+            return False
         except Exception as e:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+            self._discard_temp()
             return False
     
+    def _complete(self) -> None:
+        if self.rename_on_complete and os.path.exists(self.temp_path):
+            os.replace(self.temp_path, self.save_path)
+    
+    def _discard_temp(self) -> None:
+        if not self.keep_temp_on_failure and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+    
     def _download_part(self, task: DownloadTask, temp_file: str) -> bool:
         task_id = task.task_id
         start = task.start
         end = task.end
         
         for retry in range(3):
+            if self.cancelled.is_set():
+                return False
             try:
                 headers = self.headers.copy()
                 if end > 0:
@@ -184,13 +305,27 @@ class VideoDownloader:
                         continue
                     return False
                 
+                if response.status_code == 200 and start + task.downloaded > 0:
+                    # 服务器忽略了 Range，返回的是完整文件，不能写到偏移处
+                    response.close()
+                    return False
+                
                 with open(temp_file, 'r+b') as f:
-                    f.seek(start + task.downloaded)
+                    position = start + task.downloaded
+                    f.seek(position)
                     
-                    for chunk in response.iter_content(chunk_size=8192):
+                    for chunk in response.iter_content(chunk_size=self.read_size):
+                        if self.cancelled.is_set():
+                            response.close()
+                            return False
                         if chunk:
                             f.write(chunk)
                             chunk_len = len(chunk)
+                            if self.hasher:
+                                self.hasher.update(position, chunk)
+                            position += chunk_len
+                            if self.rate_limiter:
+                                self.rate_limiter.consume(chunk_len)
                             
                             with self.lock:
                                 self.downloaded_size += chunk_len
@@ -205,15 +340,41 @@ class VideoDownloader:
                 return True
                 
             except Exception as e:
-                if retry < 2:
-                    import time
-                    time.sleep(2)
+                if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+                    # 磁盘写满，重试也没有用
+                    self.disk_full = True
+                    return False
+                if retry < 2 and not self.cancelled.wait(2):
                     continue
                 return False
         
         return False
 
 
+def preallocate(path: str, size: int, truncate: bool = True) -> None:
+    """
+    为文件真正分配磁盘空间（posix_fallocate），空间不足时立即抛出 OSError，
+    而不是下载到一半才失败；文件系统不支持时退回到稀疏文件
+
+    Args:
+        truncate: 为 False 时保留已有内容（续传），只把文件扩展到 size
+    """
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if truncate else 0)
+    fd = os.open(path, flags, 0o644)
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, size)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                    raise
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
 def format_size(size: int) -> str:
     for unit in ['B', 'KB', 'MB', 'GB']:
         if size < 1024:
@@ -1,16 +1,26 @@
 """
 微信视频号自动嗅探下载器 - 主程序
 """
+import sys
+
+from utils import import_profiler
+
+# 需要在导入其他模块之前开始计时，所以不等 argparse
+if '--profile-startup' in sys.argv:
+    import_profiler.install()
+
 import argparse
 import atexit
 import os
+import secrets
 import signal
 import subprocess
-import sys
-import time
+import tempfile
 from pathlib import Path
-from typing import Optional
+from threading import Thread
+from typing import List, Optional
 
+from core import startup
 from core.proxy_manager import ProxyManager, check_certificate
 from utils.config import config
 from utils.logger import logger
@@ -24,9 +34,58 @@ def cleanup_proxy():
         proxy_manager.cleanup()
 
 
+def setup_system_proxy(port: int, auto_proxy: bool) -> None:
+    """代理就绪后设置系统代理并检查证书"""
+    global proxy_manager
+    
+    if auto_proxy:
+        proxy_manager = ProxyManager("127.0.0.1", port)
+        
+        if proxy_manager.setup():
+            atexit.register(cleanup_proxy)
+        else:
+            logger.warning("⚠️自动设置代理失败，请手动设置")
+            logger.warning(f"代理地址: 127.0.0.1:{port}")
+            proxy_manager = None
+    else:
+        logger.info(f"⚠️请手动设置系统代理: 127.0.0.1:{port}")
+    
+    if not check_certificate():
+        logger.warning("⚠️无法连接到代理，可能需要安装证书")
+
+
+async def run_embedded(port: int, auto_proxy: bool) -> None:
+    """在主进程中运行 mitmproxy（DumpMaster），就绪后在后台线程里设置系统代理"""
+    import asyncio
+    from mitmproxy.options import Options
+    from mitmproxy.tools.dump import DumpMaster
+    
+    master = DumpMaster(Options(listen_host='127.0.0.1', listen_port=port), with_dumper=False)
+    master.options.update(block_global=False, stream_large_bodies='5m', ssl_insecure=True)
+    
+    from core import addon_server
+    for addon in addon_server.addons:
+        master.addons.add(addon)
+    
+    def on_ready():
+        startup.ready.wait()
+        setup_system_proxy(port, auto_proxy)
+    
+    Thread(target=on_ready, daemon=True).start()
+    
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, master.shutdown)
+        except (NotImplementedError, RuntimeError):
+            # Windows 不支持，Ctrl+C 以 KeyboardInterrupt 的形式抛出
+            pass
+    
+    await master.run()
+
+
 def main():
     """主函数"""
-    global proxy_manager
     
     parser = argparse.ArgumentParser(
         description='微信视频号自动嗅探下载器',
@@ -52,69 +111,213 @@ def main():
         help='不自动设置系统代理'
     )
     
+    parser.add_argument(
+        '--no-passive-capture',
+        action='store_true',
+        help='不捕获客户端播放时的视频流量（所有数据都重新从 CDN 下载）'
+    )
+    
+    parser.add_argument(
+        '--intercept',
+        choices=['selective', 'all'],
+        default=config.intercept_mode,
+        help='selective: 只解密微信相关域名，其余 TLS 透传；all: 解密全部 (默认: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--faststart',
+        action='store_true',
+        help='下载完成后把 MP4 的 moov 移到文件开头，便于边下边播'
+    )
+    
+    parser.add_argument(
+        '--dedup',
+        choices=['hardlink', 'symlink'],
+        help='按内容去重保存：相同视频只存一份，文件名为指向它的硬链接或符号链接'
+    )
+    
+    parser.add_argument(
+        '--shard',
+        choices=['none', 'date', 'hash'],
+        default=config.shard_mode,
+        help='按日期或文件名哈希前缀分子目录保存，避免单个目录文件过多 (默认: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--embedded',
+        action='store_true',
+        help='在主进程内运行 mitmproxy 并下载（不启动 mitmdump 子进程和下载服务进程，包含 --in-process）'
+    )
+    
+    parser.add_argument(
+        '--in-process',
+        action='store_true',
+        help='在代理进程内下载（不启动独立的下载服务进程）'
+    )
+    
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=config.proxy_workers,
+        help='代理进程数：监听从 --port 开始的连续端口，共用一个下载服务 (默认: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--log-async',
+        action='store_true',
+        help='终端日志由后台线程输出，下载线程不等待终端'
+    )
+    
+    parser.add_argument(
+        '--log-json',
+        action='store_true',
+        help='同时输出 JSON Lines 格式的日志文件（logs/日期.jsonl，每行带任务编号）'
+    )
+    
+    parser.add_argument(
+        '--log-sample',
+        type=float,
+        metavar='SECONDS',
+        default=config.log_sample_interval,
+        help='同一任务的下载进度日志至少间隔多少秒输出一次，0 为不限制 (默认: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--profile-startup',
+        action='store_true',
+        help='输出各模块的导入耗时和到代理就绪的耗时，用于排查启动变慢'
+    )
+    
     args = parser.parse_args()
     
+    if args.workers < 1:
+        parser.error('--workers 至少为 1')
+    if args.workers > 1 and (args.embedded or args.in_process):
+        parser.error('多个代理进程需要共用独立的下载服务，不能与 --embedded / --in-process 同时使用')
+    # 主进程内运行 mitmproxy 时也在主进程内下载，整个程序只有一个进程
+    in_process = args.in_process or args.embedded
+    
+    # 日志在第一次输出时才配置，这里设置的选项对本进程和子进程都生效
+    if args.log_async:
+        os.environ['LOG_ENQUEUE'] = '1'
+    if args.log_json:
+        os.environ['LOG_JSON'] = '1'
+    os.environ['LOG_SAMPLE_INTERVAL'] = str(args.log_sample)
+    
     save_dir = Path(args.dir).absolute()
     save_dir.mkdir(exist_ok=True)
     port = args.port
+    ports = list(range(port, port + args.workers))
     
     logger.info("")
     logger.info("=" * 70)
     logger.info("  🎬微信视频号自动嗅探下载器")
     logger.info(f"  📁保存目录: {save_dir}")
-    logger.info(f"  🌐代理端口: {port}")
+    logger.info(f"  🌐代理端口: {port}" if args.workers == 1 else f"  🌐代理端口: {ports[0]}-{ports[-1]}（{args.workers} 个代理进程）")
+    logger.info(f"  🔍拦截模式: {args.intercept}")
     logger.info("=" * 70)
     logger.info("")
     
     env = os.environ.copy()
     env['SAVE_DIR'] = str(save_dir)
     env['PORT'] = str(port)
+    if args.no_passive_capture:
+        env['PASSIVE_CAPTURE'] = '0'
+    env['INTERCEPT_MODE'] = args.intercept
+    if args.faststart:
+        env['FASTSTART'] = '1'
+    env['SHARD_MODE'] = args.shard
+    if args.dedup:
+        env['CONTENT_STORE'] = '1'
+        env['LINK_MODE'] = args.dedup
+    if not in_process:
+        # 下载服务使用代理端口之后的第一个端口
+        env['DOWNLOAD_SERVICE'] = f"127.0.0.1:{ports[-1] + 1}"
+        env['DOWNLOAD_SERVICE_KEY'] = secrets.token_hex(16)
+    # mitmdump 只把脚本所在目录（core/）加入 sys.path，这里补上项目根目录
+    project_root = str(Path(__file__).parent.absolute())
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [project_root, env.get('PYTHONPATH')]))
+    env['STARTUP_TS'] = str(startup.STARTED_AT)
+    ready_file = os.path.join(tempfile.gettempdir(), f"wechat-downloader-{os.getpid()}.ready")
+    env['READY_FILE'] = ready_file
     
     addon_script = Path(__file__).parent / 'core' / 'addon_server.py'
     
-    cmd = [
-        'mitmdump',
-        '-s', str(addon_script),
-        '-p', str(port),
-        '--set', 'block_global=false',
-        '--set', 'stream_large_bodies=5m',
-        '--ssl-insecure',
-        '--quiet'
-    ]
+    processes: List[subprocess.Popen] = []
+    ready_files: List[str] = []
+    service = None
     
-    process = None
+    def start_worker(index: int) -> None:
+        """启动一个 mitmdump 代理进程，多个代理进程时各自使用单独的就绪文件"""
+        worker_env = env
+        worker_ready_file = ready_file
+        if args.workers > 1:
+            worker_env = dict(env, PROXY_WORKER=f"worker-{index}")
+            worker_ready_file = f"{ready_file}.{index}"
+            worker_env['READY_FILE'] = worker_ready_file
+        cmd = [
+            'mitmdump',
+            '-s', str(addon_script),
+            '-p', str(ports[index]),
+            '--set', 'block_global=false',
+            '--set', 'stream_large_bodies=5m',
+            '--ssl-insecure',
+            '--quiet'
+        ]
+        processes.append(subprocess.Popen(cmd, env=worker_env))
+        ready_files.append(worker_ready_file)
+    
+    def wait_workers(indexes: List[int]) -> None:
+        for index in indexes:
+            if startup.wait_ready_file(ready_files[index], processes[index]) is None:
+                if processes[index].poll() is not None:
+                    logger.error(f"❌代理服务器启动失败: {ports[index]}")
+                    sys.exit(1)
+                logger.warning(f"⚠️等待代理就绪超时: {ports[index]}")
     
     try:
-        logger.info("🚀启动代理服务器...")
-        process = subprocess.Popen(cmd, env=env)
+        if not in_process:
+            logger.info("🚀启动下载服务...")
+            service = subprocess.Popen(
+                [sys.executable, '-m', 'core.download_service'],
+                env=env,
+                cwd=str(Path(__file__).parent)
+            )
         
-        time.sleep(1)
+        if args.embedded:
+            logger.info("🚀启动代理服务器（主进程内）...")
+            os.environ.update(env)
+            import asyncio
+            asyncio.run(run_embedded(port, not args.no_auto_proxy))
+            return
         
-        if not args.no_auto_proxy:
-            proxy_manager = ProxyManager("127.0.0.1", port)
-            
-            if proxy_manager.setup():
-                atexit.register(cleanup_proxy)
-            else:
-                logger.warning("⚠️自动设置代理失败，请手动设置")
-                logger.warning(f"代理地址: 127.0.0.1:{port}")
-                proxy_manager = None
-        else:
-            logger.info(f"⚠️请手动设置系统代理: 127.0.0.1:{port}")
+        logger.info("🚀启动代理服务器..." if args.workers == 1 else f"🚀启动 {args.workers} 个代理进程...")
+        indexes = list(range(args.workers))
+        if args.workers > 1 and not (Path.home() / '.mitmproxy' / 'mitmproxy-ca.pem').exists():
+            # 第一次运行时先让一个进程生成 CA 证书，避免多个进程各自生成不同的证书
+            start_worker(0)
+            wait_workers([0])
+            indexes = indexes[1:]
+        for index in indexes:
+            start_worker(index)
+        wait_workers(indexes)
+        startup.log_import_profile()
         
-        if not check_certificate():
-            logger.warning("⚠️无法连接到代理，可能需要安装证书")
+        # 系统代理指向第一个代理进程，其余端口供其他设备手动配置
+        setup_system_proxy(port, not args.no_auto_proxy)
         
-        process.wait()
+        for process in processes:
+            process.wait()
         
     except KeyboardInterrupt:
         logger.info("⏸️️正在停止...")
-        if process:
-            process.send_signal(signal.SIGINT)
-            try:
-                process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                process.kill()
+        for child in processes + [service]:
+            if child:
+                child.send_signal(signal.SIGINT)
+                try:
+                    child.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    child.kill()
         logger.success("✅已停止")
         
     except FileNotFoundError:
@@ -126,6 +329,14 @@ def main():
         sys.exit(1)
         
     finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        if service and service.poll() is None:
+            service.terminate()
+        for path in ready_files + [ready_file]:
+            if os.path.exists(path):
+                os.remove(path)
         cleanup_proxy()
 
 
@@ -0,0 +1,249 @@
+"""
+微信视频号批量下载 - 不启动代理
+从 JSONL 文件读取之前捕获的视频信息（每行一个页面上报到 /res-downloader/wechat 的请求体），
+解析、按媒体去重后交给下载流水线下载和解密，全部结束后输出吞吐量和失败统计；
+适合在没有微信的服务器上重新下载
+
+用法: python main_batch.py payloads.jsonl [更多文件 ...] [-d 目录] [-j 同时下载数]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from threading import Lock
+from typing import List
+
+from utils.config import config
+from utils.logger import logger
+
+
+class BatchDownloader:
+    """读取视频信息文件，去重后提交给下载服务（进程内），等待全部任务结束，失败的媒体续传重试"""
+
+    def __init__(self, retries: int = 1):
+        """
+        Args:
+            retries: 全部任务结束后，最终失败的媒体再提交几轮（从已下载的部分续传）
+        """
+        # 下载流水线和 requests 在设置好环境变量之后才加载
+        from core.download_service import DownloadService
+
+        self.service = DownloadService(on_failed=self._on_failed)
+        self.retries = retries
+        self.seen = set()
+        self.failed: List = []
+        self.lock = Lock()
+        self.counters = dict.fromkeys(('lines', 'invalid', 'media', 'duplicates', 'submitted'), 0)
+        self.started_at = time.monotonic()
+
+    def start(self) -> None:
+        self.service.start()
+
+    def _on_failed(self, video_data) -> None:
+        with self.lock:
+            self.failed.append(video_data)
+
+    def load(self, path: str) -> None:
+        """逐行读取并提交，流水线队列满时阻塞（不会一次读入整个文件）"""
+        from core.video_info import extract_video_urls
+        from downloaders.media_rules import media_key
+
+        source = 'stdin' if path == '-' else os.path.basename(path)
+        handle = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+        try:
+            for line_no, line in enumerate(handle, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                self.counters['lines'] += 1
+
+                try:
+                    payload = json.loads(line)
+                    if not isinstance(payload, dict):
+                        raise ValueError("不是 JSON 对象")
+                except ValueError as e:
+                    self.counters['invalid'] += 1
+                    logger.warning(f"[批量] {source}:{line_no} 解析失败: {e}")
+                    continue
+
+                group = extract_video_urls(payload)
+                if not group:
+                    self.counters['invalid'] += 1
+                    logger.warning(f"[批量] {source}:{line_no} 没有可下载的媒体")
+                    continue
+
+                # 同一媒体不同 token 的地址也只下载一次
+                new = [video_data for video_data in group if media_key(video_data.url) not in self.seen]
+                self.seen.update(media_key(video_data.url) for video_data in new)
+                self.counters['media'] += len(group)
+                self.counters['duplicates'] += len(group) - len(new)
+                if new:
+                    self.counters['submitted'] += len(new)
+                    self.service.submit(new, source=source)
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+
+    def _finished(self) -> bool:
+        """入队的任务都已完成或失败（回调在任务离开流水线之后才调用，不能只看流水线）"""
+        stats = self.service.source_stats().values()
+        accepted = sum(counters['accepted'] for counters in stats)
+        done = sum(counters['completed'] + counters['failed'] for counters in stats)
+        return done >= accepted and not self.service.pipeline.pending()
+
+    def wait(self, poll_interval: float = 0.5) -> List:
+        """
+        等待全部任务结束，失败的媒体重新提交
+
+        Returns:
+            最终失败的媒体
+        """
+        attempt = 0
+        while True:
+            while not self._finished():
+                time.sleep(poll_interval)
+            with self.lock:
+                failed, self.failed = self.failed, []
+            if not failed or attempt >= self.retries:
+                return failed
+            attempt += 1
+            logger.info(f"🔁重新下载 {len(failed)} 个失败的媒体（第 {attempt}/{self.retries} 轮）")
+            for video_data in failed:
+                self.service.submit([video_data], source='retry')
+
+    def summary(self, failed: List) -> None:
+        from core.pipeline import FAILURES
+        from downloaders.video_downloader import format_size
+
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        stats = self.service.source_stats().values()
+        completed = sum(counters['completed'] for counters in stats)
+        saved = sum(counters['bytes'] for counters in stats)
+        transferred = self.service.pipeline.downloaded_bytes()
+        reasons = ', '.join(f"{key[0]}: {int(count)}" for key, count in sorted(FAILURES.values.items()))
+
+        logger.info("")
+        logger.info("=" * 70)
+        logger.info(f"  📄视频信息: {self.counters['lines']} 行（无效 {self.counters['invalid']}）")
+        logger.info(f"  🎞️媒体: {self.counters['media']} 个（重复 {self.counters['duplicates']}，"
+                    f"下载 {self.counters['submitted']}）")
+        logger.info(f"  ✅完成: {completed} 个，{format_size(saved)}")
+        logger.info(f"  ❌失败: {len(failed)} 个" + (f"（各次失败原因 {reasons}）" if reasons else ""))
+        logger.info(f"  ⏱️耗时: {elapsed:.1f}s | 下载 {format_size(transferred)} "
+                    f"({format_size(int(transferred / elapsed))}/s) | {completed / elapsed * 60:.1f} 个/分钟")
+        logger.info("=" * 70)
+        for video_data in failed:
+            logger.warning(f"  ❌{video_data.display_name} {video_data.url}")
+
+
+def main():
+    """主函数"""
+
+    parser = argparse.ArgumentParser(
+        description='微信视频号批量下载：从捕获的视频信息（JSONL）下载，不启动代理',
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument(
+        'inputs',
+        nargs='+',
+        help='JSONL 文件，每行一个上报到 /res-downloader/wechat 的请求体；- 为标准输入'
+    )
+
+    parser.add_argument(
+        '-d', '--dir',
+        default=config.download_dir,
+        help=f'视频保存目录 (默认: {config.download_dir})'
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=config.stage_workers['fetch'],
+        help='同时下载的媒体数 (默认: %(default)s)'
+    )
+
+    parser.add_argument(
+        '--bandwidth',
+        type=int,
+        metavar='KB',
+        default=config.bandwidth_limit // 1024,
+        help='所有下载共用的限速（KB/s），0 为不限速 (默认: %(default)s)'
+    )
+
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=1,
+        help='全部结束后失败的媒体再续传重试几轮 (默认: %(default)s)'
+    )
+
+    parser.add_argument(
+        '--faststart',
+        action='store_true',
+        help='下载完成后把 MP4 的 moov 移到文件开头，便于边下边播'
+    )
+
+    parser.add_argument(
+        '--dedup',
+        choices=['hardlink', 'symlink'],
+        help='按内容去重保存：相同视频只存一份，文件名为指向它的硬链接或符号链接'
+    )
+
+    parser.add_argument(
+        '--shard',
+        choices=['none', 'date', 'hash'],
+        default=config.shard_mode,
+        help='按日期或文件名哈希前缀分子目录保存，避免单个目录文件过多 (默认: %(default)s)'
+    )
+
+    args = parser.parse_args()
+
+    if args.jobs < 1:
+        parser.error('--jobs 至少为 1')
+    for path in args.inputs:
+        if path != '-' and not os.path.isfile(path):
+            parser.error(f'文件不存在: {path}')
+
+    save_dir = Path(args.dir).absolute()
+    save_dir.mkdir(parents=True, exist_ok=True)
+
+    # 下载服务按环境变量读取配置
+    os.environ['SAVE_DIR'] = str(save_dir)
+    os.environ['STAGE_WORKERS'] = ','.join(filter(None, [os.getenv('STAGE_WORKERS'), f"fetch={args.jobs}"]))
+    os.environ['BANDWIDTH_LIMIT_KB'] = str(args.bandwidth)
+    os.environ['SHARD_MODE'] = args.shard
+    if args.faststart:
+        os.environ['FASTSTART'] = '1'
+    if args.dedup:
+        os.environ['CONTENT_STORE'] = '1'
+        os.environ['LINK_MODE'] = args.dedup
+
+    logger.info("")
+    logger.info("=" * 70)
+    logger.info("  🎬微信视频号批量下载")
+    logger.info(f"  📁保存目录: {save_dir}")
+    logger.info(f"  📄输入: {', '.join(args.inputs)}")
+    logger.info(f"  ⚙️同时下载: {args.jobs}" + (f" | 限速: {args.bandwidth}KB/s" if args.bandwidth else ""))
+    logger.info("=" * 70)
+    logger.info("")
+
+    batch = BatchDownloader(retries=args.retries)
+    batch.start()
+    failed = []
+    try:
+        for path in args.inputs:
+            batch.load(path)
+        failed = batch.wait()
+    except KeyboardInterrupt:
+        logger.info("⏸️️已中断，未完成的任务不再等待")
+        with batch.lock:
+            failed = list(batch.failed)
+    batch.summary(failed)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
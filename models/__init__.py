@@ -1,8 +1,10 @@
 """数据模型"""
-from models.entities import VideoData, DownloadTask
+from models.entities import VideoData, DownloadTask, SmallObjectTask, DownloadJob
 
 __all__ = [
     'VideoData',
     'DownloadTask',
+    'SmallObjectTask',
+    'DownloadJob',
 ]
 
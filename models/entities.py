@@ -1,8 +1,9 @@
 """
 数据实体类定义
 """
+import os
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Optional, Tuple
 
 
 @dataclass
@@ -16,6 +17,8 @@ class VideoData:
     cover_url: str = field(default="")
     media_type: str = field(default="video")
     formats: List[str] = field(default_factory=list)
+    post_id: str = field(default="")
+    index: int = field(default=0)
     
     @property
     def is_encrypted(self) -> bool:
@@ -48,3 +51,37 @@ class DownloadTask:
             return 0.0
         total = self.end - self.start + 1
         return self.downloaded / total if total > 0 else 0.0
+
+
+@dataclass
+class SmallObjectTask:
+    """小文件下载任务实体（图片、封面）"""
+    url: str = field(default_factory=str)
+    save_path: str = field(default_factory=str)
+    decode_key: str = field(default="")
+
+
+@dataclass
+class DownloadJob:
+    """下载流水线中的任务实体"""
+    job_id: int = field(default_factory=int)
+    video_data: VideoData = field(default_factory=VideoData)
+    filepath: str = field(default="")
+    temp_path: str = field(default="")
+    group_size: int = field(default=1)
+    attempts: int = field(default=0)
+    deferred: int = field(default=0)
+    expected_size: int = field(default=0)
+    decrypted: bool = field(default=False)
+    resume_ranges: List[Tuple[int, int]] = field(default_factory=list)
+    hasher: Optional[object] = field(default=None)
+    # 控制接口：优先级越大越先下载；所在阶段及是否正在处理；暂停 / 取消标记
+    priority: int = field(default=0)
+    stage: str = field(default="")
+    running: bool = field(default=False)
+    paused: bool = field(default=False)
+    cancelled: bool = field(default=False)
+    
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.filepath)
@@ -17,3 +17,10 @@ class NetworkError(CrawlerException):
 class UnhandledError(CrawlerException):
     """Exception raised for unhandled errors."""
     pass
+
+class ControlError(CrawlerException):
+    """Exception raised for invalid control API requests."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
@@ -1,10 +1,19 @@
 """工具模块"""
-from utils.config import config
-from utils.logger import logger, LoggerManager
+import importlib
 
-__all__ = [
-    'config',
-    'logger',
-    'LoggerManager',
-]
+# 名称 -> 所在模块，第一次访问时才导入（见 core/__init__.py）
+_exports = {
+    'config': 'utils.config',
+    'logger': 'utils.logger',
+    'LoggerManager': 'utils.logger',
+    'verify_mp4': 'utils.mp4',
+}
 
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module), name)
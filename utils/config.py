@@ -2,6 +2,7 @@
 统一配置管理模块
 """
 import os
+from typing import Optional, Tuple
 
 
 class Config:
@@ -33,10 +34,25 @@ class Config:
         config_dir = os.path.dirname(os.path.abspath(__file__))
         return os.path.join(os.path.dirname(config_dir), "logs")
 
+    @property
+    def log_enqueue(self) -> bool:
+        """终端日志是否交给后台线程输出（LOG_ENQUEUE=1），写日志的线程不再等待终端"""
+        return os.getenv("LOG_ENQUEUE", "0") == "1"
+
+    @property
+    def log_json(self) -> bool:
+        """是否同时输出 JSON Lines 格式的日志文件（LOG_JSON=1），每行带任务编号"""
+        return os.getenv("LOG_JSON", "0") == "1"
+
+    @property
+    def log_sample_interval(self) -> float:
+        """下载进度等重复日志的最小间隔（LOG_SAMPLE_INTERVAL 秒，0 为不限制）"""
+        return float(os.getenv("LOG_SAMPLE_INTERVAL", "0"))
+
     @property
     def download_dir(self) -> str:
-        """下载目录（微信视频默认保存位置）"""
-        download_dir = os.path.join(self.log_dir, "downloads")
+        """下载目录（SAVE_DIR，由 main.py -d 设置；默认为 logs/downloads）"""
+        download_dir = os.getenv("SAVE_DIR") or os.path.join(self.log_dir, "downloads")
         os.makedirs(download_dir, exist_ok=True)
         return download_dir
     
@@ -45,5 +61,119 @@ class Config:
         """默认代理端口"""
         return 8899
 
+    @property
+    def proxy_workers(self) -> int:
+        """代理进程数（PROXY_WORKERS），多个代理进程监听连续的端口，共用一个下载服务"""
+        return max(1, int(os.getenv("PROXY_WORKERS", "1")))
+
+    @property
+    def worker_name(self) -> str:
+        """当前代理进程的名字（PROXY_WORKER），多个代理进程时由 main.py 设置"""
+        return os.getenv("PROXY_WORKER", "")
+
+    @property
+    def service_address(self) -> Optional[Tuple[str, int]]:
+        """独立下载服务进程的地址（DOWNLOAD_SERVICE=host:port），未设置时在代理进程内下载"""
+        value = os.getenv("DOWNLOAD_SERVICE", "")
+        if not value:
+            return None
+        host, port = value.rsplit(':', 1)
+        return host, int(port)
+
+    @property
+    def service_authkey(self) -> bytes:
+        """下载服务 IPC 的认证密钥（DOWNLOAD_SERVICE_KEY），由 main.py 随机生成"""
+        return os.getenv("DOWNLOAD_SERVICE_KEY", "").encode()
+
+    @property
+    def control_token(self) -> str:
+        """
+        控制接口和指标的访问令牌（CONTROL_TOKEN）；未设置时只响应本机（回环地址）的客户端，
+        设置后其他设备带上 X-Control-Token 请求头也可以访问
+        """
+        return os.getenv("CONTROL_TOKEN", "")
+
+    @property
+    def coalesce_window(self) -> float:
+        """同一媒体重复上报的合并窗口（秒）"""
+        return float(os.getenv("COALESCE_WINDOW", "0.3"))
+
+    @property
+    def stage_workers(self) -> dict:
+        """
+        下载流水线各阶段线程数，可用 STAGE_WORKERS=fetch=4,decrypt=2 覆盖
+        """
+        workers = {'discover': 1, 'fetch': 4, 'decrypt': 1, 'verify': 1, 'finalize': 1}
+        for item in os.getenv("STAGE_WORKERS", "").split(','):
+            if '=' in item:
+                name, count = item.split('=', 1)
+                workers[name.strip()] = int(count)
+        return workers
+
+    @property
+    def stage_queue_size(self) -> int:
+        """下载流水线各阶段的队列长度"""
+        return int(os.getenv("STAGE_QUEUE_SIZE", "16"))
+
+    @property
+    def bandwidth_limit(self) -> int:
+        """所有下载共用的限速（BANDWIDTH_LIMIT_KB，KB/s，0 为不限速），运行中可通过控制接口调整"""
+        return int(os.getenv("BANDWIDTH_LIMIT_KB", "0")) * 1024
+
+    @property
+    def small_object_threshold(self) -> int:
+        """小于等于该大小（字节）的媒体走小文件下载，不分段"""
+        return int(os.getenv("SMALL_OBJECT_THRESHOLD", str(2 * 1024 * 1024)))
+
+    @property
+    def small_object_workers(self) -> int:
+        """小文件并发下载数"""
+        return int(os.getenv("SMALL_OBJECT_WORKERS", "16"))
+
+    @property
+    def faststart(self) -> bool:
+        """下载完成后是否把 MP4 的 moov 移到文件开头"""
+        return os.getenv("FASTSTART", "0") == "1"
+
+    @property
+    def content_store(self) -> bool:
+        """是否按内容哈希去重保存（文件名为指向 .objects 的链接）"""
+        return os.getenv("CONTENT_STORE", "0") == "1"
+
+    @property
+    def link_mode(self) -> str:
+        """内容存储的链接方式：hardlink 或 symlink"""
+        return os.getenv("LINK_MODE", "hardlink")
+
+    @property
+    def shard_mode(self) -> str:
+        """子目录划分方式：none、date（按日期）、hash（按文件名哈希前缀）"""
+        return os.getenv("SHARD_MODE", "none")
+
+    @property
+    def min_free_space(self) -> int:
+        """下载目录所在磁盘至少保留的剩余空间（MIN_FREE_MB，默认 512MB），不足时任务延后"""
+        return int(os.getenv("MIN_FREE_MB", "512")) * 1024 * 1024
+
+    @property
+    def download_covers(self) -> bool:
+        """是否同时下载视频封面"""
+        return os.getenv("DOWNLOAD_COVERS", "1") != "0"
+
+    @property
+    def passive_capture(self) -> bool:
+        """是否捕获客户端自己播放的视频流量，减少重复下载"""
+        return os.getenv("PASSIVE_CAPTURE", "1") != "0"
+
+    @property
+    def stream_passthrough(self) -> bool:
+        """不需要改写的响应是否直接流式转发"""
+        return os.getenv("STREAM_PASSTHROUGH", "1") != "0"
+
+    @property
+    def intercept_mode(self) -> str:
+        """拦截模式：selective 只解密微信相关域名，all 解密全部"""
+        return os.getenv("INTERCEPT_MODE", "selective")
+
 
 config = Config()
@@ -0,0 +1,88 @@
+"""
+启动耗时分析
+安装后记录之后导入的每个模块的耗时（自身 / 含子模块），代理就绪时输出最慢的模块，
+便于发现启动变慢的回归；只依赖标准库，需要在其他模块导入之前安装
+
+启用: python main.py --profile-startup（子进程通过 STARTUP_PROFILE=1 继承）
+"""
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+ENV_NAME = "STARTUP_PROFILE"
+
+
+class ImportProfiler:
+    """sys.meta_path 上的查找器：把找到的 loader.exec_module 包一层计时，本身不加载模块"""
+
+    def __init__(self):
+        # 模块名 -> (自身耗时, 含子模块耗时)，单位秒
+        self.records: Dict[str, Tuple[float, float]] = {}
+        self.local = threading.local()
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        # 内置 / 冻结模块的 loader 是类本身，不计时
+        loader = spec.loader
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, 'exec_module'):
+            loader.exec_module = self._timed(fullname, loader.exec_module)
+        return spec
+
+    def _timed(self, fullname: str, exec_module):
+        def exec_module_timed(module):
+            stack = self.local.__dict__.setdefault('stack', [])
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                total = time.perf_counter() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += total
+                self.records[fullname] = (total - children, total)
+        return exec_module_timed
+
+    def report(self, limit: int = 15) -> List[str]:
+        """按自身耗时排序的最慢模块"""
+        records = sorted(self.records.items(), key=lambda item: item[1][0], reverse=True)
+        total = sum(own for own, _ in self.records.values())
+        lines = [f"⏱️导入 {len(self.records)} 个模块，共 {total * 1000:.0f}ms（自身 / 含子模块）:"]
+        for name, (own, cumulative) in records[:limit]:
+            lines.append(f"   {own * 1000:7.1f}ms {cumulative * 1000:8.1f}ms  {name}")
+        return lines
+
+
+profiler: Optional[ImportProfiler] = None
+
+
+def install() -> ImportProfiler:
+    """安装到 sys.meta_path 最前面，并让子进程继承"""
+    global profiler
+    if profiler is None:
+        profiler = ImportProfiler()
+        sys.meta_path.insert(0, profiler)
+        os.environ[ENV_NAME] = "1"
+    return profiler
+
+
+def install_from_env() -> Optional[ImportProfiler]:
+    """STARTUP_PROFILE=1 时安装"""
+    if os.getenv(ENV_NAME) == "1":
+        return install()
+    return None
+
+
+def report(limit: int = 15) -> List[str]:
+    """未启用时返回空列表"""
+    return profiler.report(limit) if profiler else []
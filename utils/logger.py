@@ -1,11 +1,13 @@
 """
 统一日志配置模块
 """
+import json
 import os
 import sys
+import time
 from datetime import datetime
-
-from loguru import logger
+from threading import Lock
+from typing import Dict, Optional
 
 from utils.config import config
 
@@ -28,6 +30,8 @@ class LoggerManager:
 
     @staticmethod
     def _setup_logger():
+        from loguru import logger
+
         log_dir = config.log_dir
         os.makedirs(log_dir, exist_ok=True)
         logger.remove()
@@ -37,7 +41,7 @@ class LoggerManager:
             format="<green>{time:HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <level>{message}</level>",
             level="INFO",
             colorize=True,
-            enqueue=False
+            enqueue=config.log_enqueue
         )
 
         current_date = datetime.now().strftime("%Y-%m-%d")
@@ -48,13 +52,112 @@ class LoggerManager:
             level="DEBUG",
             retention="7 days",
             encoding="utf-8",
-            enqueue=True
+            enqueue=True,
+            delay=True
         )
 
+        if config.log_json:
+            logger.add(
+                sink=os.path.join(log_dir, f"{current_date}.jsonl"),
+                format=LoggerManager._json_format,
+                level="DEBUG",
+                retention="7 days",
+                encoding="utf-8",
+                enqueue=True,
+                delay=True
+            )
+
+    @staticmethod
+    def _json_format(record) -> str:
+        """每条日志一行 JSON；bind / contextualize 的字段（如 job）原样带上"""
+        extra = {key: value for key, value in record["extra"].items() if key != "json"}
+        record["extra"]["json"] = json.dumps({
+            "time": record["time"].isoformat(),
+            "level": record["level"].name,
+            "message": record["message"],
+            "module": record["name"],
+            "function": record["function"],
+            "line": record["line"],
+            "thread": record["thread"].name,
+            **extra,
+        }, ensure_ascii=False, default=str)
+        return "{extra[json]}\n"
+
     @staticmethod
     def get_logger():
+        from loguru import logger
+
+        LoggerManager()
         return logger
 
 
-logger_manager = LoggerManager()
-__all__ = ['LoggerManager', 'logger_manager', 'logger']
+class LazyLogger:
+    """
+    loguru 的代理：第一次写日志时才导入 loguru 并配置输出，
+    只导入模块、不写日志时（如 --help）不付出这部分启动开销
+    """
+
+    def __getattr__(self, name):
+        value = getattr(LoggerManager.get_logger(), name)
+        # 之后直接命中实例属性，不再经过 __getattr__
+        setattr(self, name, value)
+        return value
+
+
+logger = LazyLogger()
+
+
+class LogThrottle:
+    """
+    热点路径上重复出现的日志限频：同一个 key 在 interval 秒内只输出一次，
+    被跳过的条数在下一次输出时返回，调用方可以附在消息里
+    """
+
+    def __init__(self, interval: Optional[float] = None):
+        """
+        Args:
+            interval: 最小间隔（秒），小于等于 0 时不限制；None 时使用 config.log_sample_interval
+        """
+        self._interval = interval
+        self.last: Dict[str, float] = {}
+        self.skipped: Dict[str, int] = {}
+        self.lock = Lock()
+
+    @property
+    def interval(self) -> float:
+        return config.log_sample_interval if self._interval is None else self._interval
+
+    def allow(self, key: str, force: bool = False) -> Optional[int]:
+        """
+        Returns:
+            允许输出时返回此前跳过的条数，需要跳过时返回 None
+        """
+        interval = self.interval
+        if interval <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last.get(key, -interval) < interval:
+                self.skipped[key] = self.skipped.get(key, 0) + 1
+                return None
+            self.last[key] = now
+            return self.skipped.pop(key, 0)
+
+    def forget(self, key: str) -> None:
+        """任务结束后清理"""
+        with self.lock:
+            self.last.pop(key, None)
+            self.skipped.pop(key, None)
+
+
+# 下载进度、m3u8 片段进度共用
+progress_throttle = LogThrottle()
+
+
+def __getattr__(name):
+    if name == 'logger_manager':
+        return LoggerManager()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ['LoggerManager', 'logger_manager', 'logger', 'LogThrottle', 'progress_throttle']
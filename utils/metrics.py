@@ -0,0 +1,145 @@
+"""
+运行指标
+Prometheus 文本格式（0.0.4）的计数器、直方图和按需计算的指标，只依赖标准库；
+计数直接在字典上累加，不加锁（依赖 GIL，极少数并发累加可能丢失），
+下载的字节数不在读数据的循环里累加，而是导出时从进行中的下载器读取
+"""
+import bisect
+from typing import Callable, Dict, Iterable, List, Tuple
+
+PREFIX = "wechat_downloader_"
+
+# 耗时直方图默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """只增不减的计数"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labels = labels
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """分桶统计（耗时等）"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各桶计数（不累计）..., +Inf 桶, 总和]
+        self.values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Collected:
+    """导出时才计算的指标（队列深度、进行中的下载等），collect 返回 [(标签值, 数值)]"""
+
+    def __init__(self, name: str, help_text: str, kind: str,
+                 collect: Callable[[], Iterable[Tuple[LabelKey, float]]], labels: Tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.kind = kind
+        self.collect = collect
+        self.labels = labels
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self.collect():
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """本进程的全部指标"""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def collected(self, name: str, help_text: str, collect: Callable, labels: Tuple[str, ...] = (),
+                  kind: str = 'gauge') -> Collected:
+        """同名的重新注册时替换（例如重新创建的流水线）"""
+        metric = Collected(name, help_text, kind, collect, labels)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def _register(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {name} 导出失败: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
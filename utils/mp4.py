@@ -0,0 +1,236 @@
+"""
+MP4 结构校验
+只读取顶层 box 的头部（每个 8 或 16 字节），按 box 大小 seek 到下一个，
+不读取 box 内容，几 GB 的文件也只需要几次 seek
+"""
+import os
+import struct
+from typing import List, Optional, Tuple
+
+# 必须出现的顶层 box
+REQUIRED_BOXES = (b'ftyp', b'moov', b'mdat')
+
+
+def read_top_level_boxes(path: str, max_boxes: int = 1024) -> List[Tuple[bytes, int, int]]:
+    """
+    读取顶层 box 列表
+
+    Returns:
+        [(类型, 偏移, 大小)]
+
+    Raises:
+        ValueError: box 头部不合法或超出文件末尾（文件被截断）
+    """
+    file_size = os.path.getsize(path)
+    boxes = []
+
+    with open(path, 'rb') as f:
+        offset = 0
+        while offset < file_size:
+            if len(boxes) >= max_boxes:
+                raise ValueError(f"顶层 box 数量超过 {max_boxes}")
+
+            f.seek(offset)
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"偏移 {offset} 处 box 头部不完整")
+
+            size, box_type = struct.unpack('>I4s', header)
+            if not all(32 <= c < 127 for c in box_type):
+                raise ValueError(f"偏移 {offset} 处 box 类型不合法: {box_type!r}")
+
+            header_size = 8
+            if size == 1:
+                large = f.read(8)
+                if len(large) < 8:
+                    raise ValueError(f"偏移 {offset} 处 box 头部不完整")
+                size = struct.unpack('>Q', large)[0]
+                header_size = 16
+            elif size == 0:
+                size = file_size - offset
+
+            if size < header_size:
+                raise ValueError(f"偏移 {offset} 处 box 大小不合法: {size}")
+            if offset + size > file_size:
+                raise ValueError(
+                    f"{box_type.decode()} 超出文件末尾（需要 {offset + size} 字节，实际 {file_size}），文件可能被截断"
+                )
+
+            boxes.append((box_type, offset, size))
+            offset += size
+
+    return boxes
+
+
+def verify_mp4(path: str) -> Optional[str]:
+    """
+    校验 MP4 顶层结构：第一个 box 是 ftyp，包含 moov 和 mdat，box 正好铺满整个文件
+
+    Returns:
+        None 表示通过，否则为错误原因
+    """
+    try:
+        boxes = read_top_level_boxes(path)
+    except (OSError, ValueError) as e:
+        return str(e)
+
+    if not boxes:
+        return "文件为空"
+    if boxes[0][0] != b'ftyp':
+        return f"第一个 box 不是 ftyp（{boxes[0][0]!r}），可能解密失败"
+
+    types = {box_type for box_type, _, _ in boxes}
+    missing = [box_type.decode() for box_type in REQUIRED_BOXES if box_type not in types]
+    if missing:
+        return f"缺少 {', '.join(missing)}"
+    return None
+
+
+# 需要递归进入的容器 box（到 stco / co64 所在的 stbl 为止）
+CONTAINER_BOXES = (b'moov', b'trak', b'mdia', b'minf', b'stbl')
+
+COPY_CHUNK = 64 * 1024 * 1024
+
+
+def _parse_boxes(data: bytes) -> list:
+    """把 moov 内容解析成 [类型, 内容或子 box 列表] 的树"""
+    boxes = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header_size or offset + size > len(data):
+            raise ValueError(f"{box_type!r} 大小不合法")
+
+        payload = data[offset + header_size:offset + size]
+        if box_type in CONTAINER_BOXES:
+            boxes.append([box_type, _parse_boxes(payload)])
+        else:
+            boxes.append([box_type, payload])
+        offset += size
+    return boxes
+
+
+def _serialize_boxes(boxes: list) -> bytes:
+    parts = []
+    for box_type, content in boxes:
+        payload = _serialize_boxes(content) if isinstance(content, list) else content
+        if len(payload) + 8 > 0xFFFFFFFF:
+            parts.append(struct.pack('>I4sQ', 1, box_type, len(payload) + 16))
+        else:
+            parts.append(struct.pack('>I4s', len(payload) + 8, box_type))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def _chunk_offset_boxes(boxes: list):
+    """遍历所有 stco / co64 box"""
+    for box in boxes:
+        if isinstance(box[1], list):
+            yield from _chunk_offset_boxes(box[1])
+        elif box[0] in (b'stco', b'co64'):
+            yield box
+
+
+def _read_chunk_offsets(box: list) -> List[int]:
+    box_type, payload = box
+    count = struct.unpack_from('>I', payload, 4)[0]
+    fmt = '>%dI' if box_type == b'stco' else '>%dQ'
+    return list(struct.unpack_from(fmt % count, payload, 8))
+
+
+def _write_chunk_offsets(box: list, offsets: List[int]) -> None:
+    """写回偏移；超过 32 位时把 stco 升级为 co64"""
+    if box[0] == b'stco' and offsets and max(offsets) > 0xFFFFFFFF:
+        box[0] = b'co64'
+    fmt = '>%dI' if box[0] == b'stco' else '>%dQ'
+    box[1] = box[1][:8] + struct.pack(fmt % len(offsets), *offsets)
+
+
+def _copy_range(src_fd: int, dst_fd: int, offset: int, count: int) -> None:
+    """在内核中复制 [offset, offset + count)，数据不经过用户态"""
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    while count > 0:
+        try:
+            if copy_file_range:
+                copied = copy_file_range(src_fd, dst_fd, min(count, COPY_CHUNK), offset)
+            else:
+                copied = os.sendfile(dst_fd, src_fd, offset, min(count, COPY_CHUNK))
+        except OSError:
+            # 跨文件系统等不支持的情况，退回到普通读写
+            copy_file_range = None
+            data = os.pread(src_fd, min(count, COPY_CHUNK), offset)
+            copied = os.write(dst_fd, data) if data else 0
+        if copied <= 0:
+            raise OSError(f"复制在偏移 {offset} 处中断")
+        offset += copied
+        count -= copied
+
+
+def faststart(src: str, dst: str) -> bool:
+    """
+    把 moov 移到文件开头（紧跟 ftyp），并修正 stco / co64 中的 chunk 偏移
+
+    只有 moov 会读入内存，mdat 等其他 box 通过 copy_file_range / sendfile 在内核中复制，
+    内存占用与文件大小无关
+
+    Returns:
+        True 表示已生成 dst；False 表示不需要处理（moov 已在 mdat 之前）或不支持（压缩的 moov）
+
+    Raises:
+        ValueError: 文件结构不合法
+    """
+    boxes = read_top_level_boxes(src)
+    types = [box_type for box_type, _, _ in boxes]
+    if b'moov' not in types or b'mdat' not in types or types[0] != b'ftyp':
+        raise ValueError("缺少 ftyp / moov / mdat")
+    if types.index(b'moov') < types.index(b'mdat'):
+        return False
+
+    _, moov_offset, moov_size = boxes[types.index(b'moov')]
+    with open(src, 'rb') as f:
+        f.seek(moov_offset)
+        moov = _parse_boxes(f.read(moov_size))[0]
+    if any(box_type == b'cmov' for box_type, _ in moov[1]):
+        return False
+
+    chunk_boxes = list(_chunk_offset_boxes([moov]))
+    original = [_read_chunk_offsets(box) for box in chunk_boxes]
+    insert_at = boxes[0][2]
+    moov_end = moov_offset + moov_size
+
+    # stco 升级为 co64 会让 moov 变大，重新计算直到大小稳定
+    new_size = moov_size
+    while True:
+        for box, offsets in zip(chunk_boxes, original):
+            _write_chunk_offsets(box, [
+                o + new_size if insert_at <= o < moov_offset else
+                o - moov_size + new_size if o >= moov_end else o
+                for o in offsets
+            ])
+        moov_data = _serialize_boxes([moov])
+        if len(moov_data) == new_size:
+            break
+        new_size = len(moov_data)
+
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            _copy_range(src_fd, dst_fd, 0, insert_at)
+            view = memoryview(moov_data)
+            while view:
+                view = view[os.write(dst_fd, view):]
+            for box_type, offset, size in boxes[1:]:
+                if box_type != b'moov':
+                    _copy_range(src_fd, dst_fd, offset, size)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    return True